@@ -1,17 +1,9 @@
-from .runtime import (
-    FaasitRuntime, 
-    FaasitResult,
-    createFaasitRuntimeMetadata,
-    FaasitRuntimeMetadata,
-    load_runtime
-)
-from .utils import (
-    get_function_container_config,
-    callback,
-)
-from .workflow import Workflow,Route,RouteBuilder,RouteRunner,WorkflowContext
-from typing import Callable, Any
+from typing import Callable, Any, TYPE_CHECKING
+import importlib
 import inspect
+# imported eagerly so that the `workflow` decorator below replaces the
+# subpackage attribute, route itself does not import the runtime
+from .workflow.route import RouteBuilder
 from ._private import (
     FunctionConfig,
     LocalFunction,
@@ -23,13 +15,61 @@ from ._private import (
     Function
 )
 
-type_Function = Callable[[Any], FaasitResult]
+# The runtime models need pydantic and the workflow engine imports the
+# runtime, both are resolved on first access (PEP 562) so that importing the
+# package for its decorators stays cheap.
+_lazy_imports = {
+    "FaasitRuntime": ".runtime",
+    "FaasitResult": ".runtime",
+    "createFaasitRuntimeMetadata": ".runtime",
+    "FaasitRuntimeMetadata": ".runtime",
+    "load_runtime": ".runtime",
+    "get_function_container_config": ".utils.config",
+    "reload_function_container_config": ".utils.config",
+    "callback": ".utils",
+    "Workflow": ".workflow.workflow",
+    "Route": ".workflow.route",
+    "RouteRunner": ".workflow.route",
+    "WorkflowContext": ".workflow.context",
+    "Shuffle": ".shuffle",
+}
+
+if TYPE_CHECKING:
+    from .runtime import (
+        FaasitRuntime,
+        FaasitResult,
+        createFaasitRuntimeMetadata,
+        FaasitRuntimeMetadata,
+        load_runtime
+    )
+    from .utils import (
+        get_function_container_config,
+        reload_function_container_config,
+        callback,
+    )
+    from .workflow import Workflow,Route,RouteRunner,WorkflowContext
+    from .shuffle import Shuffle
+
+def __getattr__(name: str):
+    module = _lazy_imports.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_imports))
+
+type_Function = Callable[[Any], 'FaasitResult']
 
 def transformfunction(fn: type_Function) -> type_Function:
+    from .runtime import FaasitRuntime, createFaasitRuntimeMetadata, load_runtime
+    from .utils.config import get_function_container_config
     containerConf = get_function_container_config()
     provider = containerConf['provider']
     if provider == 'local':
-        def local_function(event,metadata:FaasitRuntimeMetadata = None) -> FaasitResult:
+        def local_function(event,metadata:'FaasitRuntimeMetadata' = None) -> 'FaasitResult':
             LocalRuntime = load_runtime('local')
             frt = LocalRuntime(event,metadata)
             return fn(frt)
@@ -41,7 +81,7 @@ def transformfunction(fn: type_Function) -> type_Function:
             return fn(frt)
         return aliyun_function
     elif provider == 'knative':
-        def kn_function(event,metadata: FaasitRuntimeMetadata=None) -> FaasitResult:
+        def kn_function(event,metadata: 'FaasitRuntimeMetadata'=None) -> 'FaasitResult':
             KnativeRuntime = load_runtime('knative')
             frt = KnativeRuntime(event)
             return fn(frt)
@@ -51,7 +91,7 @@ def transformfunction(fn: type_Function) -> type_Function:
     elif provider == 'local-once':
         def localonce_function(event, 
                             workflow_runner = None,
-                            metadata: FaasitRuntimeMetadata = None
+                            metadata: 'FaasitRuntimeMetadata' = None
                             ):
             LocalOnceRuntime = load_runtime('local-once')
             if metadata is None:
@@ -73,6 +113,7 @@ routeBuilder = RouteBuilder()
 
 def durable(*args, **kwargs) -> Function:
     def __durable(fn) -> Function:
+        from .utils.config import get_function_container_config
         config = get_function_container_config()
         provider = kwargs.get('provider', config['provider'])
         fn_name = kwargs.get('name', fn.__name__)
@@ -92,6 +133,7 @@ def durable(*args, **kwargs) -> Function:
 def function(*args, **kwargs) -> Function:
 
     def __function(fn) -> Function:
+        from .utils.config import get_function_container_config
         config = get_function_container_config()
         provider = kwargs.get('provider', config['provider'])
         fn_name = kwargs.get('name', fn.__name__)
@@ -115,7 +157,9 @@ def function(*args, **kwargs) -> Function:
             assert func_cls != None, "wrapper is required for custom runtime"
             assert issubclass(func_cls, Function), "wrapper must be subclass of Function"
             func = func_cls(fn, fn_config)
-        routeBuilder.func(fn_name).set_handler(func.export())
+        route_func = routeBuilder.func(fn_name)
+        route_func.set_handler(func.export())
+        route_func.local_call = kwargs.get('local_call')
         return func
     if len(args) == 1 and len(kwargs) == 0:
         fn = args[0]
@@ -124,13 +168,16 @@ def function(*args, **kwargs) -> Function:
         return __function
         
 
-def workflow(*args, **kwargs) -> WorkflowContext:
-    def __workflow(fn) -> WorkflowContext:
+def workflow(*args, **kwargs) -> 'WorkflowContext':
+    def __workflow(fn) -> 'WorkflowContext':
+        from .utils.config import get_function_container_config
+        from .workflow.workflow import Workflow
+        from .workflow.context import WorkflowContext
         config = get_function_container_config()
         provider = kwargs.get('provider', config['provider'])
         executor_cls = kwargs.get('executor')
         route = routeBuilder.build()
-        def generate_workflow(rt: FaasitRuntime) -> Workflow:
+        def generate_workflow(rt: 'FaasitRuntime') -> 'Workflow':
             wf = Workflow(route,fn.__name__)
             if executor_cls != None:
                 wf.setExecutor(executor_cls)
@@ -138,8 +185,9 @@ def workflow(*args, **kwargs) -> WorkflowContext:
             r  = fn(wf)
             wf.end_with(r)
             return wf
-        routeBuilder.workflow(fn.__name__).set_workflow(generate_workflow)
-        return WorkflowContext(generate_workflow, provider, route)
+        context = WorkflowContext(generate_workflow, provider, route)
+        routeBuilder.workflow(fn.__name__).set_workflow(generate_workflow, context)
+        return context
 
     if len(args) == 1 and len(kwargs) == 0:
         fn = args[0]
@@ -155,7 +203,14 @@ def recursive(fn):
         return fn
     return Y(helper)
 
-def create_handler(fn_or_workflow : Function | WorkflowContext):
+def create_handler(fn_or_workflow : 'Function | WorkflowContext'):
+    if isinstance(fn_or_workflow, Function):
+        # the runtime and the workflow engine are only needed for workflows
+        return fn_or_workflow.export()
+    from .runtime import load_runtime
+    from .utils.config import get_function_container_config
+    from .workflow.route import RouteRunner
+    from .workflow.context import WorkflowContext
     container_conf = get_function_container_config()
     if isinstance(fn_or_workflow, WorkflowContext):
         workflow_ctx = fn_or_workflow
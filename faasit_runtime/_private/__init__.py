@@ -1,3 +1,4 @@
+import inspect
 class FunctionConfig:
     def __init__(self, *args, **options):
         pass
@@ -50,6 +51,12 @@ class KnativeFunction(Function):
         super().__init__(fn, config)
     def _transformfunction(self, fn):
         from faasit_runtime.serverless_function import Metadata
+        if inspect.iscoroutinefunction(fn):
+            async def kn_async_function(md: Metadata):
+                from ..runtime.kn_runtime import KnativeRuntime
+                rt = KnativeRuntime(md, async_storage=True)
+                return await fn(rt)
+            return kn_async_function
         def kn_function(md: Metadata):
             from ..runtime.kn_runtime import KnativeRuntime
             rt = KnativeRuntime(md)
@@ -66,12 +73,7 @@ class LocalOnceFunction(Function):
             from ..runtime.local_once_runtime import LocalOnceRuntime
             from faasit_runtime import routeBuilder
             route = routeBuilder.build()
-            route_dict = {}
-            for function in route.functions:
-                route_dict[function.name] = function.handler
-            for workflow in route.workflows:
-                route_dict[workflow.name] = function.handler
-            metadata = Metadata(str(uuid.uuid4()), data, None, route_dict, 'invoke', None)
+            metadata = Metadata(str(uuid.uuid4()), data, None, route.table, 'invoke', None)
             rt = LocalOnceRuntime(metadata)
             result = fn(rt)
             return result
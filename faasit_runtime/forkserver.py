@@ -0,0 +1,306 @@
+import os
+import gc
+import queue
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+from typing import Any, Callable
+from multiprocessing.connection import Connection
+
+from .utils.logging import log as logger
+
+# A zygote process is forked once the lambda and the runtime are imported.
+# It does nothing but fork pool processes on demand, so every pool process
+# starts with everything already imported and shares those pages with the
+# zygote copy-on-write. Pool processes connect back to the server through
+# a unix socket and answer one request at a time.
+#
+#   server --fork--> supervisor --fork--> zygote --fork--> pool process
+#   pool process --connect--> server
+#
+# The zygote is forked by a supervisor process, which is forked by `start`
+# while the server still has a single thread. The supervisor waits for the
+# zygote and forks a new one when it exits. Forking in the server later on
+# would copy a multi-threaded process, with locks held by threads that do
+# not exist in the child. Spawn requests go through a pipe the supervisor
+# keeps open, so those the old zygote did not read are served by the new
+# one. A zygote that exits right after it was started is not restarted,
+# the supervisor exits and invocations fail at once instead of waiting for
+# processes that will never come.
+
+# seconds a zygote has to stay up to be restarted when it exits
+_MIN_ZYGOTE_LIFETIME = 1.0
+
+_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT, signal.SIGUSR1, signal.SIGUSR2)
+
+
+class ForkServer:
+    """
+    Runs `target(request)` in processes forked from a pre-initialized zygote.
+    `pool_size` processes are kept ready, with `per_request` every process
+    exits after one request and the zygote forks a replacement while the
+    request is being served.
+
+    `start` must be called before the server starts any thread, forking a
+    multi-threaded process only copies the calling thread. The server does
+    not fork after that, a replacement zygote is forked by the supervisor.
+    With a `timeout` an invocation fails after that many seconds and the
+    process serving it is killed and replaced.
+    """
+    def __init__(self, target: Callable[[Any], Any], pool_size: int = 1, per_request: bool = False):
+        self.target = target
+        self.pool_size = max(1, pool_size)
+        self.per_request = per_request
+        self.spawned = 0
+        self.zygote_pid = None
+        self.restarts = 0
+        # (connection, pid) of the idle pool processes, None once the zygote is gone for good
+        self._idle: queue.Queue[tuple[Connection, int] | None] = queue.Queue()
+        self._spawn_lock = threading.Lock()
+        self._spawn_fd = None
+        # the supervisor writes the pid of every zygote it forks there
+        self._status = None
+        self._failure = None
+        self._closing = False
+        self._watcher = None
+        self._dir = None
+        self._address = None
+        self._sock = None
+
+    def start(self):
+        self._dir = tempfile.mkdtemp(prefix='faasit-forkserver-')
+        self._address = os.path.join(self._dir, 'forkserver.sock')
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self._address)
+        self._sock.listen(self.pool_size * 2)
+        self._start_supervisor()
+        threading.Thread(target=self._accept, daemon=True).start()
+        self._spawn(self.pool_size)
+        logger.info(f"Fork server started, zygote pid: {self.zygote_pid}, pool size: {self.pool_size}")
+
+    def _start_supervisor(self):
+        spawn_r, spawn_w = os.pipe()
+        status_r, status_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(spawn_w)
+            os.close(status_r)
+            self._sock.close()
+            try:
+                self._supervise(spawn_r, status_w)
+            finally:
+                os._exit(0)
+        os.close(spawn_r)
+        os.close(status_w)
+        self._spawn_fd = spawn_w
+        self._status = os.fdopen(status_r, 'rb')
+        line = self._status.readline()
+        self.zygote_pid = int(line) if line else None
+        self._watcher = threading.Thread(target=self._watch, args=(pid,), daemon=True)
+        self._watcher.start()
+
+    def _supervise(self, spawn_fd: int, status_fd: int):
+        for signum in _SIGNALS:
+            signal.signal(signum, signal.SIG_DFL)
+        # it exits with the server, when the spawn pipe closes, not when the
+        # process group is interrupted or terminated
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        while True:
+            started = time.monotonic()
+            pid = os.fork()
+            if pid == 0:
+                os.close(status_fd)
+                try:
+                    self._zygote(spawn_fd)
+                except Exception as e:
+                    logger.error(f"Fork server zygote failed: {e}")
+                    os._exit(1)
+                os._exit(0)
+            os.write(status_fd, f"{pid}\n".encode())
+            _, status = os.waitpid(pid, 0)
+            if status == 0 or os.WIFSIGNALED(status) and os.WTERMSIG(status) in (signal.SIGINT, signal.SIGTERM):
+                # the server closed the spawn pipe or is being shut down
+                return
+            if time.monotonic() - started < _MIN_ZYGOTE_LIFETIME:
+                logger.error(f"Fork server zygote {pid} exited right after start (status {status})")
+                os._exit(1)
+            logger.error(f"Fork server zygote {pid} exited (status {status}), starting a new one")
+
+    def _watch(self, pid: int):
+        # every pid after the first one is a restarted zygote
+        for line in self._status:
+            self.zygote_pid = int(line)
+            self.restarts += 1
+        _, status = os.waitpid(pid, 0)
+        self._status.close()
+        with self._spawn_lock:
+            if self._closing:
+                return
+            os.close(self._spawn_fd)
+            self._spawn_fd = None
+        if status == 0:
+            # the zygote was interrupted or terminated
+            self._fail(f"Fork server zygote {self.zygote_pid} was stopped", logger.info)
+        elif os.WIFEXITED(status) and os.WEXITSTATUS(status) == 1:
+            self._fail(f"Fork server zygote {self.zygote_pid} exited right after start")
+        else:
+            self._fail(f"Fork server supervisor {pid} exited (status {status})")
+
+    def _fail(self, reason: str, log: Callable[[str], Any] = logger.error):
+        log(reason)
+        self._failure = reason
+        # wakes every invocation waiting for a process, see invoke
+        self._idle.put(None)
+
+    def _zygote(self, spawn_fd: int):
+        for signum in _SIGNALS:
+            signal.signal(signum, signal.SIG_DFL)
+        # pool processes are not waited for, let the kernel reap them
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        # keep the collector from touching (and so copying) the imported objects
+        gc.freeze()
+        while True:
+            try:
+                data = os.read(spawn_fd, 64)
+            except InterruptedError:
+                continue
+            if not data:
+                # the server is gone
+                return
+            for _ in range(len(data)):
+                if os.fork() == 0:
+                    os.close(spawn_fd)
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    try:
+                        self._serve()
+                    finally:
+                        os._exit(0)
+
+    def _serve(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self._address)
+        conn = Connection(sock.detach())
+        conn.send(os.getpid())
+        while True:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                response = {'status': 'ok', 'data': self.target(request)}
+            except Exception as e:
+                logger.error(f"Failed to invoke the lambda function: {e}")
+                response = {'status': 'error', 'error': str(e)}
+            try:
+                conn.send(response)
+            except Exception as e:
+                conn.send({'status': 'error', 'error': f"Failed to send the result: {e}"})
+            if self.per_request:
+                return
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._sock.accept()
+            except OSError:
+                return
+            conn = Connection(sock.detach())
+            try:
+                pid = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                continue
+            self._idle.put((conn, pid))
+
+    def _spawn(self, n: int = 1):
+        with self._spawn_lock:
+            self.spawned += n
+            if self._spawn_fd is not None:
+                # otherwise the supervisor is gone, invocations fail
+                os.write(self._spawn_fd, b'\x01' * n)
+
+    def invoke(self, request: Any, timeout: float = None) -> Any:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            item = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No fork server process available")
+        if item is None:
+            self._idle.put(None)
+            raise RuntimeError(self._failure)
+        conn, pid = item
+        if self.per_request:
+            # fork the replacement while this request runs
+            self._spawn()
+        try:
+            conn.send(request)
+            answered = deadline is None or conn.poll(max(deadline - time.monotonic(), 0))
+            response = conn.recv() if answered else None
+        except (EOFError, OSError) as e:
+            conn.close()
+            if not self.per_request:
+                self._spawn()
+            raise RuntimeError(f"Fork server process exited: {e}")
+        if not answered:
+            # the process is stuck in the request, it cannot be reused
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            conn.close()
+            if not self.per_request:
+                self._spawn()
+            raise TimeoutError(f"Fork server process {pid} did not answer within {timeout}s")
+        if self.per_request:
+            conn.close()
+        else:
+            self._idle.put((conn, pid))
+        if response['status'] == 'error':
+            raise RuntimeError(response['error'])
+        return response['data']
+
+    def stats(self) -> dict:
+        return {
+            'pool_size': self.pool_size,
+            'per_request': self.per_request,
+            'idle': self._idle.qsize(),
+            'spawned': self.spawned,
+            'zygote_pid': self.zygote_pid,
+            'restarts': self.restarts,
+            'failure': self._failure,
+        }
+
+    def close(self):
+        with self._spawn_lock:
+            self._closing = True
+            if self._spawn_fd is not None:
+                # the zygote and then the supervisor exit when the pipe
+                # closes, idle processes when their connection does
+                os.close(self._spawn_fd)
+                self._spawn_fd = None
+        if self._watcher is not None:
+            # it reaps the supervisor
+            self._watcher.join()
+            self._watcher = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        while True:
+            try:
+                item = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[0].close()
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+
+
+__all__ = [
+    "ForkServer",
+]
@@ -1,21 +1,46 @@
 import time
 from faasit_runtime.runtime import FaasitRuntime
-from alibabacloud_fc_open20210406.client import Client as FC_Open20210406Client
-from alibabacloud_tea_openapi import models as open_api_models
-from alibabacloud_fc_open20210406 import models as fc__open20210406_models
-from alibabacloud_tea_util import models as util_models
-from alibabacloud_tea_util.client import Client as UtilClient
-from typing import Any, List
+from typing import Any, Iterable, Iterator, List
 import os
-import json
-import pickle
-from dotenv import load_dotenv,find_dotenv
+import ast
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from faasit_runtime.runtime.faasit_runtime import StorageMethods
-import oss2
+from faasit_runtime.utils.serializer import storage_serializer, get_serializer
+from faasit_runtime.utils.logging import log
+from faasit_runtime.storage.cache import cached
+
+# The Alibaba Cloud SDKs and oss2 are imported on first use, importing this
+# module should not cost a function that never calls them.
+
+# Objects larger than one part go through multipart upload and ranged
+# download, `oss_parallel` parts at a time. OSS needs parts of at least 100KB.
+oss_part_size = int(os.getenv('FAASIT_OSS_PART_SIZE', 8 * 1024 * 1024))
+oss_parallel = int(os.getenv('FAASIT_OSS_PARALLEL', 4))
+
+
+class ObjectChangedError(RuntimeError):
+    """An object read in parts was overwritten or deleted before its last part was read."""
+
+
+_env_loaded = False
+
+def load_env():
+    # 获取用户进程中的环境变量文件, only once since find_dotenv walks the filesystem
+    global _env_loaded
+    if _env_loaded:
+        return
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv(usecwd=True))
+    _env_loaded = True
 
-# 获取用户进程中的环境变量文件
-load_dotenv(find_dotenv(usecwd=True))
 def helper_invoke_aliyun_function(fnName: str, event: Any):
+    from alibabacloud_fc_open20210406.client import Client as FC_Open20210406Client
+    from alibabacloud_tea_openapi import models as open_api_models
+    from alibabacloud_fc_open20210406 import models as fc__open20210406_models
+    from alibabacloud_tea_util import models as util_models
+    load_env()
     config = open_api_models.Config(
         access_key_id=os.environ['ALIBABA_CLOUD_ACCESS_KEY_ID'],
         access_key_secret=os.environ['ALIBABA_CLOUD_ACCESS_KEY_SECRET']
@@ -28,24 +53,67 @@ def helper_invoke_aliyun_function(fnName: str, event: Any):
         read_timeout=100000
     )
     invoke_func_req = fc__open20210406_models.InvokeFunctionRequest(
-        body=UtilClient.to_bytes(event or {}),
+        body=get_serializer('json').dumps(event or {}),
     )
     return client.invoke_function_with_options('faasit', fnName, invoke_func_req, headers, runtime)
 
+def decode_payload(payload) -> Any:
+    """
+    Parse an event or invocation response body without copying it to str.
+    Bodies are JSON, the python literal fallback is kept for callers that
+    still send `str(dict)` and for handlers whose dict results the platform
+    returns via `str()`.
+    """
+    if not isinstance(payload, (bytes, bytearray, memoryview, str)):
+        return payload
+    try:
+        return get_serializer('json').loads(payload)
+    except ValueError:
+        pass
+    if not isinstance(payload, str):
+        try:
+            payload = bytes(payload).decode('utf-8')
+        except UnicodeDecodeError:
+            # neither JSON nor text, handed over as is (as LocalStorage.decode does)
+            return bytes(payload)
+    try:
+        return ast.literal_eval(payload)
+    except (ValueError, SyntaxError):
+        return payload
+
+def _rechunk(chunks: Iterable, size: int) -> Iterator[bytes]:
+    """Regroup bytes-like `chunks` into parts of `size` bytes, the last one may be shorter."""
+    buf = bytearray()
+    for chunk in chunks:
+        view = memoryview(chunk).cast('B')
+        while len(view):
+            if not buf and len(view) >= size:
+                yield bytes(view[:size])
+                view = view[size:]
+                continue
+            take = size - len(buf)
+            buf += view[:take]
+            view = view[take:]
+            if len(buf) == size:
+                yield bytes(buf)
+                buf = bytearray()
+    if buf:
+        yield bytes(buf)
+
 class AliyunRuntime(FaasitRuntime):
     name: str = 'aliyun'
     def __init__(self, arg0, arg1) -> None:
         super().__init__()
+        load_env()
         self.event = arg0
         self.context = arg1
-        self._storage = self.AliyunStorage()
+        self._input = None
+        self._storage = cached(self.AliyunStorage(), f"oss://{os.environ.get('ALIBABA_CLOUD_OSS_BUCKET_NAME')}")
 
     def input(self):
-        self.event = self.event.decode('utf-8')
-        self.event = self.event.replace("'", '"')
-        self.event = self.event.replace("True", "true")
-        print(self.event)
-        return json.loads(self.event)
+        if self._input is None:
+            self._input = decode_payload(self.event)
+        return self._input
 
     def output(self, data):
         return data
@@ -54,10 +122,8 @@ class AliyunRuntime(FaasitRuntime):
         result = helper_invoke_aliyun_function(fn_name, event)
         result = result.to_map()
         result = result['body']
-        print(result)
-        result = result.decode('utf-8')
-        result = result.replace("'", '"')
-        return json.loads(result)
+        log.debug(f"Response from function {fn_name}: {len(result)} bytes")
+        return decode_payload(result)
 
     def tell(self, fn_name:str, event: Any):
         self.call(fn_name, event)
@@ -67,29 +133,141 @@ class AliyunRuntime(FaasitRuntime):
         }
 
     class AliyunStorage(StorageMethods):
-        def __init__(self):
-            auth = oss2.Auth(os.environ['ALIBABA_CLOUD_ACCESS_KEY_ID'], 
-                            os.environ['ALIBABA_CLOUD_ACCESS_KEY_SECRET'])
-            endpoint = f'https://{os.environ["ALIBABA_CLOUD_OSS_REGION"]}.aliyuncs.com'
-            self.bucket = oss2.Bucket(auth, 
-                            endpoint, 
-                            os.environ['ALIBABA_CLOUD_OSS_BUCKET_NAME'])
+        """
+        Objects over one part are uploaded as parallel multipart uploads and
+        downloaded as parallel ranged GETs, the whole object is never held
+        twice. ALIBABA_CLOUD_OSS_ENDPOINT points the storage at another
+        OSS-compatible endpoint (e.g. a local stand-in), or pass `bucket`.
+        """
+        def __init__(self, bucket = None):
+            if bucket is None:
+                import oss2
+                load_env()
+                auth = oss2.Auth(os.environ['ALIBABA_CLOUD_ACCESS_KEY_ID'], 
+                                os.environ['ALIBABA_CLOUD_ACCESS_KEY_SECRET'])
+                endpoint = os.environ.get('ALIBABA_CLOUD_OSS_ENDPOINT') or f'https://{os.environ["ALIBABA_CLOUD_OSS_REGION"]}.aliyuncs.com'
+                bucket = oss2.Bucket(auth, 
+                                endpoint, 
+                                os.environ['ALIBABA_CLOUD_OSS_BUCKET_NAME'])
+            self.bucket = bucket
 
         def put(self, filename, data: bytes) -> None:
-            data = pickle.dumps(data)
-            res = self.bucket.put_object(filename, data)
-            if 200 <= res.resp.status < 300:
-                print(f"[storage put] Put data into {filename} successfully.")
-            else:
-                print(res)
+            self.put_stream(filename, storage_serializer().dump_parts(data))
 
         def get(self, filename, timeout = -1) -> bytes:
-            if not self.bucket.object_exists(filename):
+            data = self._read(filename)
+            if data is None:
                 return None
-            return str(pickle.loads(self.bucket.get_object(filename).read())).encode('utf-8')
+            return self.decode(data)
+
+        def get_raw(self, filename, timeout = -1) -> bytes | bytearray | None:
+            return self._read(filename)
+
+        def decode(self, data):
+            try:
+                return storage_serializer().loads(data)
+            except Exception:
+                return bytes(data)
+
+        def put_stream(self, filename: str, chunks: Iterable) -> None:
+            """Store the concatenation of `chunks`, at most `oss_parallel` parts are in memory."""
+            parts = _rechunk(chunks, oss_part_size)
+            first = next(parts, b'')
+            second = next(parts, None)
+            if second is None:
+                res = self.bucket.put_object(filename, first)
+                log.debug(f"[storage put] Put {len(first)} bytes into {filename}, status {res.status}")
+                return
+            upload_id = self.bucket.init_multipart_upload(filename).upload_id
+            try:
+                infos = []
+                pending = deque()
+                with ThreadPoolExecutor(oss_parallel) as pool:
+                    for number, part in enumerate(itertools.chain((first, second), parts), 1):
+                        if len(pending) >= oss_parallel:
+                            infos.append(pending.popleft().result())
+                        pending.append(pool.submit(self._upload_part, filename, upload_id, number, part))
+                    infos.extend(future.result() for future in pending)
+                self.bucket.complete_multipart_upload(filename, upload_id, infos)
+            except BaseException:
+                self.bucket.abort_multipart_upload(filename, upload_id)
+                raise
+            log.debug(f"[storage put] Put {len(infos)} parts into {filename}")
+
+        def get_stream(self, filename: str) -> Iterator[bytes] | None:
+            """The object's bytes in parts, fetched `oss_parallel` ranges ahead. None if it does not exist."""
+            first = self._get_part(filename, 0)
+            if first is None:
+                return None
+            return self._stream(filename, *first)
+
+        def _upload_part(self, filename: str, upload_id: str, number: int, data: bytes):
+            import oss2
+            res = self.bucket.upload_part(filename, upload_id, number, data)
+            return oss2.models.PartInfo(number, res.etag)
+
+        def _get_part(self, filename: str, start: int, etag: str = None) -> tuple[bytes, int, str] | None:
+            # one ranged GET instead of HEAD + GET, a missing object is NoSuchKey.
+            # Later ranges are pinned to the first one's ETag so an object
+            # overwritten mid-read fails instead of mixing versions.
+            import oss2
+            headers = {'If-Match': etag} if etag else None
+            try:
+                res = self.bucket.get_object(filename, byte_range=(start, start + oss_part_size - 1), headers=headers)
+            except oss2.exceptions.NoSuchKey:
+                return None
+            data = res.read()
+            content_range = res.headers.get('Content-Range')
+            if res.status == 206 and content_range:
+                total = int(content_range.rsplit('/', 1)[1])
+            else:
+                # the range was ignored (e.g. empty object), this is the whole object
+                total = start + len(data)
+            return data, total, res.etag
+
+        def _get_next_part(self, filename: str, start: int, etag: str) -> bytes:
+            # a later range of the object whose first range had `etag`
+            import oss2
+            try:
+                part = self._get_part(filename, start, etag)
+            except oss2.exceptions.PreconditionFailed:
+                part = None
+            if part is None:
+                raise ObjectChangedError(f"Object {filename} changed or was deleted during the read")
+            return part[0]
+
+        def _read(self, filename: str) -> bytes | bytearray | None:
+            first = self._get_part(filename, 0)
+            if first is None:
+                return None
+            data, total, etag = first
+            if total <= len(data):
+                return data
+            buf = bytearray(total)
+            buf[:len(data)] = data
+            def fetch(start):
+                part = self._get_next_part(filename, start, etag)
+                buf[start:start + len(part)] = part
+            with ThreadPoolExecutor(oss_parallel) as pool:
+                list(pool.map(fetch, range(len(data), total, oss_part_size)))
+            return buf
+
+        def _stream(self, filename: str, data: bytes, total: int, etag: str):
+            yield data
+            pending = deque()
+            with ThreadPoolExecutor(oss_parallel) as pool:
+                for start in range(len(data), total, oss_part_size):
+                    if len(pending) >= oss_parallel:
+                        yield pending.popleft().result()
+                    pending.append(pool.submit(self._get_next_part, filename, start, etag))
+                while pending:
+                    yield pending.popleft().result()
 
-        def list(self) -> List:
-            return [sbj.key for sbj in self.bucket.list_objects_v2().object_list]
+        def list(self, prefix: str = '', page_size: int = 1000) -> Iterator[str]:
+            # follows the continuation token, one ListObjectsV2 per page
+            import oss2
+            for obj in oss2.ObjectIteratorV2(self.bucket, prefix=prefix, max_keys=page_size):
+                yield obj.key
 
         def exists(self, filename: str) -> bool:
             return self.bucket.object_exists(filename)
@@ -97,7 +275,7 @@ class AliyunRuntime(FaasitRuntime):
         def delete(self, filename: str) -> None:
             if self.bucket.object_exists(filename):    
                 self.bucket.delete_object(filename)
-                print(f"[storage delete] Delete {filename} successfully.")
+                log.debug(f"[storage delete] Deleted {filename}")
             else:
-                print(f"[storage delete] {filename} is not exist.")
+                log.debug(f"[storage delete] {filename} does not exist")
                 
\ No newline at end of file
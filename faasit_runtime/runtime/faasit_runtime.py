@@ -1,7 +1,12 @@
 from abc import ABC, abstractmethod
-from typing import Any, Tuple, Awaitable, Union, Callable, List
+from typing import Any, Tuple, Awaitable, Union, Callable, List, AsyncIterator, Iterator, TYPE_CHECKING
 from pydantic import BaseModel, validator, ValidationError
+import asyncio
+import inspect
+import time
 import uuid
+if TYPE_CHECKING:
+    from faasit_runtime.shuffle import Shuffle
 
 class InvocationMetadata(BaseModel):
     class Caller(BaseModel):
@@ -72,8 +77,14 @@ class StorageMethods(ABC):
     def get(self, filename: str, timeout = -1) -> bytes:
         pass
 
-    def list(self) -> List:
-        pass
+    def list(self, prefix: str = '', page_size: int = 1000) -> Iterator[str]:
+        """
+        Lazily iterate over the keys starting with `prefix`, the backend is
+        asked for `page_size` keys at a time. Keys written or deleted while
+        iterating may or may not be seen, and a backend may return a key
+        more than once (Redis SCAN).
+        """
+        return iter(())
 
     def exists(self, filename: str) -> bool:
         pass
@@ -81,6 +92,91 @@ class StorageMethods(ABC):
     def delete(self, filename: str) -> None:
         pass
 
+    # Batched operations, backends that can answer them in fewer round trips
+    # override these, the defaults run the single operations one by one.
+    def mget(self, filenames: List[str]) -> List[Any]:
+        return [self.get(filename) for filename in filenames]
+
+    def mput(self, items: dict[str, Any]) -> None:
+        for filename, data in items.items():
+            self.put(filename, data)
+
+    def mdelete(self, filenames: List[str]) -> None:
+        for filename in filenames:
+            self.delete(filename)
+
+    def pipeline(self) -> 'StoragePipeline':
+        return StoragePipeline(self)
+
+    # The stored bytes of a value and their decoding, what `get` does in
+    # two steps. The storage cache keeps values as these bytes, every hit
+    # decodes a fresh copy.
+    def get_raw(self, filename: str, timeout = -1) -> bytes | None:
+        raise NotImplementedError(f"{type(self).__name__} cannot read stored bytes")
+
+    def mget_raw(self, filenames: List[str]) -> List[bytes | None]:
+        return [self.get_raw(filename) for filename in filenames]
+
+    def decode(self, data: bytes) -> Any:
+        raise NotImplementedError(f"{type(self).__name__} cannot decode stored bytes")
+
+    def wait_get(self, filename: str, timeout: float = None) -> Any:
+        """
+        Block until `filename` exists and return its value, or None after
+        `timeout` seconds (None waits forever). Backends that can be told
+        when a key is written override this, the default polls `exists`
+        with an increasing delay.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.001
+        while not self.exists(filename):
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        return self.get(filename)
+
+class StoragePipeline:
+    """
+    Queues put/get/delete on a storage, `execute` (or leaving the `with`
+    block) runs them and stores their results, in order, in `results`.
+    """
+    def __init__(self, storage: StorageMethods):
+        self._storage = storage
+        self._ops: list[tuple] = []
+        self.results: List | None = None
+
+    def put(self, filename: str, data) -> 'StoragePipeline':
+        self._ops.append(('put', filename, data))
+        return self
+
+    def get(self, filename: str) -> 'StoragePipeline':
+        self._ops.append(('get', filename))
+        return self
+
+    def delete(self, filename: str) -> 'StoragePipeline':
+        self._ops.append(('delete', filename))
+        return self
+
+    def _run(self, ops: list[tuple]) -> List:
+        return [getattr(self._storage, op)(*args) for op, *args in ops]
+
+    def execute(self) -> List:
+        ops, self._ops = self._ops, []
+        self.results = self._run(ops)
+        return self.results
+
+    def __enter__(self) -> 'StoragePipeline':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.execute()
+        self._ops = []
+
 class FaasitRuntime(ABC):
     def __init__(self) -> None:
         super().__init__()
@@ -117,12 +213,100 @@ class FaasitRuntime(ABC):
     def storage(self) -> StorageMethods:
         return self._storage
 
-    async def waitResults(self, tasks: list[Awaitable[CallResult]]):
+    def _blocking_storage(self) -> StorageMethods:
+        # storage with synchronous methods, for helpers that run in threads
+        return self.storage
+
+    def shuffle(self, name: str, num_partitions: int, **options) -> 'Shuffle':
+        """A shuffle named `name` over this runtime's storage, see `faasit_runtime.shuffle.Shuffle`."""
+        from faasit_runtime.shuffle import Shuffle
+        return Shuffle(self._blocking_storage(), name, num_partitions, **options)
+
+    @staticmethod
+    def _ensureTask(task, timeout: float = None) -> asyncio.Future:
+        # plain values (e.g. results of a synchronous `call`) count as already done
+        if not inspect.isawaitable(task):
+            fut = asyncio.get_running_loop().create_future()
+            fut.set_result(task)
+            return fut
+        if timeout is not None:
+            task = asyncio.wait_for(task, timeout)
+        return asyncio.ensure_future(task)
+
+    async def waitResults(self,
+                          tasks: list[Awaitable[CallResult]],
+                          return_when: str = asyncio.ALL_COMPLETED,
+                          timeout: float = None,
+                          task_timeout: float = None,
+                          return_exceptions: bool = False) -> list[CallResult]:
+        """
+        Run `tasks` concurrently and return their results in the order of `tasks`.
+
+        return_when: asyncio.ALL_COMPLETED, FIRST_COMPLETED or FIRST_EXCEPTION
+        timeout: overall seconds to wait, unfinished tasks are cancelled
+        task_timeout: seconds allowed for every single task
+        return_exceptions: put failures (including asyncio.TimeoutError) into
+            the result list instead of raising the first one
+
+        Tasks cancelled because of FIRST_COMPLETED/FIRST_EXCEPTION leave None
+        in their slot, with ALL_COMPLETED they count as timed out.
+        """
+        futures = [self._ensureTask(t, task_timeout) for t in tasks]
+        if len(futures) == 0:
+            return []
+        done, pending = await asyncio.wait(futures, timeout=timeout, return_when=return_when)
+        for f in pending:
+            f.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
         results = []
-        for t in tasks:
-            results.append(await t)
+        errors = []
+        for f in futures:
+            if f in pending:
+                if return_when != asyncio.ALL_COMPLETED:
+                    results.append(None)
+                    continue
+                error = asyncio.TimeoutError()
+            else:
+                error = f.exception()
+                if error is None:
+                    results.append(f.result())
+                    continue
+            errors.append(error)
+            results.append(error)
+        if errors and not return_exceptions:
+            raise errors[0]
         return results
 
+    async def asCompleted(self,
+                          tasks: list[Awaitable[CallResult]],
+                          timeout: float = None,
+                          task_timeout: float = None) -> AsyncIterator[Tuple[int, CallResult]]:
+        """
+        Yield `(index, result)` for every task as soon as it finishes.
+
+        A failed task raises at the point it is yielded, the remaining tasks
+        are cancelled when the consumer stops iterating or `timeout` expires.
+        """
+        futures = {self._ensureTask(t, task_timeout): i for i, t in enumerate(tasks)}
+        pending = set(futures)
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        try:
+            while pending:
+                remaining = None if deadline is None else deadline - loop.time()
+                if remaining is not None and remaining <= 0:
+                    raise asyncio.TimeoutError()
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                for f in done:
+                    yield futures[f], f.result()
+        finally:
+            for f in pending:
+                f.cancel()
+
     def helperCollectMetadata(self, 
                               kind: Union["call", "tell"], 
                               fnName: str, 
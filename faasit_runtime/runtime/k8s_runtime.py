@@ -30,7 +30,7 @@ class K8sRuntime(FaasitRuntime):
         def get(self, filename: str, timeout = -1) -> bytes:
             pass
 
-        def list(self) -> List:
+        def list(self, prefix: str = '', page_size: int = 1000) -> List:
             pass
 
         def exists(self, filename: str) -> bool:
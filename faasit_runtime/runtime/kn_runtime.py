@@ -2,20 +2,32 @@ from .faasit_runtime import (
     FaasitRuntime, 
     InputType,
     CallResult,
-    StorageMethods
+    StorageMethods,
+    StoragePipeline
 )
+from typing import Any, Iterator, List
 import requests
 import os
 import json
 import uuid
+import inspect
 from faasit_runtime.serverless_function import Metadata
 from faasit_runtime.utils.logging import log
-from faasit_runtime.storage import RedisDB
+from faasit_runtime.utils.serializer import wire_serializer, accept_header, loads_wire, get_serializer, NDJSON_CONTENT_TYPE
+from faasit_runtime.utils.compression import maybe_compress, decompress, accept_encoding
+from faasit_runtime.storage import RedisDB, AsyncRedisDB, AsyncRedisPipeline
+from faasit_runtime.storage.cache import cached
+from faasit_runtime.runtime.local_call import find_local_handler, prepare, run_local, call_local, tell_local
+
+# Codecs each callee can decode, by url, from the Accept-Encoding header of
+# its last response. Request bodies are only compressed with one of them, a
+# callee that was never heard from gets them uncompressed.
+_callee_encodings: dict[str, str] = {}
 
 
 class KnativeRuntime(FaasitRuntime):
     name: str = 'knative'
-    def __init__(self,metadata: Metadata) -> None:
+    def __init__(self,metadata: Metadata, async_storage: bool = False) -> None:
         super().__init__()
         self._input = metadata._params
         self._id = metadata._id
@@ -23,12 +35,21 @@ class KnativeRuntime(FaasitRuntime):
         self._namespace = metadata._namespace
         self._router:dict = metadata._router
         self._type = metadata._type
-        self._storage = self.KnStorage(redis_db=self._redis_db)
+        if async_storage:
+            # coroutine handlers get the non blocking client
+            self._storage = self.AsyncKnStorage(redis_db=self._redis_db.as_async())
+        else:
+            self._storage = cached(self.KnStorage(redis_db=self._redis_db), self._redis_db.config.url)
     
     @property
     def storage(self) -> "KnStorage":
         return self._storage
 
+    def _blocking_storage(self) -> StorageMethods:
+        if isinstance(self._storage, self.AsyncKnStorage):
+            return self.KnStorage(redis_db=self._redis_db)
+        return self._storage
+
     def input(self):
         result = None
         try:
@@ -39,17 +60,60 @@ class KnativeRuntime(FaasitRuntime):
     def output(self, _out):
         return _out
 
-    def _collect_metadata(self, params, call_kind='invoke'):
+    def _collect_metadata(self, params, call_kind='invoke', priority: int = None):
         id = str(uuid.uuid4())
         
-        return {
+        metadata = {
             'id': id,
             'params': params,
             'namespace': self._namespace,
             'router': self._router,
             'type': call_kind
         }
+        if priority:
+            # the callee serves queued tells with a higher priority first
+            metadata['priority'] = priority
+        return metadata
+
+    def _send(self, fnName: str, call_url: str, metadata_dict: dict, accept: str) -> requests.Response:
+        serializer = wire_serializer()
+        body, encoding = serializer.dumps(metadata_dict), None
+        accepted = _callee_encodings.get(call_url)
+        if accepted:
+            body, encoding = maybe_compress(body, accepted)
+        headers = {
+            'Content-Type': serializer.content_type,
+            'Accept': accept,
+            'Accept-Encoding': accept_encoding(),
+        }
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        resp = requests.post(f"{call_url}", data=body, headers=headers, proxies={'http': None, 'https': None}, stream=True)
+        _callee_encodings[call_url] = resp.headers.get('Accept-Encoding', '')
+        log.info(f"Response from function {fnName}: {resp}")
+        return resp
+
+    def _post(self, fnName: str, call_url: str, metadata_dict: dict) -> dict:
+        with self._send(fnName, call_url, metadata_dict, accept_header()) as resp:
+            # read the raw body so that we decode it ourselves whatever urllib3 supports
+            content = decompress(resp.raw.read(decode_content=False), resp.headers.get('Content-Encoding'))
+            return loads_wire(resp.headers.get('Content-Type'), content)
+
+    def _local_metadata(self, params, policy: str, call_kind='invoke') -> Metadata:
+        return Metadata(
+            id=str(uuid.uuid4()),
+            params=prepare(params, policy),
+            namespace=self._namespace,
+            router=self._router,
+            request_type=call_kind,
+            redis_db=self._redis_db,
+        )
+
     def call(self, fnName:str, fnParams: InputType) -> CallResult:
+        local = find_local_handler(fnName)
+        if local is not None:
+            handler, policy = local
+            return call_local(fnName, handler, policy, self._local_metadata(fnParams, policy))
         call_url = self._router.get(fnName)
         if call_url is None:
             raise ValueError(f"Function {fnName} not found in router")
@@ -57,24 +121,67 @@ class KnativeRuntime(FaasitRuntime):
         metadata_dict = self._collect_metadata(params=fnParams)
         log.info(f"Calling function {fnName} with params metadata: {metadata_dict}")
 
-        resp = requests.post(f"{call_url}", json=metadata_dict, headers={'Content-Type': 'application/json'}, proxies={'http': None, 'https': None})
-
-        log.info(f"Response from function {fnName}: {resp}")
-        resp = resp.json()
+        resp = self._post(fnName, call_url, metadata_dict)
         if resp['status'] == 'error':
             raise ValueError(f"Failed to call function {fnName}: {resp['error']}")
         return resp['data']
     
-    def tell(self, fnName:str, fnParams: InputType) -> CallResult:
+    def callStream(self, fnName:str, fnParams: InputType) -> Iterator[Any]:
+        """
+        Call `fnName` and iterate over the chunks its handler yields while
+        they arrive. Results of handlers that return instead of yield come
+        out as a single chunk, or one chunk per item for lists.
+        """
+        local = find_local_handler(fnName)
+        if local is not None:
+            handler, policy = local
+            result = run_local(fnName, handler, policy, self._local_metadata(fnParams, policy))
+            if isinstance(result, list) or inspect.isgenerator(result):
+                for chunk in result:
+                    yield prepare(chunk, policy)
+            else:
+                yield prepare(result, policy)
+            return
+        call_url = self._router.get(fnName)
+        if call_url is None:
+            raise ValueError(f"Function {fnName} not found in router")
+
+        metadata_dict = self._collect_metadata(params=fnParams)
+        log.info(f"Streaming function {fnName} with params metadata: {metadata_dict}")
+
+        with self._send(fnName, call_url, metadata_dict, f"{NDJSON_CONTENT_TYPE}, {accept_header()}") as resp:
+            content_type = resp.headers.get('Content-Type', '')
+            if not content_type.startswith(NDJSON_CONTENT_TYPE):
+                content = decompress(resp.raw.read(decode_content=False), resp.headers.get('Content-Encoding'))
+                result = loads_wire(content_type, content)
+                if result['status'] == 'error':
+                    raise ValueError(f"Failed to call function {fnName}: {result['error']}")
+                if isinstance(result['data'], list):
+                    yield from result['data']
+                else:
+                    yield result['data']
+                return
+            serializer = get_serializer('json')
+            for line in resp.iter_lines(chunk_size=64 * 1024):
+                if not line:
+                    continue
+                chunk = serializer.loads(line)
+                if chunk['status'] == 'error':
+                    raise ValueError(f"Failed to call function {fnName}: {chunk['error']}")
+                yield chunk['data']
+
+    def tell(self, fnName:str, fnParams: InputType, priority: int = 0) -> CallResult:
+        local = find_local_handler(fnName)
+        if local is not None:
+            handler, policy = local
+            return tell_local(fnName, handler, policy, self._local_metadata(fnParams, policy, 'tell'), priority)['message']
         call_url = self._router.get(fnName)
         if call_url is None:
             raise ValueError(f"Function {fnName} not found in router")
         
-        metadata_dict = self._collect_metadata(params=fnParams, call_kind='tell')
+        metadata_dict = self._collect_metadata(params=fnParams, call_kind='tell', priority=priority)
         log.info(f"Sending message to function {fnName} with metadata: {metadata_dict}")
-        resp = requests.post(f"{call_url}", json=metadata_dict, headers={'Content-Type': 'application/json'}, proxies={'http': None, 'https': None})
-        log.info(f"Response from function {fnName}: {resp}")
-        resp = resp.json()
+        resp = self._post(fnName, call_url, metadata_dict)
         if resp['status'] == 'error':
             raise ValueError(f"Failed to call function {fnName}: {resp['error']}")
         return resp['message']
@@ -88,4 +195,59 @@ class KnativeRuntime(FaasitRuntime):
         def put(self, filename: str, value, *_, **__):
             return self._redis_db.set(filename, value)
         def delete(self, filename: str):
-            return self._redis_db.delete(filename)
\ No newline at end of file
+            return self._redis_db.delete(filename)
+        def exists(self, filename: str) -> bool:
+            return self._redis_db.exists(filename)
+        # shadows the builtin in the rest of this class body, annotate with typing.List
+        def list(self, prefix: str = '', page_size: int = 1000):
+            return self._redis_db.scan(prefix, page_size)
+        def mget(self, filenames: List[str]) -> List:
+            return self._redis_db.mget(filenames)
+        def get_raw(self, filename: str, *_, **__):
+            return self._redis_db.get_raw(filename)
+        def mget_raw(self, filenames: List[str]) -> List:
+            return self._redis_db.mget_raw(filenames)
+        def decode(self, data):
+            return self._redis_db.loads(data)
+        def mput(self, items: dict[str, Any]):
+            return self._redis_db.mset(items)
+        def mdelete(self, filenames: List[str]):
+            return self._redis_db.mdelete(filenames)
+        def pipeline(self) -> StoragePipeline:
+            return self.RedisStoragePipeline(self)
+        def wait_get(self, filename: str, timeout: float = None):
+            return self._redis_db.wait_get(filename, timeout)
+
+        class RedisStoragePipeline(StoragePipeline):
+            # all queued operations go to redis in a single round trip
+            def _run(self, ops: list[tuple]) -> list:
+                with self._storage._redis_db.pipeline() as pipe:
+                    for op, *args in ops:
+                        {'put': pipe.set, 'get': pipe.get, 'delete': pipe.delete}[op](*args)
+                return pipe.results
+
+    class AsyncKnStorage(StorageMethods):
+        """KnStorage whose operations are coroutines."""
+        def __init__(self, redis_db: AsyncRedisDB):
+            self._redis_db = redis_db
+        async def get(self, filename: str, *_, **__):
+            return await self._redis_db.get(filename)
+        async def put(self, filename: str, value, *_, **__):
+            return await self._redis_db.set(filename, value)
+        async def delete(self, filename: str):
+            return await self._redis_db.delete(filename)
+        async def exists(self, filename: str) -> bool:
+            return await self._redis_db.exists(filename)
+        def list(self, prefix: str = '', page_size: int = 1000):
+            # use with `async for`, shadows the builtin as in KnStorage
+            return self._redis_db.scan(prefix, page_size)
+        async def mget(self, filenames: List[str]) -> List:
+            return await self._redis_db.mget(filenames)
+        async def mput(self, items: dict[str, Any]):
+            return await self._redis_db.mset(items)
+        async def mdelete(self, filenames: List[str]):
+            return await self._redis_db.mdelete(filenames)
+        def pipeline(self) -> AsyncRedisPipeline:
+            return self._redis_db.pipeline()
+        async def wait_get(self, filename: str, timeout: float = None):
+            return await self._redis_db.wait_get(filename, timeout)
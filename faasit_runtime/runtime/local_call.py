@@ -0,0 +1,117 @@
+import os
+import copy
+import queue
+import inspect
+import itertools
+import threading
+from typing import Any, Callable
+
+from faasit_runtime.utils.logging import log
+from faasit_runtime.utils.event_loop import resolve
+
+# Functions registered in this process (through `@function`) can be called
+# without going through HTTP. FAASIT_LOCAL_CALL sets the default policy,
+# `@function(local_call=...)` overrides it per callee:
+#   off    always go through the router
+#   copy   call the handler in-process on deep copies of params and result,
+#          the callee cannot observe or change the caller's objects
+#   share  call the handler in-process on the caller's objects
+LOCAL_CALL_POLICIES = ('off', 'copy', 'share')
+
+# In-process tells wait in a bounded queue served by a fixed pool of threads,
+# as tells sent to a worker do, a tell with a higher `priority` first. When
+# the queue is full the teller blocks until there is room, and fails after
+# `local_tell_timeout` seconds.
+local_tell_workers = int(os.getenv('FAASIT_LOCAL_TELL_WORKERS', 4))
+local_tell_queue_size = int(os.getenv('FAASIT_LOCAL_TELL_QUEUE_SIZE', 1024))
+local_tell_timeout = float(os.getenv('FAASIT_LOCAL_TELL_TIMEOUT', 30))
+
+
+def local_call_policy(override: str = None) -> str:
+    policy = (override or os.environ.get('FAASIT_LOCAL_CALL', 'off')).strip().lower()
+    if policy not in LOCAL_CALL_POLICIES:
+        raise ValueError(f"Invalid local call policy {policy}, expected one of {LOCAL_CALL_POLICIES}")
+    return policy
+
+
+def find_local_handler(fnName: str) -> tuple[Callable, str] | None:
+    """The handler of `fnName` and its policy if it is co-located and may be called in-process."""
+    from faasit_runtime import routeBuilder
+    func = routeBuilder.build().function(fnName)
+    if func is None or func.handler is None:
+        return None
+    policy = local_call_policy(func.local_call)
+    if policy == 'off':
+        return None
+    return func.handler, policy
+
+
+def prepare(value: Any, policy: str) -> Any:
+    return copy.deepcopy(value) if policy == 'copy' else value
+
+
+def run_local(fnName: str, handler: Callable, policy: str, metadata) -> Any:
+    """The result of the handler, awaited if the handler is a coroutine, before any copy."""
+    log.debug(f"Calling function {fnName} in-process ({policy})")
+    return resolve(handler(metadata))
+
+
+def call_local(fnName: str, handler: Callable, policy: str, metadata) -> Any:
+    result = run_local(fnName, handler, policy, metadata)
+    if inspect.isgenerator(result):
+        result = list(result)
+    return prepare(result, policy)
+
+
+tell_queue: queue.PriorityQueue = queue.PriorityQueue(maxsize=local_tell_queue_size)
+tell_seq = itertools.count()
+tell_threads: list[threading.Thread] = []
+tell_pid = None
+tell_lock = threading.Lock()
+
+def _tell_worker():
+    while True:
+        _, _, (fnName, handler, policy, metadata) = tell_queue.get()
+        try:
+            call_local(fnName, handler, policy, metadata)
+        except Exception as e:
+            log.error(f"Failed to tell function {fnName} in-process: {e}")
+        finally:
+            tell_queue.task_done()
+
+def _start_tell_threads():
+    # threads do not survive fork, a forked process starts its own
+    global tell_threads, tell_pid
+    with tell_lock:
+        if tell_pid == os.getpid() and len(tell_threads) >= local_tell_workers:
+            return
+        if tell_pid != os.getpid():
+            tell_threads = []
+        while len(tell_threads) < local_tell_workers:
+            t = threading.Thread(target=_tell_worker, daemon=True)
+            t.start()
+            tell_threads.append(t)
+        tell_pid = os.getpid()
+
+
+def tell_local(fnName: str, handler: Callable, policy: str, metadata, priority: int = 0) -> dict:
+    _start_tell_threads()
+    try:
+        tell_queue.put((-priority, next(tell_seq), (fnName, handler, policy, metadata)), timeout=local_tell_timeout)
+    except queue.Full:
+        raise RuntimeError(f"Failed to tell function {fnName} in-process: the queue stayed full for {local_tell_timeout}s")
+    return {
+        'status': 'ok',
+        'message': 'Lambda function told successfully',
+    }
+
+
+__all__ = [
+    "LOCAL_CALL_POLICIES",
+    "local_call_policy",
+    "find_local_handler",
+    "prepare",
+    "run_local",
+    "call_local",
+    "tell_local",
+]
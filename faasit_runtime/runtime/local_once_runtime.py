@@ -1,5 +1,6 @@
 import os
 import time
+import mmap
 from .faasit_runtime import (
     FaasitRuntime,
     CallParams,
@@ -9,12 +10,21 @@ from .faasit_runtime import (
     InputType,
     FaasitRuntimeMetadata,
 )
-import pickle
-from typing import Any, List
+from typing import Any, Iterator, List
 from ..serverless_function import Metadata
 from faasit_runtime.utils.logging import log
+from faasit_runtime.utils.serializer import storage_serializer
+from faasit_runtime.storage.cache import cached
+from faasit_runtime.utils.inotify import watch_dir
+import threading
 import uuid
 
+# files from this size on are memory mapped by `get` instead of read
+local_mmap_threshold = int(os.environ.get('FAASIT_LOCAL_MMAP_THRESHOLD', 64 * 1024))
+
+# notified after every local put, wakes readers waiting in this process
+_written = threading.Condition()
+
 class LocalOnceRuntime(FaasitRuntime):
     name: str = 'local-once'
     def __init__(self, metadata: Metadata) -> None:
@@ -24,7 +34,7 @@ class LocalOnceRuntime(FaasitRuntime):
         self._namespace = metadata._namespace
         self._router = metadata._router
         local_store_dir = os.environ.get('LOCAL_STORAGE_DIR', './local_storage')
-        self._storage = self.LocalStorage(local_store_dir)
+        self._storage = cached(self.LocalStorage(local_store_dir), f"file://{os.path.abspath(local_store_dir)}")
 
 
     def input(self):
@@ -42,7 +52,6 @@ class LocalOnceRuntime(FaasitRuntime):
             router=self._router,
             request_type="invoke",
             redis_db=None,
-            producer=None
         )
         return {
             'id': id,
@@ -100,6 +109,7 @@ class LocalOnceRuntime(FaasitRuntime):
     class LocalStorage(StorageMethods):
         def __init__(self, store_path: str = './local_storage') -> None:
             self.storage_path = os.path.abspath(store_path)
+            self._serializer = storage_serializer()
         
         def check_and_make_dir(fn):
             def wrapper(self, *args, **kwargs):
@@ -110,47 +120,146 @@ class LocalOnceRuntime(FaasitRuntime):
 
         @check_and_make_dir
         def put(self, filename, data) -> None:
+            self._write(filename, self._serializer.dump_parts(data))
+
+        @check_and_make_dir
+        def put_buffer(self, filename: str, data) -> None:
+            """Store the bytes-like `data` as is, `open_buffer` maps them back."""
+            self._write(filename, [data])
+
+        def _write(self, filename: str, parts: list) -> None:
+            # written to a temporary file and renamed over the key, readers
+            # never see a partial file and mappings of the previous value
+            # stay valid (a truncated mapped file would SIGBUS them)
             file_path = os.path.join(self.storage_path,filename)
             dir_name = os.path.dirname(file_path)
             os.makedirs(dir_name, exist_ok=True)
             self._acquire_filelock(file_path)
-            with open(file_path, "wb") as f:
-                f.write(pickle.dumps(data))
-                f.flush()
+            try:
+                tmp_path = os.path.join(dir_name, f".{os.path.basename(file_path)}.{uuid.uuid4().hex}.tmp")
+                try:
+                    with open(tmp_path, "xb") as f:
+                        for part in parts:
+                            f.write(part)
+                    os.replace(tmp_path, file_path)
+                except BaseException:
+                    os.remove(tmp_path)
+                    raise
+            finally:
+                self._release_filelock(file_path)
             log.debug(f"[storage put] Put data into {file_path} successfully.")
-            self._release_filelock(file_path)
+            with _written:
+                _written.notify_all()
 
         def get(self, filename, timeout = -1) -> bytes:
             file_path = os.path.join(self.storage_path,filename)
-            start_t = time.time()
-            while not os.path.exists(file_path):
-                time.sleep(0.001)
-                if timeout > 0:
-                    if time.time() - start_t > timeout / 1000: return None
+            if not self._wait_exists(file_path, timeout / 1000 if timeout > 0 else None):
+                return None
             self._wait_filelock(file_path)
-            while True:
-                with open(file_path, "rb") as f:
-                    data = f.read()
-                data_len = len(data)
-                if data_len == 0:
-                    print(f"[storage get] read error of {file_path}, retry ...")
-                    time.sleep(0.001)
-                    continue
-                break
+            # large files are mapped copy-on-write, out-of-band pickle buffers
+            # (numpy arrays...) become writable views of the page cache
+            data = self._map(file_path, mmap.ACCESS_COPY, local_mmap_threshold)
+            return self.decode(data)
+
+        def get_raw(self, filename, timeout = -1) -> bytes | None:
+            file_path = os.path.join(self.storage_path,filename)
+            if not self._wait_exists(file_path, timeout / 1000 if timeout > 0 else None):
+                return None
+            self._wait_filelock(file_path)
+            with open(file_path, "rb") as f:
+                return f.read()
+
+        def decode(self, data):
             try:
-                return pickle.loads(data)
+                return self._serializer.loads(data)
             except:
-                return data.decode('utf-8')
+                try:
+                    return bytes(data).decode('utf-8')
+                except UnicodeDecodeError:
+                    return bytes(data)
+
+        def open_buffer(self, filename: str, timeout = -1) -> memoryview | None:
+            """
+            Read-only view of the stored bytes of `filename`, backed by an
+            mmap of the file, nothing is read until the view is touched.
+            Holds the serialized value for keys written with `put`, the raw
+            bytes for keys written with `put_buffer`. None if it does not
+            exist within `timeout` ms.
+            """
+            file_path = os.path.join(self.storage_path,filename)
+            if not self._wait_exists(file_path, timeout / 1000 if timeout > 0 else None):
+                return None
+            self._wait_filelock(file_path)
+            return memoryview(self._map(file_path, mmap.ACCESS_READ))
+
+        @staticmethod
+        def _map(file_path: str, access: int, threshold: int = 0):
+            # the mapping stays open as long as a view of it is alive
+            with open(file_path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0 or size < threshold:
+                    return f.read()
+                return memoryview(mmap.mmap(f.fileno(), 0, access=access))
+
+        def wait_get(self, filename: str, timeout: float = None):
+            return self.get(filename, timeout * 1000 if timeout is not None else -1)
 
-        def list(self) -> List:
-            return [f for f in os.listdir(self.storage_path) if not f.endswith(".lock")]
+        def _wait_exists(self, file_path: str, timeout: float = None) -> bool:
+            # sleep until the file shows up: inotify sees writes from any
+            # process, without it puts from this process notify `_written`
+            # and other processes are picked up by a periodic re-check
+            if os.path.exists(file_path):
+                return True
+            deadline = None if timeout is None else time.monotonic() + timeout
+            dir_name = os.path.dirname(file_path)
+            os.makedirs(dir_name, exist_ok=True)
+            watch = watch_dir(dir_name)
+            try:
+                while not os.path.exists(file_path):
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                    if watch is not None:
+                        watch.wait(remaining)
+                    else:
+                        with _written:
+                            _written.wait(0.05 if remaining is None else min(remaining, 0.05))
+                return True
+            finally:
+                if watch is not None:
+                    watch.close()
+
+        def list(self, prefix: str = '', page_size: int = 1000) -> Iterator[str]:
+            # keys are paths relative to the storage root, `stage/key` lives
+            # in a subdirectory. The walk starts at the deepest directory the
+            # prefix names, scandir reads directories incrementally so there
+            # is nothing to page.
+            top = os.path.join(self.storage_path, os.path.dirname(prefix))
+            stack = [top]
+            while stack:
+                try:
+                    it = os.scandir(stack.pop())
+                except (FileNotFoundError, NotADirectoryError):
+                    continue
+                with it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            continue
+                        if entry.name.endswith((".lock", ".tmp")):
+                            continue
+                        key = os.path.relpath(entry.path, self.storage_path).replace(os.sep, '/')
+                        if key.startswith(prefix):
+                            yield key
 
         def exists(self, filename: str) -> bool:
-            file_path = self.storage_path + filename
+            file_path = os.path.join(self.storage_path, filename)
             return os.path.exists(file_path)
 
         def delete(self, filename: str) -> None:
-            file_path = self.storage_path + filename
+            file_path = os.path.join(self.storage_path, filename)
             if os.path.exists(file_path):
                 self._acquire_filelock(file_path)
                 os.remove(file_path)
@@ -9,11 +9,16 @@ from faasit_runtime.runtime.faasit_runtime import (
 )
 import requests
 import aiohttp
-import redis
+import redis.asyncio as aioredis
 
 import json
 from typing import Any
 from faasit_runtime.serverless_function import Metadata
+from faasit_runtime.utils.serializer import wire_serializer, accept_header, loads_wire
+from faasit_runtime.storage.redis_db import _match_prefix
+from faasit_runtime.storage.redis_conn import RedisConfig, get_async_client
+from faasit_runtime.runtime.local_call import find_local_handler, prepare, call_local, tell_local
+import uuid
 
 class LocalRuntime(FaasitRuntime):
     name: str = 'local'
@@ -38,6 +43,16 @@ class LocalRuntime(FaasitRuntime):
     def metadata(self):
         return self._metadata
 
+    def _local_metadata(self, params, policy: str, call_kind='invoke') -> Metadata:
+        return Metadata(
+            id=str(uuid.uuid4()),
+            params=prepare(params, policy),
+            namespace=None,
+            router=None,
+            request_type=call_kind,
+            redis_db=None,
+        )
+
     def call(self, fnName: str, fnParams) -> CallResult:
         fnParams: CallParams
         try:
@@ -51,14 +66,20 @@ class LocalRuntime(FaasitRuntime):
         print(f"[function call] {callerName} -> {fnName}")
         print(f"[call params] {event}")
 
+        local = find_local_handler(fnName)
+        if local is not None:
+            handler, policy = local
+            return call_local(fnName, handler, policy, self._local_metadata(event, policy))
+
         url = f"http://{fnName}:9000"
         json_data = {
             "event": event,
             "metadata": metadata.json()
         }
-        headers = {"Content-Type": "application/json"}
-        resp = requests.post(url, json=json_data, headers=headers)
-        result = resp.json()
+        serializer = wire_serializer()
+        headers = {"Content-Type": serializer.content_type, "Accept": accept_header()}
+        resp = requests.post(url, data=serializer.dumps(json_data), headers=headers)
+        result = loads_wire(resp.headers.get('Content-Type'), resp.content)
         
         status = result.get('status')
         if status == "finished":
@@ -81,15 +102,21 @@ class LocalRuntime(FaasitRuntime):
         print(f"[function tell] {callerName} -> {fnName}")
         print(f"[tell params] {event}")
 
+        local = find_local_handler(fnName)
+        if local is not None:
+            handler, policy = local
+            return tell_local(fnName, handler, policy, self._local_metadata(event, policy, 'tell'))
+
         url = f"http://{fnName}:9000"
         json_data = {
             "event": event,
             "metadata": metadata.json()
         }
-        headers = {"Content-Type": "application/json"}
+        serializer = wire_serializer()
+        headers = {"Content-Type": serializer.content_type, "Accept": accept_header()}
         async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=json_data,headers=headers) as resp:
-                result = await resp.json()
+            async with session.post(url, data=serializer.dumps(json_data), headers=headers) as resp:
+                result = loads_wire(resp.headers.get('Content-Type'), await resp.read())
                 return result
 
     @property
@@ -98,25 +125,27 @@ class LocalRuntime(FaasitRuntime):
 
     class LocalStorage(StorageMethods):
         def __init__(self) -> None:
-            self.redis_client = redis.Redis(host='redis', port=6379, db=0)
-            pass
+            # the redis service of the local deployment unless REDIS_* says
+            # otherwise, clients are shared per event loop
+            self._redis_config = RedisConfig.from_env(host='redis')
+
+        @property
+        def redis_client(self) -> aioredis.Redis:
+            return get_async_client(self._redis_config)
 
         async def set(self, key: str, value: str) -> None:
-            self.redis_client.set(key, value)
-            pass
+            await self.redis_client.set(key, value)
 
         async def get(self, key: str) -> str:
-            return self.redis_client.get(key)
+            return await self.redis_client.get(key)
 
         async def delete(self, key: str) -> None:
-            self.redis_client.delete(key)
-            pass
+            await self.redis_client.delete(key)
 
-        async def list(self) -> list:
-            return [key.decode('utf-8') for key in self.redis_client.keys()]
+        async def list(self, prefix: str = '', page_size: int = 1000):
+            # SCAN instead of KEYS, use with `async for`
+            async for key in self.redis_client.scan_iter(match=_match_prefix(prefix), count=page_size):
+                yield key.decode('utf-8')
 
         async def exists(self, key: str) -> bool:
-            return self.redis_client.exists(key)
-
-
-        
\ No newline at end of file
+            return await self.redis_client.exists(key)
@@ -69,7 +69,7 @@ class PKURuntime(FaasitRuntime):
             obj = self._metadata.get_existed_object(src_state, filename, **opts)
             return obj
 
-        def list(self) -> list:
+        def list(self, prefix: str = '', page_size: int = 1000) -> list:
             pass
 
         def exists(self, filename: str) -> bool:
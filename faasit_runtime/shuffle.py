@@ -0,0 +1,214 @@
+import heapq
+import pickle
+import zlib
+import itertools
+import functools
+from collections import deque
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator
+
+from faasit_runtime.runtime.faasit_runtime import StorageMethods
+from faasit_runtime.utils.logging import log
+
+# A shuffle moves (key, value) records from map tasks to the reduce task
+# that owns their partition, through the function storage. Under the
+# shuffle's name it writes
+#   {name}/{partition}/{map_id}-{seq}   one run: the records a map task
+#                                       buffered for a partition
+#   {name}/_commit/{map_id}             the run keys of every partition,
+#                                       written when the map task closes
+# Reducers wait for the commits, so maps and reduces can be started
+# together, and only read runs of committed map tasks.
+
+_first = itemgetter(0)
+
+
+def partition_of(key: Any, num_partitions: int) -> int:
+    """The partition of `key`, the same in every process (hash() of str is not)."""
+    if isinstance(key, str):
+        data = key.encode('utf-8')
+    elif isinstance(key, (bytes, bytearray)):
+        data = bytes(key)
+    else:
+        data = pickle.dumps(key, protocol=4)
+    return zlib.crc32(data) % num_partitions
+
+
+class Shuffle:
+    """
+    Map side, one instance per map task with its `map_id`:
+
+        with frt.shuffle('wc', num_partitions=4, map_id=task, combine=operator.add) as out:
+            out.scatter((word, 1) for word in words)
+
+    Records are buffered per partition, combined by key with `combine` and
+    sorted by key with `sort`, and every `buffer_records` records (and on
+    close) all partitions are written in one `mput`. Closing commits the
+    map task.
+
+    Reduce side:
+
+        for word, count in frt.shuffle('wc', num_partitions=4, num_maps=4, combine=operator.add).read(task):
+
+    yields the records of the partition from all map tasks. Runs are
+    fetched `prefetch` at a time in the background, sorted runs are merged
+    and `combine` is applied across map tasks. With `num_maps` the map
+    tasks are 0..num_maps-1 and their commits are waited for (up to
+    `timeout` seconds each), without it the committed map tasks are read.
+    """
+    def __init__(self,
+                 storage: StorageMethods,
+                 name: str,
+                 num_partitions: int,
+                 map_id: Any = None,
+                 combine: Callable[[Any, Any], Any] = None,
+                 sort: bool = False,
+                 buffer_records: int = 100_000,
+                 num_maps: int = None,
+                 prefetch: int = 4,
+                 timeout: float = None):
+        if num_partitions <= 0:
+            raise ValueError(f"Invalid number of partitions {num_partitions}")
+        self._storage = storage
+        self.name = name
+        self.num_partitions = num_partitions
+        self.map_id = map_id
+        self.combine = combine
+        self.sort = sort
+        self.buffer_records = buffer_records
+        self.num_maps = num_maps
+        self.prefetch = prefetch
+        self.timeout = timeout
+        # partition -> dict of combined records with `combine`, else a list
+        self._buffers: dict[int, Any] = {}
+        self._buffered = 0
+        self._runs: list[list[str]] = [[] for _ in range(num_partitions)]
+        self._seq = 0
+
+    def partition(self, key: Any) -> int:
+        return partition_of(key, self.num_partitions)
+
+    # map side
+
+    def write(self, partition: int, records: Iterable[tuple]) -> None:
+        """Buffer (key, value) `records` for `partition`."""
+        if self.map_id is None:
+            raise ValueError(f"Shuffle {self.name} needs a map_id to write")
+        if not 0 <= partition < self.num_partitions:
+            raise ValueError(f"Invalid partition {partition} of shuffle {self.name}")
+        buf = self._buffers.get(partition)
+        if self.combine is not None:
+            if buf is None:
+                buf = self._buffers[partition] = {}
+            before = len(buf)
+            combine = self.combine
+            for key, value in records:
+                buf[key] = combine(buf[key], value) if key in buf else value
+            self._buffered += len(buf) - before
+        else:
+            if buf is None:
+                buf = self._buffers[partition] = []
+            before = len(buf)
+            buf.extend(records)
+            self._buffered += len(buf) - before
+        if self._buffered >= self.buffer_records:
+            self.flush()
+
+    def scatter(self, records: Iterable[tuple]) -> None:
+        """Buffer (key, value) `records`, each in the partition of its key."""
+        groups: dict[int, list] = {}
+        for record in records:
+            groups.setdefault(self.partition(record[0]), []).append(record)
+        for partition, group in groups.items():
+            self.write(partition, group)
+
+    def flush(self) -> None:
+        """Write the buffered records, one run per partition, in one batch."""
+        items = {}
+        for partition, buf in self._buffers.items():
+            records = list(buf.items()) if self.combine is not None else buf
+            if not records:
+                continue
+            if self.sort:
+                records.sort(key=_first)
+            run = f"{self.name}/{partition}/{self.map_id}-{self._seq}"
+            items[run] = records
+            self._runs[partition].append(run)
+        self._buffers = {}
+        self._buffered = 0
+        if items:
+            self._seq += 1
+            self._storage.mput(items)
+            log.debug(f"[shuffle] {self.name}: map {self.map_id} wrote {len(items)} runs")
+
+    def close(self) -> None:
+        """Flush and commit the map task, reducers only read committed map tasks."""
+        self.flush()
+        self._storage.put(f"{self.name}/_commit/{self.map_id}", self._runs)
+
+    def __enter__(self) -> 'Shuffle':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+    # reduce side
+
+    def _commits(self) -> Iterator[list]:
+        prefix = f"{self.name}/_commit/"
+        if self.num_maps is None:
+            # a listing may return a key twice (Redis SCAN)
+            keys = list(dict.fromkeys(self._storage.list(prefix)))
+            yield from self._storage.mget(keys)
+            return
+        for map_id in range(self.num_maps):
+            commit = self._storage.wait_get(f"{prefix}{map_id}", self.timeout)
+            if commit is None:
+                raise TimeoutError(f"Shuffle {self.name}: map {map_id} did not commit within {self.timeout}s")
+            yield commit
+
+    def _fetch_runs(self, partition: int) -> Iterator[list]:
+        # runs are fetched in the background while earlier ones are consumed
+        pending = deque()
+        with ThreadPoolExecutor(max(self.prefetch, 1)) as pool:
+            for commit in self._commits():
+                for run in commit[partition]:
+                    if len(pending) >= self.prefetch:
+                        yield pending.popleft().result()
+                    pending.append(pool.submit(self._storage.get, run))
+            while pending:
+                yield pending.popleft().result()
+
+    def read(self, partition: int) -> Iterator[tuple]:
+        """The (key, value) records of `partition`, in key order with `sort`."""
+        if not 0 <= partition < self.num_partitions:
+            raise ValueError(f"Invalid partition {partition} of shuffle {self.name}")
+        runs = self._fetch_runs(partition)
+        if self.sort:
+            # merging needs the head of every run, all of them are fetched
+            records = heapq.merge(*runs, key=_first)
+        else:
+            records = itertools.chain.from_iterable(runs)
+        if self.combine is None:
+            yield from records
+        elif self.sort:
+            for key, group in itertools.groupby(records, key=_first):
+                yield key, functools.reduce(self.combine, (value for _, value in group))
+        else:
+            combined = {}
+            combine = self.combine
+            for key, value in records:
+                combined[key] = combine(combined[key], value) if key in combined else value
+            yield from combined.items()
+
+    def delete(self) -> None:
+        """Remove every run and commit of the shuffle."""
+        self._storage.mdelete(list(self._storage.list(f"{self.name}/")))
+
+
+__all__ = [
+    "Shuffle",
+    "partition_of",
+]
@@ -1,73 +1,278 @@
 import os
 import time
+import uuid
+import errno
+import fcntl
+import select
 import argparse
 import importlib.util
 from faasit_runtime.utils.logging import log as logger
+from faasit_runtime.utils.serializer import get_serializer
 import sys
-import mmap
+import shutil
+import threading
+import subprocess
 from functools import wraps
 import json
 import multiprocessing
 
-profile = 1
-lock_file = "lock"
-lock_string = "0"
+# Snapshot layout: <snapshot_dir>/imgs holds the CRIU images, requests and
+# responses travel as JSON lines through two named pipes next to them.
+# The snapshotted process blocks in open() on the request pipe, a real
+# blocking syscall, so it neither burns CPU before the dump nor after restore.
+request_fifo_name = "request.fifo"
+response_fifo_name = "response.fifo"
+images_dir_name = "imgs"
+pid_file_name = "restored.pid"
 ret_imm = False
 
-mm_lock = None
+# seconds a client waits for the restored process to take its request and
+# answer it, and seconds the restored process waits for the client to read
+# an answer before dropping it (the client gave up)
+snapshot_timeout = float(os.getenv('FAASIT_SNAPSHOT_TIMEOUT', 300))
+snapshot_response_wait = float(os.getenv('FAASIT_SNAPSHOT_RESPONSE_WAIT', 1))
 
-def criu(handler):
-    def wait():
-        with open(lock_file, 'rb') as f:
-            fd = f.fileno()
-            mm_lock = mmap.mmap(fd, 0, flags=mmap.MAP_SHARED, prot=mmap.PROT_READ)
-        while chr(mm_lock[0]) == lock_string:
-            pass
+serializer = get_serializer('json')
+
+
+def make_fifos(snapshot_dir: str):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    for name in (request_fifo_name, response_fifo_name):
+        path = os.path.join(snapshot_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+        os.mkfifo(path, 0o666)
+
+
+def open_fifo(path: str, flags: int, deadline: float, alive=None) -> int:
+    """
+    Open the FIFO at `path` without blocking for the other end longer than
+    until `deadline` (time.monotonic()), raises TimeoutError after it and
+    ProcessLookupError as soon as `alive()` says the other end is gone.
+    The descriptor is returned in blocking mode.
+    """
+    delay = 0.0005
+    while True:
+        try:
+            fd = os.open(path, flags | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            # a write end cannot be opened before there is a reader
+            if e.errno != errno.ENXIO:
+                raise
+        if alive is not None and not alive():
+            raise ProcessLookupError(f"The process behind {path} exited")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Nobody opened {path} in time")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.01)
+    os.set_blocking(fd, True)
+    return fd
+
+
+# False in the images, the dumped process serves no request before it is
+# killed, so the first request of a restored process sees it unset
+clients_reset = False
+
+
+def build_worker_args(request: dict) -> tuple:
+    # rebuild the worker's Metadata inside the restored process, the redis
+    # connections of the dumping process are not valid after restore, new
+    # ones are made once and reused by the following requests
+    global clients_reset
+    from faasit_runtime.serverless_function import Metadata
+    from faasit_runtime.storage import RedisDB
+    if not clients_reset:
+        from faasit_runtime.storage.redis_conn import reset_clients
+        reset_clients()
+        clients_reset = True
+    redis_db = RedisDB()
+    metadata = Metadata(
+        id=request['id'],
+        params=request['params'],
+        namespace=request.get('namespace'),
+        router=request.get('router'),
+        request_type=request.get('type', 'invoke'),
+        redis_db=redis_db,
+    )
+    return (metadata,)
+
+
+def build_params_args(request: dict) -> tuple:
+    return (request.get('params'),)
+
+
+def serve_snapshot(handler, snapshot_dir: str, build_args=build_params_args):
+    """Answer requests from the pipes in `snapshot_dir` until asked to exit."""
+    request_fifo = os.path.join(snapshot_dir, request_fifo_name)
+    response_fifo = os.path.join(snapshot_dir, response_fifo_name)
+    while True:
+        with open(request_fifo, 'rb') as f:
+            line = f.readline()
+        if not line:
+            continue
+        try:
+            request = serializer.loads(line)
+        except Exception as e:
+            # a client that died while writing, it is not waiting for an answer
+            logger.error(f"Failed to read a request: {e}")
+            continue
+        if request.get('type') == 'exit' or ret_imm:
+            os._exit(0)
+        try:
+            body = serializer.dumps({'status': 'ok', 'id': request.get('id'), 'data': handler(*build_args(request))})
+        except Exception as e:
+            # raised by the handler, or its result cannot be serialized
+            logger.error(f"Failed to invoke the lambda function: {e}")
+            body = serializer.dumps({'status': 'error', 'id': request.get('id'), 'error': str(e)})
+        try:
+            fd = open_fifo(response_fifo, os.O_WRONLY, time.monotonic() + snapshot_response_wait)
+            with open(fd, 'wb') as f:
+                f.write(body + b'\n')
+        except (TimeoutError, OSError) as e:
+            logger.error(f"Dropped the response, the client is gone: {e}")
+
+
+def criu(handler, snapshot_dir: str = '.', build_args=build_params_args):
     @wraps(handler)
     def wrapper(*args, **kwargs):
-        wait()
-        if not ret_imm:
-            return handler(*args, **kwargs)
-        os._exit(0)
+        return serve_snapshot(handler, snapshot_dir, build_args)
     return wrapper
 
+
+def dump(func, snapshot_dir: str, build_args=build_params_args) -> int:
+    """Start `func` in a child that waits on the request pipe and CRIU dump it."""
+    make_fifos(snapshot_dir)
+    images_dir = os.path.join(snapshot_dir, images_dir_name)
+    if os.path.exists(images_dir):
+        shutil.rmtree(images_dir)
+    os.makedirs(images_dir)
+    process = multiprocessing.Process(target=criu(func, snapshot_dir, build_args))
+    process.start()
+    pid = process.pid
+    logger.info(f"pid: {pid}")
+    # the dumped task is killed once its images are written
+    ret = os.system(f"criu dump --images-dir={images_dir} -t {pid} -vvvv -o dump.log")
+    os.chmod(images_dir, 0o777)
+    process.join()
+    return ret
+
+
+class SnapshotClient:
+    """
+    Restores a dumped function and forwards invocations to it through the
+    pipes. The restored process serves one request at a time, callers are
+    serialized with a thread lock plus a file lock so that several server
+    processes can share it. An exchange fails after `timeout` seconds
+    (FAASIT_SNAPSHOT_TIMEOUT), and at once if the restored process exited,
+    so a stuck or dead process never holds the lock for good.
+    """
+    def __init__(self, snapshot_dir: str, timeout: float = None):
+        self.snapshot_dir = os.path.abspath(snapshot_dir)
+        self.timeout = snapshot_timeout if timeout is None else timeout
+        self._request_fifo = os.path.join(self.snapshot_dir, request_fifo_name)
+        self._response_fifo = os.path.join(self.snapshot_dir, response_fifo_name)
+        self._lock_path = os.path.join(self.snapshot_dir, "client.lock")
+        self._pid_path = os.path.join(self.snapshot_dir, pid_file_name)
+        self._lock = threading.Lock()
+
+    def _alive(self) -> bool:
+        # the restored process may be restored by another server process
+        try:
+            with open(self._pid_path) as f:
+                pid = int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _exchange(self, request: dict, wait_response: bool = True):
+        deadline = time.monotonic() + self.timeout
+        with self._lock, open(self._lock_path, 'wb') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            request = dict(request, id=uuid.uuid4().hex)
+            with open(open_fifo(self._request_fifo, os.O_WRONLY, deadline, self._alive), 'wb') as f:
+                f.write(serializer.dumps(request) + b'\n')
+            if not wait_response:
+                return None
+            while True:
+                with open(open_fifo(self._response_fifo, os.O_RDONLY, deadline), 'rb') as f:
+                    line = self._read_line(f, deadline)
+                response = serializer.loads(line) if line else None
+                # the late answer to a request that timed out is skipped
+                if response is not None and response.get('id') == request['id']:
+                    return response
+
+    def _read_line(self, f, deadline: float) -> bytes:
+        # a FIFO that never had a writer does not report POLLHUP, poll
+        # returns once the restored process answered or the deadline passed
+        poller = select.poll()
+        poller.register(f.fileno(), select.POLLIN)
+        while not poller.poll(min(max(deadline - time.monotonic(), 0), 1.0) * 1000):
+            if not self._alive():
+                raise ProcessLookupError("The restored process exited")
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"No response from the restored process within {self.timeout}s")
+        return f.readline()
+
+    def restore(self):
+        images_dir = os.path.join(self.snapshot_dir, images_dir_name)
+        # criu does not replace a pid file, the old one names a process that exited
+        try:
+            os.unlink(self._pid_path)
+        except FileNotFoundError:
+            pass
+        subprocess.run(['criu', 'restore', '-d', f'--images-dir={images_dir}', f'--pidfile={self._pid_path}', '-o', 'restore.log'], check=True)
+
+    def invoke(self, request: dict):
+        response = self._exchange(request)
+        if response['status'] == 'error':
+            raise RuntimeError(response['error'])
+        return response['data']
+
+    def close(self):
+        self._exchange({'type': 'exit'}, wait_response=False)
+
+
+def load_function(lambda_file: str, function_name: str):
+    spec = importlib.util.spec_from_file_location(function_name, lambda_file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, function_name)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='faasit fast start')
     parser.add_argument('--lambda_file', type=str, required=True, help='The lambda file to run')
     parser.add_argument('--function_name', type=str, required=True, help='The function name to run')
     parser.add_argument('--params', type=str, required=False, help='The parameters to pass to the lambda function', default='{}')
+    parser.add_argument('--snapshot_dir', type=str, default='.', help='Where the images and request pipes are created')
+    parser.add_argument('--worker', action='store_true', help='The restored process receives worker requests and calls the function with Metadata')
     args = parser.parse_args()
     lambda_file = args.lambda_file
     function_name = args.function_name
     # Load the user's lambda function
     try:
-        spec = importlib.util.spec_from_file_location(function_name, lambda_file)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        func = getattr(module, function_name)
+        func = load_function(lambda_file, function_name)
     except Exception as e:
         logger.error(f"Failed to load the lambda function: {e}")
         sys.exit(1)
 
-    func = criu(func)
     try:
         params = json.loads(args.params)
     except:
         params = args.params
-    
-    # criu dump the func
-    with open(lock_file, 'wb') as f:
-        f.write(lock_string.encode())
-    
-    if os.path.exists("imgs"):
-        os.system("rm -rf imgs")
-    os.system("mkdir imgs")
-    process = multiprocessing.Process(target=func, args=(params,))
-    process.start()
-    pid = process.pid
-    print(f"pid: {pid}")
-    os.system(f"criu dump --images-dir=./imgs -t {pid} -vvvv -o dump.log")
-    os.chmod("imgs", 0o777)
-    with open(lock_file, 'wb') as f:
-        f.write(str(pid).encode())
-    process.join()
\ No newline at end of file
+
+    if args.worker:
+        build_args = build_worker_args
+    else:
+        # requests without params fall back to the ones given at dump time
+        def build_args(request: dict) -> tuple:
+            return (request.get('params', params),)
+    sys.exit(1 if dump(func, args.snapshot_dir, build_args) != 0 else 0)
@@ -1,3 +1,5 @@
-from .redis_db import RedisDB
+from .redis_conn import RedisConfig, get_client, get_async_client
+from .redis_db import RedisDB, RedisPipeline
+from .async_redis_db import AsyncRedisDB, AsyncRedisPipeline
 
-__all__ = ['RedisDB']
\ No newline at end of file
+__all__ = ['RedisConfig', 'get_client', 'get_async_client', 'RedisDB', 'RedisPipeline', 'AsyncRedisDB', 'AsyncRedisPipeline']
\ No newline at end of file
@@ -0,0 +1,279 @@
+import asyncio
+import time
+import redis
+from typing import Any, AsyncIterator, Iterable
+import redis.asyncio as aioredis
+from faasit_runtime.utils.logging import log as logging
+from .redis_db import redis_seconds, _dumps, _loads, _chunks, _keyspace_flags_enabled, _remaining, _match_prefix, _queue_ops, _decode_write
+from . import redis_db, redis_chunks
+from .redis_db import RedisDB
+from .redis_conn import RedisConfig, get_async_client
+
+
+class AsyncRedisPipeline:
+    """`RedisPipeline` for the asyncio client, use with `async with`."""
+    def __init__(self, client: aioredis.Redis, transaction: bool = False, max_connections: int = None):
+        self._client = client
+        self._transaction = transaction
+        self._max_connections = max_connections
+        # (kind, key, serialized value) per queued operation
+        self._ops: list[tuple[str, str, bytes | None]] = []
+        # segments of chunked values, written before the pipeline runs
+        self._segments = []
+        self.results: list | None = None
+
+    def set(self, key: str, value) -> 'AsyncRedisPipeline':
+        data = _dumps(value)
+        if redis_chunks.should_chunk(data):
+            data, segments = redis_chunks.split(key, data)
+            self._segments.extend(segments)
+        self._ops.append(('set', key, data))
+        return self
+
+    def get(self, key: str) -> 'AsyncRedisPipeline':
+        self._ops.append(('get', key, None))
+        return self
+
+    def delete(self, key: str) -> 'AsyncRedisPipeline':
+        self._ops.append(('delete', key, None))
+        return self
+
+    async def execute(self) -> list:
+        ops, self._ops = self._ops, []
+        segments, self._segments = self._segments, []
+        if not ops:
+            self.results = []
+            return self.results
+        if segments:
+            await redis_chunks.async_write_segments(self._client, segments, self._max_connections)
+        with redis_seconds.time(op='pipeline'):
+            # queued and decoded alike even if the scripts are refused meanwhile
+            chunking = redis_chunks.chunking()
+            replies = await redis_chunks.async_execute(self._client, lambda pipe: _queue_ops(pipe, ops, chunking), self._transaction)
+        self.results = []
+        for (kind, key, _), reply in zip(ops, replies):
+            if kind == 'get':
+                value = await redis_chunks.async_resolve(self._client, key, reply, self._max_connections)
+                self.results.append(_loads(value))
+                continue
+            result, header = _decode_write(kind, reply, chunking)
+            await redis_chunks.async_drop_segments(self._client, key, header)
+            self.results.append(result)
+        return self.results
+
+    async def reset(self):
+        self._ops = []
+        self._segments = []
+
+    async def __aenter__(self) -> 'AsyncRedisPipeline':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.execute()
+        await self.reset()
+
+
+class AsyncRedisDB:
+    """
+    `RedisDB` on redis.asyncio, the operations are coroutines and do not
+    block the event loop. Connections belong to the event loop that opened
+    them, every loop gets its own client.
+    """
+    def __init__(self, host: str = None, port: int = None, config: RedisConfig = None):
+        if config is None:
+            config = RedisConfig.from_env()
+            config = config._replace(host=host or config.host, port=port or config.port)
+        self.config = config
+        self._notify = None
+        self._notify_checked = False
+
+    def _client(self) -> aioredis.Redis:
+        return get_async_client(self.config)
+
+    async def set(self, key: str, value):
+        data = _dumps(value)
+        client = self._client()
+        if redis_chunks.should_chunk(data):
+            data, segments = redis_chunks.split(key, data)
+            with redis_seconds.time(op='set_segments'):
+                await redis_chunks.async_write_segments(client, segments, self.config.max_connections)
+        with redis_seconds.time(op='set'):
+            if redis_chunks.chunking():
+                [headers] = await redis_chunks.async_execute(client, lambda pipe: redis_chunks.queue_set(pipe, [(key, data)]))
+                await redis_chunks.async_drop_segments(client, key, headers[0])
+                ok = True
+            else:
+                ok = await client.set(key, data)
+        if ok is not True:
+            logging.error(f"Failed to set key {key}")
+            return False
+        logging.debug(f"Set key {key} succeed")
+        return True
+    async def get(self, key: str):
+        client = self._client()
+        with redis_seconds.time(op='get'):
+            value = await client.get(key)
+            value = await redis_chunks.async_resolve(client, key, value, self.config.max_connections)
+        if value is None:
+            logging.debug(f"Key {key} not found")
+            return None
+        return _loads(value)
+    async def delete(self, key: str):
+        client = self._client()
+        with redis_seconds.time(op='delete'):
+            if redis_chunks.chunking():
+                [[deleted, headers]] = await redis_chunks.async_execute(client, lambda pipe: redis_chunks.queue_delete(pipe, [key]))
+                await redis_chunks.async_drop_segments(client, key, headers[0])
+            else:
+                deleted = await client.delete(key)
+        if deleted == 0:
+            logging.debug(f"Key {key} not found, nothing deleted")
+            return False
+        return True
+    async def exists(self, key: str) -> bool:
+        return await self._client().exists(key) > 0
+    async def scan(self, prefix: str = '', count: int = 1000) -> AsyncIterator[str]:
+        """`RedisDB.scan` as an async iterator, it may return a key twice too."""
+        async for key in self._client().scan_iter(match=_match_prefix(prefix), count=count):
+            key = key.decode('utf-8')
+            if not redis_chunks.is_segment_key(key):
+                yield key
+
+    async def mget(self, keys: Iterable[str]) -> list[Any]:
+        keys = list(keys)
+        if not keys:
+            return []
+        client = self._client()
+        if self.config.cluster:
+            with redis_seconds.time(op='mget'):
+                values = await client.mget_nonatomic(keys)
+        else:
+            pipe = client.pipeline(transaction=False)
+            for chunk in _chunks(keys, redis_db.redis_batch_size):
+                pipe.mget(chunk)
+            with redis_seconds.time(op='mget'):
+                values = [value for reply in await pipe.execute() for value in reply]
+        return [_loads(await redis_chunks.async_resolve(client, key, value, self.config.max_connections))
+                for key, value in zip(keys, values)]
+    async def mset(self, mapping: dict[str, Any]) -> bool:
+        if not mapping:
+            return True
+        items = []
+        ok = True
+        for key, value in mapping.items():
+            data = _dumps(value)
+            if redis_chunks.should_chunk(data):
+                ok = await self.set(key, value) and ok
+            else:
+                items.append((key, data))
+        if not items:
+            return ok
+        client = self._client()
+        if redis_chunks.chunking():
+            batches = list(_chunks(items, self._script_batch_size()))
+            def queue(pipe):
+                for batch in batches:
+                    redis_chunks.queue_set(pipe, batch)
+            with redis_seconds.time(op='mset'):
+                replies = await redis_chunks.async_execute(client, queue)
+            for batch, headers in zip(batches, replies):
+                for (key, _), header in zip(batch, headers):
+                    await redis_chunks.async_drop_segments(client, key, header)
+            return ok
+        if self.config.cluster:
+            with redis_seconds.time(op='mset'):
+                replies = await client.mset_nonatomic(dict(items))
+        else:
+            pipe = client.pipeline(transaction=False)
+            for chunk in _chunks(items, redis_db.redis_batch_size):
+                pipe.mset(dict(chunk))
+            with redis_seconds.time(op='mset'):
+                replies = await pipe.execute()
+        if not all(reply is True for reply in replies):
+            logging.error(f"Failed to set {len(items)} keys")
+            return False
+        return ok
+    async def mdelete(self, keys: Iterable[str]) -> int:
+        keys = list(keys)
+        if not keys:
+            return 0
+        client = self._client()
+        if redis_chunks.chunking():
+            batches = list(_chunks(keys, self._script_batch_size()))
+            def queue(pipe):
+                for batch in batches:
+                    redis_chunks.queue_delete(pipe, batch)
+            with redis_seconds.time(op='mdelete'):
+                replies = await redis_chunks.async_execute(client, queue)
+            deleted = 0
+            for batch, (count, headers) in zip(batches, replies):
+                deleted += count
+                for key, header in zip(batch, headers):
+                    await redis_chunks.async_drop_segments(client, key, header)
+            return deleted
+        if self.config.cluster:
+            with redis_seconds.time(op='mdelete'):
+                return await client.delete(*keys)
+        pipe = client.pipeline(transaction=False)
+        for chunk in _chunks(keys, redis_db.redis_batch_size):
+            pipe.delete(*chunk)
+        with redis_seconds.time(op='mdelete'):
+            return sum(await pipe.execute())
+    def _script_batch_size(self) -> int:
+        return 1 if self.config.cluster else redis_db.redis_batch_size
+    def pipeline(self, transaction: bool = False) -> AsyncRedisPipeline:
+        return AsyncRedisPipeline(self._client(), transaction, self.config.max_connections)
+
+    async def _keyspace_events(self) -> bool | None:
+        if not self._notify_checked:
+            notify = False
+            if redis_db.redis_keyspace_events != 'off' and not self.config.cluster:
+                client = self._client()
+                try:
+                    flags = (await client.config_get('notify-keyspace-events')).get('notify-keyspace-events', '')
+                    notify = _keyspace_flags_enabled(flags)
+                    if not notify and redis_db.redis_keyspace_events == 'on':
+                        await client.config_set('notify-keyspace-events', flags + 'K$')
+                        notify = True
+                except redis.ResponseError:
+                    notify = None
+            self._notify = notify
+            self._notify_checked = True
+        return self._notify
+    async def wait_get(self, key: str, timeout: float = None):
+        """`RedisDB.wait_get` without blocking the event loop."""
+        value = await self.get(key)
+        if value is not None:
+            return value
+        deadline = None if timeout is None else time.monotonic() + timeout
+        notify = await self._keyspace_events()
+        if notify is False:
+            delay = 0.001
+            while True:
+                remaining = _remaining(deadline)
+                if remaining is not None and remaining <= 0:
+                    return None
+                await asyncio.sleep(delay if remaining is None else min(delay, remaining))
+                delay = min(delay * 2, 0.1)
+                value = await self.get(key)
+                if value is not None:
+                    return value
+        client = self._client()
+        db = self.config.db
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(f'__keyspace@{db}__:{key}')
+            delay = 0.001
+            while True:
+                value = await self.get(key)
+                if value is not None:
+                    return value
+                remaining = _remaining(deadline)
+                if remaining is not None and remaining <= 0:
+                    return None
+                wait = 1.0 if notify else delay
+                delay = min(delay * 2, 0.1)
+                await pubsub.get_message(timeout=wait if remaining is None else min(remaining, wait))
+        finally:
+            await pubsub.aclose()
@@ -0,0 +1,286 @@
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, List
+
+from faasit_runtime.runtime.faasit_runtime import StorageMethods, StoragePipeline
+from faasit_runtime.utils import metrics
+
+# Process-wide read-through cache for function storage. Runtimes are built
+# per request, so entries are kept in one LRU shared by every CachedStorage
+# and keyed by (scope, filename), the scope names the backend (redis
+# address, bucket, directory).
+#   FAASIT_STORAGE_CACHE_BYTES  capacity, 0 (default) disables the cache
+#   FAASIT_STORAGE_CACHE_TTL    seconds an entry stays valid, 5 by default
+#
+# Only writes through this process invalidate entries, values written by
+# other containers are seen once the TTL expires, so it must be set. Entries hold the stored
+# bytes of a value, every hit decodes its own copy.
+
+cache_hits = metrics.counter('faasit_storage_cache_hits_total', 'Storage reads answered by the cache')
+cache_misses = metrics.counter('faasit_storage_cache_misses_total', 'Storage reads that went to the backend')
+cache_evictions = metrics.counter('faasit_storage_cache_evictions_total', 'Entries evicted to stay under the byte budget')
+
+
+# keys whose generation is tracked, past it the generations start over
+_MAX_GENERATIONS = 65536
+
+_DEFAULT_TTL = 5.0
+
+
+def sizeof(value: Any) -> int:
+    """Approximate number of bytes a cached value holds."""
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, memoryview):
+        return value.nbytes
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Thread safe LRU bounded by the total size of its values, with an
+    optional TTL. Every invalidation moves the key to a new generation: a
+    reader takes `generation(key)` before it reads the backend and passes
+    it to `put`, which drops the value if the key was written meanwhile.
+    """
+    def __init__(self, max_bytes: int, ttl: float = 0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (value, size, expires_at)
+        self._entries: OrderedDict[Hashable, tuple[Any, int, float]] = OrderedDict()
+        # invalidations per key, reset with a new epoch when too many keys are tracked
+        self._generations: dict[Hashable, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                cache_misses.inc()
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            cache_hits.inc()
+            return entry[0]
+
+    def generation(self, key: Hashable) -> tuple[int, int]:
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def put(self, key: Hashable, value: Any, size: int = None, generation: tuple[int, int] = None):
+        size = sizeof(value) if size is None else size
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else 0
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(key, 0)):
+                # read before a write to the key finished, may be stale
+                return
+            self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+                cache_evictions.inc()
+
+    def contains(self, key: Hashable) -> bool:
+        # does not count as a hit or a miss
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not (entry[2] and entry[2] < time.monotonic())
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._remove(key)
+            if key not in self._generations and len(self._generations) >= _MAX_GENERATIONS:
+                # fills in flight from the previous epoch are all dropped
+                self._generations.clear()
+                self._epoch += 1
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+_cache: LRUCache | None = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> LRUCache | None:
+    """The process-wide cache, None when FAASIT_STORAGE_CACHE_BYTES is not set."""
+    global _cache
+    if _cache is None:
+        max_bytes = int(os.environ.get('FAASIT_STORAGE_CACHE_BYTES', 0))
+        if max_bytes <= 0:
+            return None
+        ttl = float(os.environ.get('FAASIT_STORAGE_CACHE_TTL', _DEFAULT_TTL))
+        if ttl <= 0:
+            raise ValueError(f"FAASIT_STORAGE_CACHE_TTL must be positive, got {ttl}")
+        with _cache_lock:
+            if _cache is None:
+                _cache = LRUCache(max_bytes, ttl)
+                metrics.gauge('faasit_storage_cache_bytes', 'Bytes held by the storage cache', fn=lambda: _cache.bytes)
+    return _cache
+
+
+class CachedStorage(StorageMethods):
+    """
+    Read-through cache in front of `storage`, which must implement
+    `get_raw`/`mget_raw`/`decode`. Writes invalidate before and after.
+    """
+    def __init__(self, storage: StorageMethods, scope: str, cache: LRUCache):
+        self._storage = storage
+        self._scope = scope
+        self._cache = cache
+
+    def _key(self, filename: str) -> tuple:
+        return (self._scope, filename)
+
+    def _fill(self, key: tuple, data, generation: tuple[int, int]):
+        # immutable, decoded values never share memory with the entry
+        data = data if isinstance(data, bytes) else bytes(data)
+        self._cache.put(key, data, len(data), generation)
+        return data
+
+    def get(self, filename: str, timeout = -1) -> Any:
+        key = self._key(filename)
+        data = self._cache.get(key)
+        if data is None:
+            generation = self._cache.generation(key)
+            data = self._storage.get_raw(filename, timeout)
+            if data is None:
+                return None
+            data = self._fill(key, data, generation)
+        return self._storage.decode(data)
+
+    def wait_get(self, filename: str, timeout: float = None) -> Any:
+        data = self._cache.get(self._key(filename))
+        if data is not None:
+            return self._storage.decode(data)
+        # filled by the next get, the backend hands out decoded values here
+        return self._storage.wait_get(filename, timeout)
+
+    def put(self, filename: str, data) -> None:
+        self._cache.invalidate(self._key(filename))
+        try:
+            return self._storage.put(filename, data)
+        finally:
+            self._cache.invalidate(self._key(filename))
+
+    def delete(self, filename: str) -> None:
+        self._cache.invalidate(self._key(filename))
+        try:
+            return self._storage.delete(filename)
+        finally:
+            self._cache.invalidate(self._key(filename))
+
+    def exists(self, filename: str) -> bool:
+        if self._cache.contains(self._key(filename)):
+            return True
+        return self._storage.exists(filename)
+
+    def list(self, *args, **kwargs) -> List:
+        return self._storage.list(*args, **kwargs)
+
+    def mget(self, filenames: List[str]) -> List[Any]:
+        filenames = list(filenames)
+        keys = [self._key(filename) for filename in filenames]
+        raws = [self._cache.get(key) for key in keys]
+        missing = [i for i, data in enumerate(raws) if data is None]
+        if missing:
+            generations = [self._cache.generation(keys[i]) for i in missing]
+            fetched = self._storage.mget_raw([filenames[i] for i in missing])
+            for i, generation, data in zip(missing, generations, fetched):
+                if data is not None:
+                    raws[i] = self._fill(keys[i], data, generation)
+        return [None if data is None else self._storage.decode(data) for data in raws]
+
+    def _invalidate(self, filenames):
+        for filename in filenames:
+            self._cache.invalidate(self._key(filename))
+
+    def mput(self, items: dict[str, Any]) -> None:
+        self._invalidate(items)
+        try:
+            return self._storage.mput(items)
+        finally:
+            self._invalidate(items)
+
+    def mdelete(self, filenames: List[str]) -> None:
+        filenames = list(filenames)
+        self._invalidate(filenames)
+        try:
+            return self._storage.mdelete(filenames)
+        finally:
+            self._invalidate(filenames)
+
+    def pipeline(self) -> StoragePipeline:
+        return self.CachedPipeline(self)
+
+    class CachedPipeline(StoragePipeline):
+        # runs on the backend's pipeline, written keys are invalidated around it
+        def _run(self, ops: list[tuple]) -> list:
+            storage: CachedStorage = self._storage
+            written = [args[0] for op, *args in ops if op in ('put', 'delete')]
+            storage._invalidate(written)
+            try:
+                with storage._storage.pipeline() as pipe:
+                    for op, *args in ops:
+                        getattr(pipe, op)(*args)
+                return pipe.results
+            finally:
+                storage._invalidate(written)
+
+    def __getattr__(self, name: str):
+        # backend specific operations go straight to the backend
+        return getattr(self._storage, name)
+
+
+def cached(storage: StorageMethods, scope: str) -> StorageMethods:
+    """`storage` behind the process-wide cache when it is enabled, else `storage` itself."""
+    cache = get_cache()
+    if cache is None:
+        return storage
+    return CachedStorage(storage, scope, cache)
+
+
+__all__ = [
+    "LRUCache",
+    "CachedStorage",
+    "get_cache",
+    "cached",
+]
@@ -0,0 +1,349 @@
+import os
+import uuid
+import struct
+import asyncio
+import hashlib
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import redis
+import redis.asyncio as aioredis
+from faasit_runtime.utils.logging import log as logging
+
+# Values larger than `redis_chunk_threshold` bytes are stored as segments of
+# `redis_chunk_size` bytes, one SET each, so no single command holds the
+# server (and every other client) for the whole transfer. The key itself
+# holds a small manifest naming the segments:
+#   key                                       magic | size:u64 | count:u32 | version:16s
+#   __faasit_chunk__:{key}:{version}:{i}      bytes [i * chunk_size, (i + 1) * chunk_size)
+# Segments are written before the manifest and a new version gets new
+# segment keys, readers see either the old or the new value. The segments
+# of a replaced or deleted value are removed by the writer, a reader that
+# lost the race reads the manifest again. Writes and deletes are script
+# calls that return the manifest a key held in the same command, see
+# SET_SCRIPT below. A server that refuses the scripts (ACLs, scripting
+# disabled) gets plain SET and DEL: chunking is turned off for the rest of
+# the process, values are written whole and the segments of values chunked
+# before are left behind when they are replaced.
+#   FAASIT_REDIS_CHUNK_THRESHOLD   bytes from which values are chunked, 0 disables chunking
+#   FAASIT_REDIS_CHUNK_SIZE        bytes per segment
+#   FAASIT_REDIS_CHUNK_PARALLEL    connections moving segments of one value at a time
+redis_chunk_threshold = int(os.getenv('FAASIT_REDIS_CHUNK_THRESHOLD', 8 * 1024 * 1024))
+redis_chunk_size = int(os.getenv('FAASIT_REDIS_CHUNK_SIZE', 1024 * 1024))
+redis_chunk_parallel = int(os.getenv('FAASIT_REDIS_CHUNK_PARALLEL', 4))
+
+CHUNK_MAGIC = b'FRTCHK1\x00'
+CHUNK_KEY_PREFIX = '__faasit_chunk__:'
+_manifest = struct.Struct('<QI16s')
+MANIFEST_LEN = len(CHUNK_MAGIC) + _manifest.size
+
+# segments per pipeline, a worker sends this many per round trip
+_SEGMENTS_PER_BATCH = 8
+_READ_ATTEMPTS = 3
+
+
+# set once the server refused the scripts
+_scripts_refused = False
+
+
+def should_chunk(data: bytes) -> bool:
+    return chunking() and len(data) > redis_chunk_threshold
+
+def chunking() -> bool:
+    return redis_chunk_threshold > 0 and not _scripts_refused
+
+def parse_manifest(value) -> tuple[int, int, str] | None:
+    """(size, count, version) if `value` is a manifest, else None."""
+    if value is None or len(value) != MANIFEST_LEN or not value.startswith(CHUNK_MAGIC):
+        return None
+    size, count, version = _manifest.unpack_from(value, len(CHUNK_MAGIC))
+    return size, count, version.decode('ascii')
+
+def segment_keys(key: str, count: int, version: str) -> list[str]:
+    return [f"{CHUNK_KEY_PREFIX}{key}:{version}:{i}" for i in range(count)]
+
+def is_segment_key(key: str) -> bool:
+    return key.startswith(CHUNK_KEY_PREFIX)
+
+def split(key: str, data: bytes) -> tuple[bytes, list[tuple[str, memoryview]]]:
+    """The manifest of `data` stored under `key` and its (segment key, bytes)."""
+    view = memoryview(data)
+    count = -(-len(view) // redis_chunk_size)
+    version = uuid.uuid4().hex[:16]
+    manifest = CHUNK_MAGIC + _manifest.pack(len(view), count, version.encode('ascii'))
+    keys = segment_keys(key, count, version)
+    return manifest, [(k, view[i * redis_chunk_size:(i + 1) * redis_chunk_size]) for i, k in enumerate(keys)]
+
+def _batches(items: list, size: int = _SEGMENTS_PER_BATCH) -> list[list]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def _parallel(max_connections: int | None) -> int:
+    # the segments of one value must not exhaust a bounded pool
+    if max_connections:
+        return max(1, min(redis_chunk_parallel, max_connections // 2))
+    return max(1, redis_chunk_parallel)
+
+def _old_segments(key: str, header) -> list[str]:
+    manifest = parse_manifest(header)
+    return segment_keys(key, manifest[1], manifest[2]) if manifest else []
+
+
+# The scripts only read a key that is a string of a manifest's length,
+# keys of any other type or size are replaced or deleted as SET and DEL do,
+# without a WRONGTYPE error. One call covers a batch of keys, in cluster
+# mode the keys of a call must share a slot and a call takes a single key.
+# Every call replies with the old manifest of each key ('' for none).
+_OLD_MANIFEST = """
+local function old_manifest(key)
+  if redis.call('TYPE', key).ok == 'string' and redis.call('STRLEN', key) == tonumber(ARGV[1]) then
+    local value = redis.call('GET', key)
+    if string.sub(value, 1, #ARGV[2]) == ARGV[2] then
+      return value
+    end
+  end
+  return ''
+end
+"""
+
+SET_SCRIPT = _OLD_MANIFEST + """
+local old = {}
+for i, key in ipairs(KEYS) do
+  old[i] = old_manifest(key)
+  redis.call('SET', key, ARGV[i + 2])
+end
+return old
+"""
+
+DELETE_SCRIPT = _OLD_MANIFEST + """
+local old, deleted = {}, 0
+for i, key in ipairs(KEYS) do
+  old[i] = old_manifest(key)
+  deleted = deleted + redis.call('DEL', key)
+end
+return {deleted, old}
+"""
+
+_scripts = {hashlib.sha1(script.encode('utf-8')).hexdigest(): script for script in (SET_SCRIPT, DELETE_SCRIPT)}
+_SET_SHA, _DELETE_SHA = _scripts
+# clients the scripts were loaded through, a restarted server forgets them
+_loaded: weakref.WeakSet = weakref.WeakSet()
+
+def queue_set(pipe, items: list[tuple[str, bytes]]):
+    """Queue one call setting the (key, data) `items`, it replies with their old manifests."""
+    keys = [key for key, _ in items]
+    pipe.evalsha(_SET_SHA, len(keys), *keys, MANIFEST_LEN, CHUNK_MAGIC, *(data for _, data in items))
+
+def queue_delete(pipe, keys: list[str]):
+    """Queue one call deleting `keys`, it replies with [deleted count, old manifests]."""
+    pipe.evalsha(_DELETE_SHA, len(keys), *keys, MANIFEST_LEN, CHUNK_MAGIC)
+
+
+def _refused(e: redis.ResponseError) -> bool:
+    # NOSCRIPT is handled by loading the scripts, OOM, BUSY... are not refusals
+    if isinstance(e, redis.exceptions.NoScriptError):
+        return False
+    if isinstance(e, redis.exceptions.NoPermissionError):
+        return True
+    message = str(e).lower()
+    return 'unknown command' in message or 'disabled' in message or 'not support' in message
+
+def _refuse(e: redis.ResponseError):
+    global _scripts_refused
+    if not _scripts_refused:
+        _scripts_refused = True
+        logging.warning(f"Redis refused the chunking scripts, large values are stored whole from now on: {e}")
+
+
+class _Recorder:
+    """Stands in for a pipeline and records the commands queued on it."""
+    def __init__(self):
+        self.commands: list[tuple[str, tuple]] = []
+
+    def __getattr__(self, name: str):
+        def command(*args):
+            self.commands.append((name, args))
+            return self
+        return command
+
+def _queue_plain(pipe, queue) -> list:
+    # queue what `queue` does with script calls replaced by MSET and DEL,
+    # returns per command a function giving its reply the script's shape
+    recorder = _Recorder()
+    queue(recorder)
+    shapes = []
+    for name, args in recorder.commands:
+        if name != 'evalsha':
+            getattr(pipe, name)(*args)
+            shapes.append(None)
+            continue
+        sha, count = args[0], args[1]
+        keys = args[2:2 + count]
+        if sha == _SET_SHA:
+            pipe.mset(dict(zip(keys, args[4 + count:])))
+            shapes.append(lambda reply, count=count: [b''] * count)
+        else:
+            pipe.delete(*keys)
+            shapes.append(lambda reply, count=count: [reply, [b''] * count])
+    return shapes
+
+def _shape(shapes: list, replies: list) -> list:
+    return [reply if shape is None else shape(reply) for shape, reply in zip(shapes, replies)]
+
+
+# synchronous client
+
+def execute(client: redis.Redis, queue, transaction: bool = False) -> list:
+    """
+    Replies of the commands `queue(pipe)` adds to a pipeline, which may call
+    the scripts. If the server refuses them the commands are sent again
+    without, the replies of the calls keep their shape.
+    """
+    if not _scripts_refused:
+        try:
+            return _execute_scripts(client, queue, transaction)
+        except redis.ResponseError as e:
+            # the calls did not run, and the other commands are reads
+            if not _refused(e):
+                raise
+            _refuse(e)
+    pipe = client.pipeline(transaction=transaction)
+    shapes = _queue_plain(pipe, queue)
+    return _shape(shapes, pipe.execute())
+
+def _execute_scripts(client: redis.Redis, queue, transaction: bool) -> list:
+    for attempt in range(2):
+        if chunking() and client not in _loaded:
+            for script in _scripts.values():
+                client.script_load(script)
+            _loaded.add(client)
+        pipe = client.pipeline(transaction=transaction)
+        queue(pipe)
+        try:
+            return pipe.execute()
+        except redis.exceptions.NoScriptError:
+            # the scripts did not run, the queue is sent again once they are loaded
+            _loaded.discard(client)
+            if attempt:
+                raise
+
+
+# synchronous client
+
+def write_segments(client: redis.Redis, segments: list[tuple[str, memoryview]], max_connections: int = None):
+    def write(batch):
+        pipe = client.pipeline(transaction=False)
+        for k, v in batch:
+            pipe.set(k, v)
+        pipe.execute()
+    with ThreadPoolExecutor(_parallel(max_connections)) as pool:
+        list(pool.map(write, _batches(segments)))
+
+def read_segments(client: redis.Redis, key: str, manifest: tuple[int, int, str], max_connections: int = None) -> bytearray | None:
+    """The value of a manifest, None if its segments are gone (the key was rewritten)."""
+    size, count, version = manifest
+    buf = bytearray(size)
+    keys = list(enumerate(segment_keys(key, count, version)))
+    def read(batch):
+        pipe = client.pipeline(transaction=False)
+        for _, k in batch:
+            pipe.get(k)
+        for (i, _), segment in zip(batch, pipe.execute()):
+            if segment is None:
+                return False
+            buf[i * redis_chunk_size:i * redis_chunk_size + len(segment)] = segment
+        return True
+    with ThreadPoolExecutor(_parallel(max_connections)) as pool:
+        if not all(pool.map(read, _batches(keys))):
+            return None
+    return buf
+
+def resolve(client: redis.Redis, key: str, value, max_connections: int = None):
+    """`value` read from `key`, with a manifest replaced by the value it names."""
+    for _ in range(_READ_ATTEMPTS):
+        manifest = parse_manifest(value)
+        if manifest is None:
+            return value
+        data = read_segments(client, key, manifest, max_connections)
+        if data is not None:
+            return data
+        value = client.get(key)
+    raise redis.RedisError(f"Segments of key {key} keep changing while it is read")
+
+def drop_segments(client: redis.Redis, key: str, header):
+    """Delete the segments of the old value of `key` if `header` (its first bytes) is a manifest."""
+    for batch in _batches(_old_segments(key, header), 1000):
+        client.delete(*batch)
+
+
+# asyncio client
+
+async def async_execute(client: aioredis.Redis, queue, transaction: bool = False) -> list:
+    if not _scripts_refused:
+        try:
+            return await _async_execute_scripts(client, queue, transaction)
+        except redis.ResponseError as e:
+            if not _refused(e):
+                raise
+            _refuse(e)
+    pipe = client.pipeline(transaction=transaction)
+    shapes = _queue_plain(pipe, queue)
+    return _shape(shapes, await pipe.execute())
+
+async def _async_execute_scripts(client: aioredis.Redis, queue, transaction: bool) -> list:
+    for attempt in range(2):
+        if chunking() and client not in _loaded:
+            for script in _scripts.values():
+                await client.script_load(script)
+            _loaded.add(client)
+        pipe = client.pipeline(transaction=transaction)
+        queue(pipe)
+        try:
+            return await pipe.execute()
+        except redis.exceptions.NoScriptError:
+            _loaded.discard(client)
+            if attempt:
+                raise
+
+async def async_write_segments(client: aioredis.Redis, segments: list[tuple[str, memoryview]], max_connections: int = None):
+    limit = asyncio.Semaphore(_parallel(max_connections))
+    async def write(batch):
+        async with limit:
+            pipe = client.pipeline(transaction=False)
+            for k, v in batch:
+                pipe.set(k, v)
+            await pipe.execute()
+    await asyncio.gather(*(write(batch) for batch in _batches(segments)))
+
+async def async_read_segments(client: aioredis.Redis, key: str, manifest: tuple[int, int, str], max_connections: int = None) -> bytearray | None:
+    size, count, version = manifest
+    buf = bytearray(size)
+    keys = list(enumerate(segment_keys(key, count, version)))
+    limit = asyncio.Semaphore(_parallel(max_connections))
+    async def read(batch):
+        async with limit:
+            pipe = client.pipeline(transaction=False)
+            for _, k in batch:
+                pipe.get(k)
+            segments = await pipe.execute()
+        for (i, _), segment in zip(batch, segments):
+            if segment is None:
+                return False
+            buf[i * redis_chunk_size:i * redis_chunk_size + len(segment)] = segment
+        return True
+    if not all(await asyncio.gather(*(read(batch) for batch in _batches(keys)))):
+        return None
+    return buf
+
+async def async_resolve(client: aioredis.Redis, key: str, value, max_connections: int = None):
+    for _ in range(_READ_ATTEMPTS):
+        manifest = parse_manifest(value)
+        if manifest is None:
+            return value
+        data = await async_read_segments(client, key, manifest, max_connections)
+        if data is not None:
+            return data
+        value = await client.get(key)
+    raise redis.RedisError(f"Segments of key {key} keep changing while it is read")
+
+async def async_drop_segments(client: aioredis.Redis, key: str, header):
+    for batch in _batches(_old_segments(key, header), 1000):
+        await client.delete(*batch)
@@ -0,0 +1,166 @@
+import os
+import asyncio
+import threading
+import weakref
+from typing import NamedTuple, Any
+import redis
+import redis.asyncio as aioredis
+from redis.backoff import ExponentialBackoff
+
+# Every redis connection of the runtime is configured here and clients are
+# shared per configuration, so a process holds one connection pool per
+# server however many RedisDB/storage objects it builds. From the
+# environment:
+#   REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_PASSWORD
+#   REDIS_UNIX_SOCKET              path of a unix socket, replaces host/port
+#   REDIS_MAX_CONNECTIONS          connections per pool (per node in cluster mode)
+#   REDIS_SOCKET_TIMEOUT           seconds a command may wait for its reply
+#   REDIS_CONNECT_TIMEOUT          seconds a connection may take to establish
+#   REDIS_RETRIES                  retries with exponential backoff on connection errors
+#   REDIS_RETRY_ON_TIMEOUT         also retry commands that timed out
+#   REDIS_HEALTH_CHECK_INTERVAL    seconds idle connections are PINGed after before reuse
+#   REDIS_CLUSTER                  REDIS_HOST:REDIS_PORT is a node of a Redis Cluster
+# Unset values keep the redis-py defaults.
+
+
+def _env(name: str, cast, default=None):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    if cast is bool:
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return cast(value)
+
+
+class RedisConfig(NamedTuple):
+    host: str = '10.0.0.100'
+    port: int = 6379
+    db: int = 0
+    password: str | None = None
+    unix_socket: str | None = None
+    max_connections: int | None = None
+    socket_timeout: float | None = None
+    connect_timeout: float | None = None
+    retries: int | None = None
+    retry_on_timeout: bool = False
+    health_check_interval: int = 0
+    cluster: bool = False
+
+    @classmethod
+    def from_env(cls, **defaults) -> 'RedisConfig':
+        """The configuration in the environment, `defaults` replace the built-in defaults."""
+        base = cls()._replace(**defaults)
+        return cls(
+            host=_env('REDIS_HOST', str, base.host),
+            port=_env('REDIS_PORT', int, base.port),
+            db=_env('REDIS_DB', int, base.db),
+            password=_env('REDIS_PASSWORD', str, base.password),
+            unix_socket=_env('REDIS_UNIX_SOCKET', str, base.unix_socket),
+            max_connections=_env('REDIS_MAX_CONNECTIONS', int, base.max_connections),
+            socket_timeout=_env('REDIS_SOCKET_TIMEOUT', float, base.socket_timeout),
+            connect_timeout=_env('REDIS_CONNECT_TIMEOUT', float, base.connect_timeout),
+            retries=_env('REDIS_RETRIES', int, base.retries),
+            retry_on_timeout=_env('REDIS_RETRY_ON_TIMEOUT', bool, base.retry_on_timeout),
+            health_check_interval=_env('REDIS_HEALTH_CHECK_INTERVAL', int, base.health_check_interval),
+            cluster=_env('REDIS_CLUSTER', bool, base.cluster),
+        )
+
+    @property
+    def url(self) -> str:
+        # names the server, used as cache scope and in logs, never holds the password
+        if self.unix_socket:
+            return f"unix://{self.unix_socket}?db={self.db}"
+        scheme = 'redis+cluster' if self.cluster else 'redis'
+        return f"{scheme}://{self.host}:{self.port}/{self.db}"
+
+    def _kwargs(self, retry_cls) -> dict[str, Any]:
+        if self.cluster and self.unix_socket:
+            raise ValueError("Redis Cluster nodes cannot be reached through a unix socket")
+        if self.cluster and self.db != 0:
+            raise ValueError("Redis Cluster only has database 0")
+        kwargs: dict[str, Any] = {'password': self.password, 'health_check_interval': self.health_check_interval}
+        if self.unix_socket:
+            kwargs['unix_socket_path'] = self.unix_socket
+        else:
+            kwargs.update(host=self.host, port=self.port)
+        if not self.cluster:
+            kwargs['db'] = self.db
+        if self.max_connections is not None:
+            kwargs['max_connections'] = self.max_connections
+        if self.socket_timeout is not None:
+            kwargs['socket_timeout'] = self.socket_timeout
+        if self.connect_timeout is not None:
+            kwargs['socket_connect_timeout'] = self.connect_timeout
+        if self.retries is not None:
+            kwargs['retry'] = retry_cls(ExponentialBackoff(), self.retries)
+        if self.retry_on_timeout:
+            kwargs['retry_on_error'] = [redis.TimeoutError]
+        return kwargs
+
+    def client(self) -> redis.Redis:
+        """A new client with its own pool, prefer `get_client`."""
+        from redis.retry import Retry
+        kwargs = self._kwargs(Retry)
+        if self.cluster:
+            from redis.cluster import RedisCluster
+            return RedisCluster(**kwargs)
+        return redis.Redis(**kwargs)
+
+    def async_client(self) -> aioredis.Redis:
+        """A new asyncio client, bound to the running event loop once used, prefer `get_async_client`."""
+        from redis.asyncio.retry import Retry
+        kwargs = self._kwargs(Retry)
+        if self.cluster:
+            from redis.asyncio.cluster import RedisCluster
+            return RedisCluster(**kwargs)
+        return aioredis.Redis(**kwargs)
+
+
+_clients: dict[RedisConfig, redis.Redis] = {}
+_clients_pid = os.getpid()
+_clients_lock = threading.Lock()
+_async_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[RedisConfig, aioredis.Redis]] = weakref.WeakKeyDictionary()
+
+
+def get_client(config: RedisConfig = None) -> redis.Redis:
+    """The process-wide client of `config` (default: the environment), thread safe."""
+    global _clients_pid
+    config = config or RedisConfig.from_env()
+    if _clients_pid != os.getpid():
+        # connections are not shared with a forked parent
+        with _clients_lock:
+            if _clients_pid != os.getpid():
+                _clients.clear()
+                _clients_pid = os.getpid()
+    client = _clients.get(config)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(config)
+            if client is None:
+                client = _clients[config] = config.client()
+    return client
+
+
+def get_async_client(config: RedisConfig = None) -> aioredis.Redis:
+    """The asyncio client of `config` for the running event loop."""
+    config = config or RedisConfig.from_env()
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(config)
+    if client is None:
+        client = clients[config] = config.async_client()
+    return client
+
+
+def reset_clients() -> None:
+    """Forget the shared clients, e.g. after a process restore invalidated their sockets."""
+    with _clients_lock:
+        _clients.clear()
+    _async_clients.clear()
+
+
+__all__ = [
+    "RedisConfig",
+    "get_client",
+    "get_async_client",
+    "reset_clients",
+]
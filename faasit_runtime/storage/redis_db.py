@@ -1,35 +1,382 @@
+import os
+import time
 import redis
-import pickle
+from typing import Any, Iterable, Iterator, TYPE_CHECKING
 from faasit_runtime.utils.logging import log as logging
+from faasit_runtime.utils.serializer import storage_serializer
+from faasit_runtime.utils import metrics
+from .redis_conn import RedisConfig, get_client
+from . import redis_chunks
+if TYPE_CHECKING:
+    from .async_redis_db import AsyncRedisDB
+
+redis_seconds = metrics.histogram('faasit_redis_duration_seconds', 'Redis round trip time, by operation', ('op',))
+
+# keys per MGET/MSET/DEL command in the batched operations, all commands of
+# one batch still go out in a single round trip
+redis_batch_size = int(os.getenv('FAASIT_REDIS_BATCH_SIZE', 1000))
+
+
+# wait_get is woken by keyspace notifications when the server sends them:
+#   auto  (default) use them if notify-keyspace-events already has K and $
+#         (or A), otherwise poll with backoff. The server's configuration is
+#         left alone, enable the flags there to make wait_get block.
+#   on    opt-in: turn K$ on with CONFIG SET if it is missing. This changes
+#         the server for every client of it and makes it publish an event
+#         for every string write, only use it on a server the functions own.
+#   off   always poll
+# With auto and on, a server that refuses CONFIG (common on managed ones) is
+# subscribed to and polled with backoff at the same time.
+redis_keyspace_events = os.getenv('FAASIT_REDIS_KEYSPACE_EVENTS', 'auto').strip().lower()
+
+
+def _dumps(value) -> bytes:
+    return storage_serializer().dumps(value)
+
+def _loads(value):
+    if value is None:
+        return None
+    try:
+        return storage_serializer().loads(value)
+    except:
+        return value
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _keyspace_flags_enabled(flags: str) -> bool:
+    return 'K' in flags and ('A' in flags or '$' in flags)
+
+def _match_prefix(prefix: str) -> str:
+    # SCAN MATCH pattern for keys starting with `prefix`, glob characters escaped
+    return ''.join('\\' + c if c in '*?[]\\' else c for c in prefix) + '*'
+
+def _remaining(deadline: float | None) -> float | None:
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class RedisPipeline:
+    """
+    Queues set/get/delete and sends them in one round trip on `execute`, or
+    when the `with` block exits. `results` holds the decoded replies in the
+    order the operations were queued. With `transaction` the operations run
+    in MULTI/EXEC.
+    """
+    def __init__(self, client: redis.Redis, transaction: bool = False, max_connections: int = None):
+        self._client = client
+        self._transaction = transaction
+        self._max_connections = max_connections
+        # (kind, key, serialized value) per queued operation
+        self._ops: list[tuple[str, str, bytes | None]] = []
+        # segments of chunked values, written before the pipeline runs
+        self._segments = []
+        self.results: list | None = None
+
+    def set(self, key: str, value) -> 'RedisPipeline':
+        data = _dumps(value)
+        if redis_chunks.should_chunk(data):
+            data, segments = redis_chunks.split(key, data)
+            self._segments.extend(segments)
+        self._ops.append(('set', key, data))
+        return self
+
+    def get(self, key: str) -> 'RedisPipeline':
+        self._ops.append(('get', key, None))
+        return self
+
+    def delete(self, key: str) -> 'RedisPipeline':
+        self._ops.append(('delete', key, None))
+        return self
+
+    def execute(self) -> list:
+        ops, self._ops = self._ops, []
+        segments, self._segments = self._segments, []
+        if not ops:
+            self.results = []
+            return self.results
+        if segments:
+            redis_chunks.write_segments(self._client, segments, self._max_connections)
+        with redis_seconds.time(op='pipeline'):
+            # queued and decoded alike even if the scripts are refused meanwhile
+            chunking = redis_chunks.chunking()
+            replies = redis_chunks.execute(self._client, lambda pipe: _queue_ops(pipe, ops, chunking), self._transaction)
+        self.results = []
+        for (kind, key, _), reply in zip(ops, replies):
+            if kind == 'get':
+                self.results.append(_loads(redis_chunks.resolve(self._client, key, reply, self._max_connections)))
+                continue
+            result, header = _decode_write(kind, reply, chunking)
+            redis_chunks.drop_segments(self._client, key, header)
+            self.results.append(result)
+        return self.results
+
+    def reset(self):
+        self._ops = []
+        self._segments = []
+
+    def __enter__(self) -> 'RedisPipeline':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.execute()
+        self.reset()
+
+
+def _queue_ops(pipe, ops: list[tuple[str, str, bytes | None]], chunking: bool):
+    # sets and deletes go through the scripts while chunking is on, they
+    # return the old manifest to drop the segments of
+    for kind, key, data in ops:
+        if kind == 'get':
+            pipe.get(key)
+        elif kind == 'set':
+            if chunking:
+                redis_chunks.queue_set(pipe, [(key, data)])
+            else:
+                pipe.set(key, data)
+        elif chunking:
+            redis_chunks.queue_delete(pipe, [key])
+        else:
+            pipe.delete(key)
+
+def _decode_write(kind: str, reply, chunking: bool) -> tuple[bool, Any]:
+    # (result, old manifest or None) of a set or delete queued by _queue_ops
+    if not chunking:
+        return (reply is True if kind == 'set' else reply > 0), None
+    if kind == 'set':
+        return True, reply[0]
+    return reply[0] > 0, reply[1][0]
+
 
 class RedisDB:
-    def __init__(self, host: str, port: int):
-        self._redis_host = host
-        self._redis_port = port
-        self._pool = redis.ConnectionPool(host=self._redis_host, port=self._redis_port)
+    def __init__(self, host: str = None, port: int = None, config: RedisConfig = None):
+        # `host`/`port` override the connection configured in the environment
+        if config is None:
+            config = RedisConfig.from_env()
+            config = config._replace(host=host or config.host, port=port or config.port)
+        self.config = config
+        self._async_db = None
+        self._notify = None
+        self._notify_checked = False
+    @property
+    def _client(self) -> redis.Redis:
+        # shared by every RedisDB with the same configuration and thread
+        # safe, connections come from its pool per command
+        return get_client(self.config)
+    def as_async(self) -> 'AsyncRedisDB':
+        """The asyncio counterpart of this database, for coroutine handlers."""
+        if self._async_db is None:
+            from .async_redis_db import AsyncRedisDB
+            self._async_db = AsyncRedisDB(config=self.config)
+        return self._async_db
     def set(self, key: str, value):
-        r = redis.Redis(connection_pool=self._pool)
-        value = pickle.dumps(value)
-        if r.set(key, value) is not True:
+        data = _dumps(value)
+        client = self._client
+        if redis_chunks.should_chunk(data):
+            data, segments = redis_chunks.split(key, data)
+            with redis_seconds.time(op='set_segments'):
+                redis_chunks.write_segments(client, segments, self.config.max_connections)
+        with redis_seconds.time(op='set'):
+            if redis_chunks.chunking():
+                [headers] = redis_chunks.execute(client, lambda pipe: redis_chunks.queue_set(pipe, [(key, data)]))
+                redis_chunks.drop_segments(client, key, headers[0])
+                ok = True
+            else:
+                ok = client.set(key, data)
+        if ok is not True:
             logging.error(f"Failed to set key {key}")
             return False
-        logging.info(f"Set key {key} succeed")
+        logging.debug(f"Set key {key} succeed")
         return True
     def get(self, key: str):
-        r = redis.Redis(connection_pool=self._pool)
-        value = r.get(key)
+        value = self.get_raw(key)
         if value is None:
-            logging.error(f"Failed to get key {key}")
+            logging.debug(f"Key {key} not found")
             return None
-        logging.info(f"Get key {key} succeed")
-        try:
-            return pickle.loads(value)
-        except:
-            return value
+        return _loads(value)
+    def get_raw(self, key: str) -> bytes | bytearray | None:
+        """The stored bytes of `key`, `loads` decodes them."""
+        with redis_seconds.time(op='get'):
+            value = self._client.get(key)
+            return redis_chunks.resolve(self._client, key, value, self.config.max_connections)
+    @staticmethod
+    def loads(data):
+        return _loads(data)
     def delete(self, key: str):
-        r = redis.Redis(connection_pool=self._pool)
-        if r.delete(key) == 0:
-            logging.error(f"Failed to delete key {key}")
+        client = self._client
+        with redis_seconds.time(op='delete'):
+            if redis_chunks.chunking():
+                [[deleted, headers]] = redis_chunks.execute(client, lambda pipe: redis_chunks.queue_delete(pipe, [key]))
+                redis_chunks.drop_segments(client, key, headers[0])
+            else:
+                deleted = client.delete(key)
+        if deleted == 0:
+            logging.debug(f"Key {key} not found, nothing deleted")
+            return False
+        return True
+
+    def exists(self, key: str) -> bool:
+        return self._client.exists(key) > 0
+    def scan(self, prefix: str = '', count: int = 1000) -> Iterator[str]:
+        """
+        Keys starting with `prefix`, fetched with SCAN `count` at a time
+        without blocking the server like KEYS does. The segments of chunked
+        values are skipped. Nothing is kept between pages, so a key may be
+        returned twice when the keyspace is rehashed during the scan, as
+        SCAN itself does. Callers that need each key once dedupe them.
+        """
+        for key in self._client.scan_iter(match=_match_prefix(prefix), count=count):
+            key = key.decode('utf-8')
+            if not redis_chunks.is_segment_key(key):
+                yield key
+
+    def mget(self, keys: Iterable[str]) -> list[Any]:
+        """Values of `keys` in order, None for missing keys."""
+        return [_loads(value) for value in self.mget_raw(keys)]
+    def mget_raw(self, keys: Iterable[str]) -> list[bytes | bytearray | None]:
+        keys = list(keys)
+        if not keys:
+            return []
+        if self.config.cluster:
+            # keys live in different slots, redis-py sends one MGET per slot
+            with redis_seconds.time(op='mget'):
+                values = self._client.mget_nonatomic(keys)
+        else:
+            pipe = self._client.pipeline(transaction=False)
+            for chunk in _chunks(keys, redis_batch_size):
+                pipe.mget(chunk)
+            with redis_seconds.time(op='mget'):
+                values = [value for reply in pipe.execute() for value in reply]
+        return [redis_chunks.resolve(self._client, key, value, self.config.max_connections)
+                for key, value in zip(keys, values)]
+    def mset(self, mapping: dict[str, Any]) -> bool:
+        if not mapping:
+            return True
+        items = []
+        ok = True
+        for key, value in mapping.items():
+            data = _dumps(value)
+            if redis_chunks.should_chunk(data):
+                ok = self.set(key, value) and ok
+            else:
+                items.append((key, data))
+        if not items:
+            return ok
+        client = self._client
+        if redis_chunks.chunking():
+            batches = list(_chunks(items, self._script_batch_size()))
+            def queue(pipe):
+                for batch in batches:
+                    redis_chunks.queue_set(pipe, batch)
+            with redis_seconds.time(op='mset'):
+                replies = redis_chunks.execute(client, queue)
+            for batch, headers in zip(batches, replies):
+                for (key, _), header in zip(batch, headers):
+                    redis_chunks.drop_segments(client, key, header)
+            return ok
+        if self.config.cluster:
+            with redis_seconds.time(op='mset'):
+                replies = client.mset_nonatomic(dict(items))
+        else:
+            pipe = client.pipeline(transaction=False)
+            for chunk in _chunks(items, redis_batch_size):
+                pipe.mset(dict(chunk))
+            with redis_seconds.time(op='mset'):
+                replies = pipe.execute()
+        if not all(reply is True for reply in replies):
+            logging.error(f"Failed to set {len(items)} keys")
             return False
-        logging.info(f"Delete key {key} succeed")
-        return True
\ No newline at end of file
+        return ok
+    def mdelete(self, keys: Iterable[str]) -> int:
+        """Delete `keys`, returns how many existed."""
+        keys = list(keys)
+        if not keys:
+            return 0
+        client = self._client
+        if redis_chunks.chunking():
+            batches = list(_chunks(keys, self._script_batch_size()))
+            def queue(pipe):
+                for batch in batches:
+                    redis_chunks.queue_delete(pipe, batch)
+            with redis_seconds.time(op='mdelete'):
+                replies = redis_chunks.execute(client, queue)
+            deleted = 0
+            for batch, (count, headers) in zip(batches, replies):
+                deleted += count
+                for key, header in zip(batch, headers):
+                    redis_chunks.drop_segments(client, key, header)
+            return deleted
+        if self.config.cluster:
+            with redis_seconds.time(op='mdelete'):
+                return client.delete(*keys)
+        pipe = client.pipeline(transaction=False)
+        for chunk in _chunks(keys, redis_batch_size):
+            pipe.delete(*chunk)
+        with redis_seconds.time(op='mdelete'):
+            return sum(pipe.execute())
+    def _script_batch_size(self) -> int:
+        # keys of one script call must share a slot in cluster mode
+        return 1 if self.config.cluster else redis_batch_size
+    def pipeline(self, transaction: bool = False) -> RedisPipeline:
+        return RedisPipeline(self._client, transaction, self.config.max_connections)
+
+    def _keyspace_events(self) -> bool | None:
+        """Whether the server sends keyspace notifications, None if it would not tell."""
+        if not self._notify_checked:
+            notify = False
+            # cluster nodes only notify their own clients, not used there
+            if redis_keyspace_events != 'off' and not self.config.cluster:
+                try:
+                    flags = self._client.config_get('notify-keyspace-events').get('notify-keyspace-events', '')
+                    notify = _keyspace_flags_enabled(flags)
+                    if not notify and redis_keyspace_events == 'on':
+                        self._client.config_set('notify-keyspace-events', flags + 'K$')
+                        notify = True
+                except redis.ResponseError:
+                    # the flags may still be set, subscribe and poll
+                    notify = None
+            self._notify = notify
+            self._notify_checked = True
+        return self._notify
+    def wait_get(self, key: str, timeout: float = None):
+        """
+        Block until `key` is set and return its value, or None after
+        `timeout` seconds (None waits forever). Woken by the key's keyspace
+        notifications, polls with backoff when the server does not send them.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        deadline = None if timeout is None else time.monotonic() + timeout
+        notify = self._keyspace_events()
+        if notify is False:
+            delay = 0.001
+            while True:
+                remaining = _remaining(deadline)
+                if remaining is not None and remaining <= 0:
+                    return None
+                time.sleep(delay if remaining is None else min(delay, remaining))
+                delay = min(delay * 2, 0.1)
+                value = self.get(key)
+                if value is not None:
+                    return value
+        db = self.config.db
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(f'__keyspace@{db}__:{key}')
+            delay = 0.001
+            while True:
+                # read after subscribing, a write in between is not missed
+                value = self.get(key)
+                if value is not None:
+                    return value
+                remaining = _remaining(deadline)
+                if remaining is not None and remaining <= 0:
+                    return None
+                # without confirmed notifications a message may never come
+                wait = 1.0 if notify else delay
+                delay = min(delay * 2, 0.1)
+                pubsub.get_message(timeout=wait if remaining is None else min(remaining, wait))
+        finally:
+            pubsub.close()
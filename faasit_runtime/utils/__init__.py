@@ -1,11 +1,20 @@
-from faasit_runtime.utils.config import get_function_container_config
-from faasit_runtime.runtime import (
-    FaasitRuntimeMetadata,
-    TellParams,
-    FaasitRuntime
-)
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from faasit_runtime.utils.config import get_function_container_config, reload_function_container_config
+    from faasit_runtime.runtime import (
+        FaasitRuntimeMetadata,
+        FaasitRuntime
+    )
 
-def callback(result,frt:FaasitRuntime):
+def __getattr__(name: str):
+    # loaded on first use (PEP 562), most importers only need callback
+    if name in ('get_function_container_config', 'reload_function_container_config'):
+        from faasit_runtime.utils import config
+        return getattr(config, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def callback(result,frt:'FaasitRuntime'):
+    from faasit_runtime.runtime import TellParams
     metadata = frt.metadata()
     if len(metadata.stack) == 0:
         return result
@@ -21,7 +30,7 @@ def callback(result,frt:FaasitRuntime):
         result = frt.tell(lastInvocation.caller.funcName, callbackParams.dict())
         return result
     
-def popStack(result, metadata: FaasitRuntimeMetadata):
+def popStack(result, metadata: 'FaasitRuntimeMetadata'):
     if len(metadata.stack) == 0:
         return result
     lastInvocation = metadata.stack[-1]
@@ -31,6 +40,7 @@ def popStack(result, metadata: FaasitRuntimeMetadata):
 
 __all__ = [
     "get_function_container_config",
+    "reload_function_container_config",
     "callback",
     "popStack"
 ]
\ No newline at end of file
@@ -0,0 +1,123 @@
+import os
+import gzip
+import importlib.util
+
+# Every function container reads its own environment, so these settings can
+# differ per function:
+#   FAASIT_COMPRESSION            gzip | zstd | none   (default gzip)
+#   FAASIT_COMPRESSION_THRESHOLD  bodies smaller than this many bytes are sent as is
+#   FAASIT_COMPRESSION_LEVEL      codec level, codec default when unset
+# Workers list the codecs they decode in the Accept-Encoding header of every
+# response, callers compress request bodies only with one of those.
+
+
+class Codec:
+    name: str = ''
+
+    def available(self) -> bool:
+        return True
+
+    def compress(self, data: bytes, level: int = None) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+
+class GzipCodec(Codec):
+    name = 'gzip'
+
+    def compress(self, data: bytes, level: int = None) -> bytes:
+        return gzip.compress(data, compresslevel=6 if level is None else level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+
+class ZstdCodec(Codec):
+    name = 'zstd'
+
+    def available(self) -> bool:
+        return importlib.util.find_spec('zstandard') is not None
+
+    def compress(self, data: bytes, level: int = None) -> bytes:
+        import zstandard
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        import zstandard
+        # frames written by stream compressors do not record their size
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+_codecs: dict[str, Codec] = {
+    'zstd': ZstdCodec(),
+    'gzip': GzipCodec(),
+}
+
+
+def _config() -> tuple[str, int, int]:
+    algorithm = os.environ.get('FAASIT_COMPRESSION', 'gzip').strip().lower()
+    threshold = int(os.environ.get('FAASIT_COMPRESSION_THRESHOLD', 64 * 1024))
+    level = os.environ.get('FAASIT_COMPRESSION_LEVEL')
+    return algorithm, threshold, None if level is None else int(level)
+
+
+def accept_encoding() -> str:
+    """Value for the `Accept-Encoding` header, the codecs this process can decode."""
+    return ', '.join(name for name, codec in _codecs.items() if codec.available())
+
+
+def choose_encoding(accept: str = None) -> str | None:
+    """
+    Pick the codec for a body. Without `accept` (request bodies) the configured
+    codec is used, otherwise the configured one if the peer accepts it or else
+    the first codec the peer lists that is available here.
+    """
+    algorithm, _, _ = _config()
+    if algorithm in ('', 'none', 'identity'):
+        return None
+    if accept is None:
+        codec = _codecs.get(algorithm)
+        return algorithm if codec is not None and codec.available() else None
+    offered = [item.split(';', 1)[0].strip().lower() for item in accept.split(',')]
+    candidates = [algorithm] + offered
+    for name in candidates:
+        codec = _codecs.get(name)
+        if name in offered and codec is not None and codec.available():
+            return name
+    return None
+
+
+def maybe_compress(data: bytes, accept: str = None) -> tuple[bytes, str | None]:
+    """Compress `data` when it is over the threshold, returns the body and its encoding."""
+    _, threshold, level = _config()
+    if len(data) < threshold:
+        return data, None
+    encoding = choose_encoding(accept)
+    if encoding is None:
+        return data, None
+    return _codecs[encoding].compress(data, level), encoding
+
+
+def decompress(data: bytes, encoding: str = None) -> bytes:
+    if not encoding:
+        return data
+    encoding = encoding.strip().lower()
+    if encoding == 'identity':
+        return data
+    codec = _codecs.get(encoding)
+    if codec is None or not codec.available():
+        raise ValueError(f"Unsupported content encoding {encoding}")
+    return codec.decompress(data)
+
+
+__all__ = [
+    "Codec",
+    "GzipCodec",
+    "ZstdCodec",
+    "accept_encoding",
+    "choose_encoding",
+    "maybe_compress",
+    "decompress",
+]
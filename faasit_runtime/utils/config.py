@@ -1,25 +1,44 @@
-from pydantic import BaseModel
-from typing import Literal
+from typing import Mapping
+from types import MappingProxyType
 import os
+import threading
 
-class WorkflowSchema(BaseModel):
-    funcName: str = ''
+PROVIDERS = ('local', 'aliyun', 'knative', 'aws', 'local-once', 'pku')
 
-class FunctionContainerConfigSchema(BaseModel):
-    funcName: str
-    # one of the providers
-    provider: Literal['local', 'aliyun','knative','aws','local-once','pku']
-    workflow: WorkflowSchema
+# The environment of a function container does not change once it runs,
+# the config is validated on first use and shared read-only afterwards.
+_config: Mapping | None = None
+_config_lock = threading.Lock()
 
-def get_function_container_config():
-    # Read the env from the environment
+def _load_function_container_config() -> Mapping:
+    # Read the env from the environment. Checked by hand, every function
+    # reads the config on start and pydantic alone would take longer to
+    # import than the rest of the package.
     env = os.environ
+    provider = env.get('FAASIT_PROVIDER', 'local-once')
+    if provider not in PROVIDERS:
+        raise ValueError(f"Invalid provider {provider}, expected one of {PROVIDERS}")
+    return MappingProxyType({
+        'funcName': env.get('FAASIT_FUNC_NAME') or '',
+        'provider': provider,
+        'workflow': MappingProxyType({
+            'funcName': env.get('FAASIT_WORKFLOW_FUNC_NAME') or '',
+        }),
+    })
 
-    config : FunctionContainerConfigSchema = FunctionContainerConfigSchema(
-        funcName=env.get('FAASIT_FUNC_NAME') or '',
-        provider=env.get('FAASIT_PROVIDER','local-once'),
-        workflow=WorkflowSchema(
-            funcName=env.get('FAASIT_WORKFLOW_FUNC_NAME') or ''
-        )
-    )
-    return config.dict()
\ No newline at end of file
+def get_function_container_config() -> Mapping:
+    global _config
+    config = _config
+    if config is None:
+        with _config_lock:
+            if _config is None:
+                _config = _load_function_container_config()
+            config = _config
+    return config
+
+def reload_function_container_config() -> Mapping:
+    """Parse the environment again, for tests that change FAASIT_* variables."""
+    global _config
+    with _config_lock:
+        _config = _load_function_container_config()
+        return _config
@@ -0,0 +1,47 @@
+import os
+import asyncio
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Coroutine handlers run on one long-lived event loop shared by the request
+# threads, async clients keep their connections from one request to the next.
+# A forked process starts its own loop.
+event_loop = None
+event_loop_pid = None
+event_loop_lock = threading.Lock()
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    global event_loop, event_loop_pid
+    with event_loop_lock:
+        if event_loop is None or event_loop_pid != os.getpid():
+            event_loop = asyncio.new_event_loop()
+            threading.Thread(target=event_loop.run_forever, daemon=True).start()
+            event_loop_pid = os.getpid()
+        return event_loop
+
+async def _wait(awaitable):
+    return await awaitable
+
+def _running_loop() -> asyncio.AbstractEventLoop | None:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+def resolve(result):
+    """The value of a handler result, awaited on the event loop if it is awaitable."""
+    if not inspect.isawaitable(result):
+        return result
+    loop = get_event_loop()
+    if _running_loop() is loop:
+        # a coroutine on the shared loop blocks on another one (a local call
+        # from an async handler), waiting for the loop would deadlock it
+        with ThreadPoolExecutor(1) as pool:
+            return pool.submit(asyncio.run, _wait(result)).result()
+    return asyncio.run_coroutine_threadsafe(_wait(result), loop).result()
+
+
+__all__ = [
+    "get_event_loop",
+    "resolve",
+]
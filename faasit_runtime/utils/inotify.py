@@ -0,0 +1,78 @@
+import os
+import sys
+import select
+import ctypes
+import ctypes.util
+
+# Minimal inotify(7) binding, enough to sleep until something changes in a
+# directory. Linux only, `watch_dir` returns None anywhere else.
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_libc = None
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc = libc
+    return _libc
+
+
+class DirWatch:
+    """Wakes `wait` when a file in `path` is written, moved in, created or deleted."""
+    def __init__(self, path: str, mask: int = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE):
+        libc = _load_libc()
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if libc.inotify_add_watch(self._fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, os.strerror(errno))
+
+    def wait(self, timeout: float = None) -> bool:
+        """True if something changed, False on timeout. Pending events are discarded."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self._fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self) -> 'DirWatch':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def watch_dir(path: str) -> DirWatch | None:
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return DirWatch(path)
+    except (OSError, AttributeError):
+        return None
+
+
+__all__ = [
+    "DirWatch",
+    "watch_dir",
+]
@@ -0,0 +1,328 @@
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+# A small in-process metrics registry rendered in the Prometheus text
+# exposition format, so the runtime does not need prometheus_client.
+# Values are per process. A pre-forked server shares them through a
+# directory (see `Registry.share`): every process writes its values to
+# {pid}.json every FAASIT_METRICS_FLUSH_INTERVAL seconds and when it exits,
+# and the process answering a scrape merges the files, as prometheus_client
+# does in multiprocess mode. Counters and histograms are summed over every
+# process that wrote a file, exited ones included, so they never go down.
+# Gauges are reported per live process with a `pid` label.
+
+flush_interval = float(os.getenv('FAASIT_METRICS_FLUSH_INTERVAL', 1))
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = '') -> str:
+    items = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, values)]
+    if extra:
+        items.append(extra)
+    return '{' + ','.join(items) + '}' if items else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type: str = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def state(self) -> dict:
+        """The metric as written to the shared directory."""
+        with self._lock:
+            values = [[list(k), v] for k, v in self._values.items()]
+        return {'type': self.type, 'help': self.documentation, 'labelnames': list(self.labelnames), 'values': values}
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines += self.samples()
+        return '\n'.join(lines)
+
+
+class _Value(Metric):
+    """A single value per label set, or one value read from `fn` at scrape time."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), fn: Callable[[], float] = None):
+        super().__init__(name, documentation, labelnames)
+        self._fn = fn
+
+    def state(self) -> dict:
+        if self._fn is None:
+            return super().state()
+        return {'type': self.type, 'help': self.documentation, 'labelnames': [], 'values': [[[], self._fn()]]}
+
+    def samples(self) -> list[str]:
+        if self._fn is not None:
+            return [f'{self.name} {_format_value(self._fn())}']
+        with self._lock:
+            values = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}' for k, v in values]
+
+
+class Counter(_Value):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Value):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def state(self) -> dict:
+        with self._lock:
+            values = [[list(k), [list(v[0]), v[1], v[2]]] for k, v in self._values.items()]
+        return {'type': self.type, 'help': self.documentation, 'labelnames': list(self.labelnames), 'buckets': self.buckets[:-1], 'values': values}
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = [(k, (list(v[0]), v[1], v[2])) for k, v in self._values.items()]
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+def _merge(states: list[tuple[int, bool, dict]]) -> list[Metric]:
+    """Metrics holding the (pid, alive, state) of every process combined."""
+    merged: dict[str, Metric] = {}
+    for pid, alive, state in states:
+        for name, metric in state.items():
+            kind, labelnames = metric['type'], tuple(metric['labelnames'])
+            if kind == 'gauge':
+                if not alive:
+                    continue
+                labelnames += ('pid',)
+            target = merged.get(name)
+            if target is None:
+                if kind == 'histogram':
+                    target = Histogram(name, metric['help'], labelnames, metric['buckets'])
+                else:
+                    target = (Gauge if kind == 'gauge' else Counter)(name, metric['help'], labelnames)
+                target = merged[name] = target
+            for key, value in metric['values']:
+                key = tuple(key) + ((pid,) if kind == 'gauge' else ())
+                if kind == 'histogram':
+                    total = target._values.setdefault(key, [[0] * len(value[0]), 0.0, 0])
+                    total[0] = [a + b for a, b in zip(total[0], value[0])]
+                    total[1] += value[1]
+                    total[2] += value[2]
+                elif kind == 'gauge':
+                    target._values[key] = value
+                else:
+                    target._values[key] = target._values.get(key, 0) + value
+    return list(merged.values())
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+        self._dir = None
+        self._pid = None
+        self._flushing_pid = None
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            # modules may be imported twice (e.g. as __main__), keep the first
+            return self._metrics.setdefault(metric.name, metric)
+
+    def state(self) -> dict:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.state() for m in metrics}
+
+    def share(self, directory: str):
+        """
+        Write this process's values to `directory` from now on and render
+        the values of every process sharing it. Called in each process of a
+        pre-forked server, after the fork. The values are written when the
+        process exits, `start_flushing` writes them periodically too.
+        """
+        self._dir = directory
+        self._pid = os.getpid()
+        self.flush()
+        atexit.register(self.flush)
+
+    def start_flushing(self):
+        """
+        Start the thread writing the values every FAASIT_METRICS_FLUSH_INTERVAL
+        seconds, if this process shares them. It is not started by `share`,
+        the process may still fork and a thread holding the registry lock
+        at that moment would leave the lock held in the child.
+        """
+        with self._lock:
+            if self._pid != os.getpid() or self._flushing_pid == self._pid:
+                return
+            self._flushing_pid = self._pid
+        threading.Thread(target=self._flush_forever, daemon=True).start()
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self._dir, f'{pid}.json')
+
+    def flush(self):
+        if self._pid != os.getpid():
+            # a forked child that did not share its own values
+            return
+        path = self._path(self._pid)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'pid': self._pid, 'metrics': self.state()}, f)
+        os.replace(path + '.tmp', path)
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def _shared_states(self) -> list[tuple[int, bool, dict]]:
+        states = [(self._pid, True, self.state())]
+        for name in os.listdir(self._dir):
+            if not name.endswith('.json') or name == f'{self._pid}.json':
+                continue
+            try:
+                with open(os.path.join(self._dir, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            states.append((data['pid'], _alive(data['pid']), data['metrics']))
+        return states
+
+    def render(self) -> str:
+        if self._dir is not None and self._pid == os.getpid():
+            metrics = _merge(self._shared_states())
+        else:
+            with self._lock:
+                metrics = list(self._metrics.values())
+        return '\n'.join(m.render() for m in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def shared_directory(path: str = None) -> str:
+    """
+    The directory the processes of a pre-forked server share their metrics
+    through, `path` (FAASIT_METRICS_DIR) emptied of files from an earlier
+    run, or a new temporary one. Called once before forking.
+    """
+    path = path or os.getenv('FAASIT_METRICS_DIR')
+    if not path:
+        import tempfile
+        return tempfile.mkdtemp(prefix='faasit-metrics-')
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.endswith(('.json', '.json.tmp')):
+            os.unlink(os.path.join(path, name))
+    return path
+
+
+def counter(name: str, documentation: str, labelnames: tuple = (), fn: Callable[[], float] = None) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames, fn))
+
+
+def gauge(name: str, documentation: str, labelnames: tuple = (), fn: Callable[[], float] = None) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames, fn))
+
+
+def histogram(name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+__all__ = [
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "Registry",
+    "REGISTRY",
+    "CONTENT_TYPE",
+    "DEFAULT_BUCKETS",
+    "SIZE_BUCKETS",
+    "shared_directory",
+    "counter",
+    "gauge",
+    "histogram",
+]
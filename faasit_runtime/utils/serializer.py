@@ -0,0 +1,242 @@
+import os
+import json
+import pickle
+import struct
+import importlib.util
+from typing import Any
+
+# Pickle frames that carry protocol 5 out-of-band buffers start with this magic,
+# plain pickles start with b'\x80' so both can be told apart when loading.
+PICKLE_OOB_MAGIC = b'FRTPKL5\x00'
+PICKLE_OOB_ALIGN = 64
+
+# Streamed results are sent as one JSON document per line.
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+
+class Serializer:
+    name: str = ''
+    content_type: str = ''
+
+    def available(self) -> bool:
+        return True
+
+    def dumps(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def dump_parts(self, obj: Any) -> list:
+        # chunks whose concatenation is `dumps(obj)`, lets writers skip the join
+        return [self.dumps(obj)]
+
+    def loads(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+_orjson = None
+
+def _load_orjson():
+    global _orjson
+    if _orjson is None:
+        try:
+            import orjson
+            _orjson = orjson
+        except ImportError:
+            _orjson = False
+    return _orjson
+
+
+class JsonSerializer(Serializer):
+    """
+    Uses orjson when it is installed, it parses bytes directly without
+    decoding them to str first. Falls back to the json module for what
+    orjson refuses (e.g. integers over 64 bits).
+    """
+    name = 'json'
+    content_type = 'application/json'
+
+    def dumps(self, obj: Any) -> bytes:
+        orjson = _load_orjson()
+        if orjson:
+            try:
+                return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+            except TypeError:
+                pass
+        return json.dumps(obj).encode('utf-8')
+
+    def loads(self, data) -> Any:
+        orjson = _load_orjson()
+        if orjson:
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+class MsgpackSerializer(Serializer):
+    name = 'msgpack'
+    content_type = 'application/msgpack'
+
+    def available(self) -> bool:
+        return importlib.util.find_spec('msgpack') is not None
+
+    def dumps(self, obj: Any) -> bytes:
+        import msgpack
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        import msgpack
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+class PickleSerializer(Serializer):
+    """
+    Pickle protocol 5, objects that export their data as a PickleBuffer
+    (numpy arrays, PickleBuffer itself) are stored out-of-band behind the
+    pickle stream, bytes and bytearray stay in-band. `loads` hands the
+    buffers out as views of writable input (bytearray, a copy-on-write
+    mmap) instead of copies, read-only input (bytes) is copied so that the
+    loaded objects are writable as they were when dumped.
+
+    Frame layout (little endian):
+        magic | n_buffers:u32 | pickle_len:u64 | n_buffers * buffer_len:u64
+        | pickle | (padding, buffer) * n_buffers
+    every buffer starts at an offset aligned to PICKLE_OOB_ALIGN.
+    """
+    name = 'pickle'
+    content_type = 'application/x-python-pickle'
+
+    def dump_parts(self, obj: Any) -> list:
+        buffers: list[pickle.PickleBuffer] = []
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        if len(buffers) == 0:
+            return [data]
+        raws = [b.raw() for b in buffers]
+        header = PICKLE_OOB_MAGIC + struct.pack(f'<IQ{len(raws)}Q', len(raws), len(data), *[r.nbytes for r in raws])
+        parts = [header, data]
+        offset = len(header) + len(data)
+        for raw in raws:
+            pad = -offset % PICKLE_OOB_ALIGN
+            if pad:
+                parts.append(bytes(pad))
+            parts.append(raw)
+            offset += pad + raw.nbytes
+        return parts
+
+    def dumps(self, obj: Any) -> bytes:
+        return b''.join(self.dump_parts(obj))
+
+    def loads(self, data) -> Any:
+        view = memoryview(data)
+        if view[:len(PICKLE_OOB_MAGIC)] != PICKLE_OOB_MAGIC:
+            return pickle.loads(view)
+        offset = len(PICKLE_OOB_MAGIC)
+        n, data_len = struct.unpack_from('<IQ', view, offset)
+        offset += 12
+        sizes = struct.unpack_from(f'<{n}Q', view, offset)
+        offset += 8 * n
+        stream = view[offset:offset + data_len]
+        offset += data_len
+        buffers = []
+        for size in sizes:
+            offset += -offset % PICKLE_OOB_ALIGN
+            buffer = view[offset:offset + size]
+            buffers.append(memoryview(bytearray(buffer)) if view.readonly else buffer)
+            offset += size
+        return pickle.loads(stream, buffers=buffers)
+
+
+_serializers: dict[str, Serializer] = {}
+
+
+def register_serializer(serializer: Serializer) -> None:
+    _serializers[serializer.name] = serializer
+
+
+register_serializer(JsonSerializer())
+register_serializer(MsgpackSerializer())
+register_serializer(PickleSerializer())
+
+
+def _strip_params(content_type: str) -> str:
+    return content_type.split(';', 1)[0].strip().lower()
+
+
+def get_serializer(name_or_content_type: str = None) -> Serializer:
+    if not name_or_content_type:
+        return _serializers['json']
+    key = _strip_params(name_or_content_type)
+    if key in _serializers:
+        return _serializers[key]
+    for serializer in _serializers.values():
+        if serializer.content_type == key:
+            return serializer
+    raise ValueError(f"Unsupported serializer {name_or_content_type}")
+
+
+def wire_serializer() -> Serializer:
+    """The serializer used for request bodies sent by `call`/`tell`."""
+    serializer = get_serializer(os.environ.get('FAASIT_SERIALIZER', 'json'))
+    return serializer if serializer.available() else _serializers['json']
+
+
+def storage_serializer() -> Serializer:
+    """The serializer used by storage backends to persist values."""
+    serializer = get_serializer(os.environ.get('FAASIT_STORAGE_SERIALIZER', 'pickle'))
+    return serializer if serializer.available() else _serializers['pickle']
+
+
+def wire_serializers() -> list[Serializer]:
+    # pickle bodies are only decoded when this process opted into pickle on
+    # the wire, any other peer could execute code through them.
+    result = [s for s in _serializers.values() if s.available() and s.name != 'pickle']
+    if wire_serializer().name == 'pickle':
+        result.insert(0, _serializers['pickle'])
+    return result
+
+
+def accept_header() -> str:
+    preferred = wire_serializer()
+    types = [preferred.content_type]
+    types += [s.content_type for s in wire_serializers() if s is not preferred]
+    return ', '.join(types)
+
+
+def negotiate(accept: str = None) -> Serializer:
+    """Pick the serializer for a response from the peer's `Accept` header."""
+    if not accept:
+        return _serializers['json']
+    allowed = {s.content_type: s for s in wire_serializers()}
+    for item in accept.split(','):
+        content_type = _strip_params(item)
+        if content_type in allowed:
+            return allowed[content_type]
+    return _serializers['json']
+
+
+def loads_wire(content_type: str, data: bytes) -> Any:
+    """Decode a request/response body according to its `Content-Type`."""
+    content_type = _strip_params(content_type or 'application/json')
+    for serializer in wire_serializers():
+        if serializer.content_type == content_type:
+            return serializer.loads(data)
+    raise ValueError(f"Unsupported content type {content_type}")
+
+
+__all__ = [
+    "NDJSON_CONTENT_TYPE",
+    "Serializer",
+    "JsonSerializer",
+    "MsgpackSerializer",
+    "PickleSerializer",
+    "register_serializer",
+    "get_serializer",
+    "wire_serializer",
+    "storage_serializer",
+    "wire_serializers",
+    "accept_header",
+    "negotiate",
+    "loads_wire",
+]
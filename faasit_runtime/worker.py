@@ -6,61 +6,283 @@ import importlib.util
 import logging
 import argparse
 import logging
+import inspect
 import traceback
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, Response, request, jsonify, make_response, g
 
 from .utils.logging import log as logger
-from .storage import RedisDB
+from .utils.serializer import negotiate, loads_wire, get_serializer, NDJSON_CONTENT_TYPE
+from .utils.compression import maybe_compress, decompress, accept_encoding
+from .utils import metrics
+from .utils.event_loop import resolve
+from .storage import RedisDB, RedisConfig
 from .serverless_function import Metadata
 lambda_file = None
 
 lambda_handler = None
 
-# Read from env.
-redis_host = os.getenv('REDIS_HOST', '10.0.0.100')
-redis_port = int(os.getenv('REDIS_PORT', 6379))
+# Read from env, see storage/redis_conn.py for the variables.
+redis_config = RedisConfig.from_env()
 
-redis_proxy = RedisDB(host=redis_host, port=redis_port)
+redis_proxy = RedisDB(config=redis_config)
+
+requests_total = metrics.counter('faasit_requests_total', 'Requests served, by request type and status code', ('type', 'code'))
+request_seconds = metrics.histogram('faasit_request_duration_seconds', 'Time spent answering a request', ('type',))
+handler_seconds = metrics.histogram('faasit_handler_duration_seconds', 'Time spent in the lambda handler', ('type',))
+handler_errors = metrics.counter('faasit_handler_errors_total', 'Lambda handler invocations that raised', ('type',))
+request_bytes = metrics.histogram('faasit_request_payload_bytes', 'Size of request bodies as received', ('type',), metrics.SIZE_BUCKETS)
+response_bytes = metrics.histogram('faasit_response_payload_bytes', 'Size of non streamed response bodies as sent', ('type',), metrics.SIZE_BUCKETS)
 
 
 import queue
-task_queue = queue.Queue()
+import itertools
+import threading
+
+# tell requests wait in a bounded priority queue served by a pool of
+# consumer threads, a request with a higher `priority` is served first
+tell_workers = int(os.getenv('FAASIT_TELL_WORKERS', 1))
+tell_queue_size = int(os.getenv('FAASIT_TELL_QUEUE_SIZE', 1024))
+tell_retry_after = int(os.getenv('FAASIT_TELL_RETRY_AFTER', 1))
+task_queue = queue.PriorityQueue(maxsize=tell_queue_size)
+task_seq = itertools.count()
+tell_busy = 0
+tell_busy_lock = threading.Lock()
 def worker():
+    global tell_busy
     while True:
-        metadata: Metadata = task_queue.get()
+        _, _, metadata = task_queue.get()
+        with tell_busy_lock:
+            tell_busy += 1
         try:
             logger.info(f"Invoking the lambda function with metadata: {metadata}")
-            result = lambda_handler(metadata)
+            with handler_seconds.time(type='tell'):
+                result = resolve(lambda_handler(metadata))
+                if inspect.isgenerator(result):
+                    result = list(result)
             logger.info(f"Lambda function invoked successfully: {result}")
         except:
             logger.error(f"Failed to invoke the lambda function: {metadata}")
+            handler_errors.inc(type='tell')
             continue
         finally:
+            with tell_busy_lock:
+                tell_busy -= 1
             task_queue.task_done()
-# Start the worker thread
-import threading
-worker_thread = threading.Thread(target=worker, daemon=True)
-worker_thread.start()
+
+def enqueue_tell(metadata: Metadata, priority: int = 0):
+    # raises queue.Full when the queue is at capacity
+    task_queue.put_nowait((-priority, next(task_seq), metadata))
+
+# Start the worker threads. Threads do not survive fork, so a pre-forked
+# server starts them again in every worker process.
+worker_threads: list[threading.Thread] = []
+worker_pid = None
+worker_lock = threading.Lock()
+def start_worker_thread():
+    global worker_threads, worker_pid
+    with worker_lock:
+        if worker_pid == os.getpid():
+            worker_threads = [t for t in worker_threads if t.is_alive()]
+        else:
+            worker_threads = []
+        while len(worker_threads) < tell_workers:
+            t = threading.Thread(target=worker, daemon=True)
+            t.start()
+            worker_threads.append(t)
+        worker_pid = os.getpid()
+    # after the fork server, it must not be forked with this thread running
+    metrics.REGISTRY.start_flushing()
+
+
+# Fork server mode runs the lambda in processes forked from a zygote that
+# imported it, instead of in the server process. Like the tell threads it is
+# started again in every pre-forked server process.
+fork_server = None
+fork_server_options = None
+fork_server_pid = None
+forked_handler = None
+# seconds a forked process may take for a request before it is killed
+fork_timeout = None
+def start_fork_server():
+    global fork_server, fork_server_pid
+    if fork_server_options is None or fork_server_pid == os.getpid():
+        return
+    from .forkserver import ForkServer
+    fork_server = ForkServer(**fork_server_options)
+    fork_server.start()
+    fork_server_pid = os.getpid()
+
+def run_forked(request: dict):
+    metadata = Metadata(
+        id=request['id'],
+        params=request['params'],
+        namespace=request['namespace'],
+        router=request['router'],
+        request_type=request['type'],
+        redis_db=redis_proxy,
+    )
+    result = resolve(forked_handler(metadata))
+    if inspect.isgenerator(result):
+        result = list(result)
+    return result
+
+def invoke_forked(metadata: Metadata):
+    return fork_server.invoke({
+        'id': metadata._id,
+        'params': metadata._params,
+        'namespace': metadata._namespace,
+        'router': metadata._router,
+        'type': metadata._type,
+    }, timeout=fork_timeout)
+
+
+import time
+class AdmissionController:
+    """
+    Bounds the number of invocations running at once. Requests over the
+    limit wait up to `timeout` seconds in a queue of at most `max_waiting`
+    entries and are rejected when the queue is full or the wait times out.
+    `max_inflight <= 0` admits everything.
+    """
+    def __init__(self, max_inflight: int, max_waiting: int, timeout: float):
+        self.max_inflight = max_inflight
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> bool:
+        with self._cond:
+            if self.max_inflight > 0 and self.in_flight >= self.max_inflight:
+                if self.waiting >= self.max_waiting:
+                    self.rejected += 1
+                    return False
+                self.waiting += 1
+                deadline = time.monotonic() + self.timeout
+                try:
+                    while self.in_flight >= self.max_inflight:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            self.timed_out += 1
+                            return False
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'max_inflight': self.max_inflight,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
+
+admission = AdmissionController(
+    max_inflight=int(os.getenv('FAASIT_MAX_INFLIGHT', 0)),
+    max_waiting=int(os.getenv('FAASIT_ADMISSION_QUEUE', 64)),
+    timeout=float(os.getenv('FAASIT_ADMISSION_TIMEOUT', 10)),
+)
+admission_retry_after = int(os.getenv('FAASIT_ADMISSION_RETRY_AFTER', 1))
+
+
+metrics.gauge('faasit_tell_queue_depth', 'tell requests waiting in the queue', fn=lambda: task_queue.qsize())
+metrics.gauge('faasit_tell_busy_workers', 'tell consumers running the handler', fn=lambda: tell_busy)
+metrics.gauge('faasit_invocations_in_flight', 'invoke requests holding an admission slot', fn=lambda: admission.in_flight)
+metrics.gauge('faasit_invocations_waiting', 'invoke requests waiting for an admission slot', fn=lambda: admission.waiting)
+metrics.counter('faasit_invocations_rejected_total', 'invoke requests rejected by admission control', fn=lambda: admission.rejected)
 
 
 #flask
 app = Flask(__name__)
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(resp):
+    if request.path == '/':
+        request_type = g.get('request_type', 'unknown')
+        requests_total.inc(type=request_type, code=str(resp.status_code))
+        request_seconds.observe(time.perf_counter() - g.request_start, type=request_type)
+        if not resp.is_streamed:
+            response_bytes.observe(resp.content_length or 0, type=request_type)
+        # callers compress request bodies only with a codec listed here
+        resp.headers['Accept-Encoding'] = accept_encoding()
+    return resp
+
+def respond(payload: dict, status: int = 200, headers: dict = None):
+    # answer in the format the caller asked for, json if it did not say
+    serializer = negotiate(request.headers.get('Accept'))
+    body, encoding = maybe_compress(serializer.dumps(payload), request.headers.get('Accept-Encoding', ''))
+    resp = make_response(body, status, headers or {})
+    resp.headers['Content-Type'] = serializer.content_type
+    resp.headers['Vary'] = 'Accept, Accept-Encoding'
+    if encoding is not None:
+        resp.headers['Content-Encoding'] = encoding
+    return resp
+
+def respond_stream(result, on_close=None):
+    # one {'status', 'data'} document per yielded chunk, a failure while
+    # iterating is reported as a last {'status': 'error'} line
+    serializer = get_serializer('json')
+    def generate():
+        try:
+            for chunk in result:
+                yield serializer.dumps({'status': 'ok', 'data': chunk}) + b'\n'
+        except Exception as e:
+            logger.error(f"Failed to stream the lambda function result: {e}")
+            traceback.print_exc()
+            yield serializer.dumps({'status': 'error', 'error': str(e)}) + b'\n'
+    resp = Response(generate(), mimetype=NDJSON_CONTENT_TYPE)
+    if on_close is not None:
+        resp.call_on_close(on_close)
+    return resp
+
 @app.post('/')
 def invoke():
     try:
-        data = request.get_json()
+        raw = request.get_data()
+        body = decompress(raw, request.headers.get('Content-Encoding'))
+        data = loads_wire(request.content_type, body)
     except Exception as e:
-        logger.error(f"Failed to invoke the lambda function: {e}")
-        return jsonify({'error': str(e)}), 500
+        # a body that cannot be decompressed or parsed is the caller's error
+        logger.error(f"Failed to decode the request body: {e}")
+        return respond({'error': f"invalid request body: {e}"}, 400)
 
     try:
         request_type = data['type']
     except KeyError:
         logger.error(f"Failed to invoke the lambda function: request type is missing")
-        return jsonify({'error': 'request type is missing'}), 400
+        return respond({'error': 'request type is missing'}, 400)
+    g.request_type = request_type
+    request_bytes.observe(len(raw), type=request_type)
     
     if request_type == 'invoke':
+        if not admission.acquire():
+            logger.warning(f"Too many in-flight invocations, rejecting")
+            return respond({
+                'status': 'error',
+                'error': 'too many in-flight invocations',
+            }, 429, {'Retry-After': str(admission_retry_after)})
+        # a streamed result holds its slot until the response is closed
+        release = True
         try:
             id = data['id']
             params = data['params']
@@ -77,19 +299,30 @@ def invoke():
             )
             logger.info(f"Invoking the lambda function with metadata: {metadata}")
 
-            result = lambda_handler(metadata)
+            with handler_seconds.time(type=request_type):
+                result = resolve(lambda_handler(metadata))
+            if inspect.isgenerator(result):
+                if NDJSON_CONTENT_TYPE in request.headers.get('Accept', ''):
+                    logger.info(f"Streaming the lambda function result")
+                    release = False
+                    return respond_stream(result, on_close=admission.release)
+                result = list(result)
             logger.info(f"Lambda function invoked successfully: {result}")
-            return jsonify({
+            return respond({
                 'status': 'ok',
                 'data': result
             })
         except Exception as e:
             logger.error(f"Failed to invoke the lambda function: {e}")
             traceback.print_exc()
-            return jsonify({
+            handler_errors.inc(type=request_type)
+            return respond({
                 'status': 'error',
                 'error': str(e)
-            }), 500
+            }, 500)
+        finally:
+            if release:
+                admission.release()
     elif request_type == 'tell':
         try:
             id = data['id']
@@ -106,19 +339,32 @@ def invoke():
                 redis_db=redis_proxy,
             )
             logger.info(f"Tell the lambda function with metadata: {metadata}")
-            task_queue.put(metadata)
+            start_worker_thread()
+            try:
+                enqueue_tell(metadata, int(data.get('priority', 0)))
+            except queue.Full:
+                logger.warning(f"Tell queue is full, rejecting: {metadata}")
+                return respond({
+                    'status': 'error',
+                    'error': 'tell queue is full',
+                }, 503, {'Retry-After': str(tell_retry_after)})
             logger.info(f"Lambda function told successfully: {metadata}")
 
-            return jsonify({
+            return respond({
                 'status': 'ok',
                 'message': 'Lambda function told successfully',
             })
         except Exception as e:
             logger.error(f"Failed to tell the lambda function: {e}")
-            return jsonify({
+            return respond({
                 'status': 'error',
                 'error': str(e)
-            }), 500
+            }, 500)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 
 @app.route('/health')
@@ -126,34 +372,154 @@ def health():
     return jsonify({
         'status': 'UP',
         'data': {
-            'redis_host': redis_host,
-            'redis_port': redis_port,
-            'lambda_file': lambda_file
+            'redis_host': redis_config.host,
+            'redis_port': redis_config.port,
+            'redis': redis_config.url,
+            'lambda_file': lambda_file,
+            'server': server_options,
+            'tell_queue': {
+                'depth': task_queue.qsize(),
+                'capacity': tell_queue_size,
+                'workers': tell_workers,
+                'busy': tell_busy,
+            },
+            'admission': admission.stats(),
+            'fork_server': fork_server.stats() if fork_server is not None else None,
         }
     })
 
 
+server_options = {}
+
+def run_flask(port: int, threads: int, backlog: int):
+    # werkzeug's threaded server starts a thread per connection, at most
+    # `threads` run at once and further connections wait in the listen
+    # backlog until one is done
+    from werkzeug.serving import ThreadedWSGIServer
+    slots = threading.BoundedSemaphore(max(1, threads))
+
+    class BoundedWSGIServer(ThreadedWSGIServer):
+        request_queue_size = backlog
+
+        def process_request(self, request, client_address):
+            slots.acquire()
+            try:
+                super().process_request(request, client_address)
+            except BaseException:
+                slots.release()
+                raise
+
+        def process_request_thread(self, request, client_address):
+            try:
+                super().process_request_thread(request, client_address)
+            finally:
+                slots.release()
+
+    server = BoundedWSGIServer('0.0.0.0', port, app)
+    logger.info(f"Serving on port {port} with {max(1, threads)} request threads")
+    server.serve_forever()
+
+
+def run_gunicorn(port: int, workers: int, threads: int, timeout: int, backlog: int):
+    # pre-forked multi-process WSGI server, the lambda is loaded once in the
+    # master before forking so the workers share its pages copy-on-write
+    from gunicorn.app.base import BaseApplication
+
+    class WorkerApplication(BaseApplication):
+        def __init__(self, options: dict):
+            self.options = options
+            super().__init__()
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+        def load(self):
+            return app
+
+    # every worker process answers scrapes with the metrics of all of them
+    metrics_dir = metrics.shared_directory()
+
+    def post_fork(server, worker):
+        # forks, so before anything in this process starts a thread
+        start_fork_server()
+        metrics.REGISTRY.share(metrics_dir)
+        start_worker_thread()
+
+    WorkerApplication({
+        'bind': f'0.0.0.0:{port}',
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread',
+        'timeout': timeout,
+        'backlog': backlog,
+        'preload_app': True,
+        'post_fork': post_fork,
+    }).run()
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='lucas worker')
     parser.add_argument('--lambda_file', type=str, required=True, help='The lambda file to run')
     parser.add_argument('--function_name', type=str, required=True, help='The function name to run')
     parser.add_argument('--server_port', type=int, default=9000, help='The port to run the server on')
+    parser.add_argument('--server', type=str, choices=['flask', 'gunicorn'], default=os.getenv('FAASIT_WORKER_SERVER', 'flask'), help='flask development server or pre-forked gunicorn')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('FAASIT_WORKER_PROCESSES', 1)), help='Number of worker processes (gunicorn)')
+    parser.add_argument('--threads', type=int, default=int(os.getenv('FAASIT_WORKER_THREADS', 8)), help='Number of request threads per worker process')
+    parser.add_argument('--timeout', type=int, default=int(os.getenv('FAASIT_WORKER_TIMEOUT', 300)), help='Seconds before a busy worker process is restarted (gunicorn)')
+    parser.add_argument('--snapshot_dir', type=str, default=os.getenv('FAASIT_SNAPSHOT_DIR'), help='Serve from a CRIU snapshot made by `faasit_runtime.start --worker` instead of importing the lambda')
+    parser.add_argument('--fork_pool', type=int, default=int(os.getenv('FAASIT_FORK_POOL', 0)), help='Run the lambda in this many processes forked from a pre-initialized zygote, 0 runs it in the server process')
+    parser.add_argument('--fork_per_request', action='store_true', default=os.getenv('FAASIT_FORK_PER_REQUEST', '').lower() in ('1', 'true', 'yes'), help='Fork a fresh process for every request (with --fork_pool)')
+    parser.add_argument('--backlog', type=int, default=int(os.getenv('FAASIT_WORKER_BACKLOG', 2048)), help='Maximum number of pending connections')
     args = parser.parse_args()
     lambda_file = args.lambda_file
     function_name = args.function_name
     server_port = args.server_port
+    server_options = {
+        'server': args.server,
+        'workers': args.workers if args.server == 'gunicorn' else 1,
+        'threads': args.threads,
+    }
     # Load the user's lambda function
-    try:
-        spec = importlib.util.spec_from_file_location(function_name, lambda_file)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        func = getattr(module, function_name)
-        def functor(*args):
-            return func(*args)
+    if args.snapshot_dir:
+        from .start import SnapshotClient
+        snapshot = SnapshotClient(args.snapshot_dir)
+        snapshot.restore()
+        def functor(metadata: Metadata):
+            return snapshot.invoke({
+                'id': metadata._id,
+                'params': metadata._params,
+                'namespace': metadata._namespace,
+                'router': metadata._router,
+                'type': metadata._type,
+            })
         lambda_handler = functor
-    except Exception as e:
-        logger.error(f"Failed to load the lambda function: {e}")
-        traceback.print_exc()
-        sys.exit(1)
+    else:
+        try:
+            spec = importlib.util.spec_from_file_location(function_name, lambda_file)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            func = getattr(module, function_name)
+            def functor(*args):
+                return func(*args)
+            lambda_handler = functor
+        except Exception as e:
+            logger.error(f"Failed to load the lambda function: {e}")
+            traceback.print_exc()
+            sys.exit(1)
+        if args.fork_pool > 0:
+            fork_server_options = {
+                'target': run_forked,
+                'pool_size': args.fork_pool,
+                'per_request': args.fork_per_request,
+            }
+            server_options['fork_pool'] = args.fork_pool
+            server_options['fork_per_request'] = args.fork_per_request
+            forked_handler = lambda_handler
+            fork_timeout = args.timeout
+            lambda_handler = invoke_forked
     # Start the HTTP server
-    app.run(host='0.0.0.0', port=server_port)
\ No newline at end of file
+    if args.server == 'gunicorn':
+        run_gunicorn(server_port, args.workers, args.threads, args.timeout, args.backlog)
+    else:
+        start_fork_server()
+        start_worker_thread()
+        run_flask(server_port, args.threads, args.backlog)
\ No newline at end of file
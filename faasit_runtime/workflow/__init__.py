@@ -1,7 +1,34 @@
-from .workflow import Workflow
-from .ld import Lambda
-from .route import RouteFunc, Route, RouteBuilder, RouteRunner
-from .context import WorkflowContext
+from typing import TYPE_CHECKING
+import importlib
+
+# Resolved on first access (PEP 562), `route` is imported by the package
+# itself and must stay cheap, the rest pulls in the runtime models.
+_lazy_imports = {
+    "Workflow": ".workflow",
+    "Lambda": ".ld",
+    "RouteFunc": ".route",
+    "Route": ".route",
+    "RouteBuilder": ".route",
+    "RouteRunner": ".route",
+    "WorkflowContext": ".context",
+}
+
+if TYPE_CHECKING:
+    from .workflow import Workflow
+    from .ld import Lambda
+    from .route import RouteFunc, Route, RouteBuilder, RouteRunner
+    from .context import WorkflowContext
+
+def __getattr__(name: str):
+    module = _lazy_imports.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_imports))
 
 __all__ = [
     "Workflow",
@@ -11,4 +38,4 @@ __all__ = [
     "RouteBuilder",
     "RouteRunner",
     "WorkflowContext"
-]
\ No newline at end of file
+]
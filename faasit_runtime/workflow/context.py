@@ -37,10 +37,7 @@ class WorkflowContext:
             from ..serverless_function import Metadata
             import uuid
             def local_once_workflow(data: dict):
-                route_dict = {}
-                for function in self._route.functions:
-                    route_dict[function.name] = function.handler
-                metadata = Metadata(str(uuid.uuid4()), data, None, route_dict, 'invoke', None, None)
+                metadata = Metadata(str(uuid.uuid4()), data, None, self._route.table, 'invoke', None)
                 rt = LocalOnceRuntime(metadata)
                 self.set_runtime(rt)
                 workflow = self.generate()
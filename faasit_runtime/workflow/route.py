@@ -1,36 +1,119 @@
-from typing import Callable
-from ..runtime.faasit_runtime import FaasitRuntime, FaasitResult
+from typing import Callable, Mapping, Iterator
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from .workflow import Workflow
+    from .context import WorkflowContext
+    from ..runtime.faasit_runtime import FaasitRuntime, FaasitResult
 
 class RouteFunc:
-    def __init__(self, name: str, handler: Callable[[FaasitRuntime], FaasitResult] = None) -> None:
+    def __init__(self, name: str, handler: 'Callable[[FaasitRuntime], FaasitResult]' = None) -> None:
         self.name = name
         self.handler = handler
+        # in-process call policy, see runtime.local_call
+        self.local_call: str | None = None
 
     def set_handler(self, 
-                    handler: Callable[[FaasitRuntime], FaasitResult]):
+                    handler: 'Callable[[FaasitRuntime], FaasitResult]'):
         self.handler = handler
 
 class RouteWorkflow:
     def __init__(self, name: str, generate_workflow = None):
         self.name = name
         self._generate_workflow = generate_workflow
-    def set_workflow(self, generate_workflow):
+        self._handler = None
+        self.context: 'WorkflowContext | None' = None
+        self._exported = None
+    def set_workflow(self, generate_workflow, context: 'WorkflowContext' = None):
         self._generate_workflow = generate_workflow
+        self._handler = None
+        self.context = context
+        self._exported = None
+
+    def export(self):
+        """The workflow as the provider runs it, called like an exported function handler."""
+        if self._exported is None:
+            if self.context is None:
+                raise ValueError(f"Workflow {self.name} has no context to export")
+            self._exported = self.context.export()
+        return self._exported
+
+    @property
+    def handler(self):
+        # built once, not on every dispatch
+        if self._handler is None:
+            def handler(event, workflow_runner:'RouteRunner', metadata):
+                wf = self._generate_workflow(workflow_runner,metadata)
+                return wf.execute(event)
+            self._handler = handler
+        return self._handler
+
+class RouteTable(Mapping):
+    """
+    Read-only view of a route, handler by name. Every handler is called
+    the same way, `handler(params)` for local-once: a function maps to its
+    exported handler and a workflow to the handler its context exports.
+    """
+    def __init__(self, route: 'Route') -> None:
+        self._route = route
+
+    def __getitem__(self, name: str):
+        func = self._route.function(name)
+        if func is not None:
+            return func.handler
+        work = self._route.workflow(name)
+        if work is None:
+            raise KeyError(name)
+        return work.export()
+
+    def __iter__(self) -> Iterator[str]:
+        functions, workflows = self._route._index()
+        return iter(functions.keys() | workflows.keys())
+
+    def __len__(self) -> int:
+        functions, workflows = self._route._index()
+        return len(functions.keys() | workflows.keys())
 
 class Route:
     def __init__(self, functions: list[RouteFunc], workflows:list[RouteWorkflow]) -> None:
         self.functions = functions
         self.workflows = workflows
+        self._functions: dict[str, RouteFunc] = {}
+        self._workflows: dict[str, RouteWorkflow] = {}
+        self._indexed = None
+        self.table = RouteTable(self)
+
+    def _index(self) -> tuple[dict[str, RouteFunc], dict[str, RouteWorkflow]]:
+        # registrations only ever append, the indexes are rebuilt when they
+        # did. Functions and workflows are called differently and are kept
+        # apart, the first registration of a name wins
+        sizes = (len(self.functions), len(self.workflows))
+        if self._indexed != sizes:
+            functions, workflows = {}, {}
+            for func in self.functions:
+                functions.setdefault(func.name, func)
+            for work in self.workflows:
+                workflows.setdefault(work.name, work)
+            self._functions, self._workflows = functions, workflows
+            self._indexed = sizes
+        return self._functions, self._workflows
+
+    def function(self, name: str) -> RouteFunc | None:
+        return self._index()[0].get(name)
+
+    def workflow(self, name: str) -> RouteWorkflow | None:
+        return self._index()[1].get(name)
+
+    def lookup(self, name: str) -> 'Callable[[FaasitRuntime], FaasitResult] | None':
+        # functions shadow workflows
+        entry = self.function(name) or self.workflow(name)
+        return None if entry is None else entry.handler
 
 
 class RouteBuilder:
     def __init__(self) -> None:
         self.funcs: list[RouteFunc] = []
         self.works: list[RouteWorkflow] = []
-        pass
+        self._route: Route | None = None
 
     # This method is used to add a function to the workflow
     def func(self, funcName:str) -> RouteFunc:
@@ -51,9 +134,11 @@ class RouteBuilder:
     def get_works(self) -> list[RouteWorkflow]:
         return self.works
 
-    # build the workflow
+    # build the workflow, the route shares the registrations and its index
     def build(self) -> Route:
-        return Route(self.funcs,self.works)
+        if self._route is None:
+            self._route = Route(self.funcs,self.works)
+        return self._route
     
 class RouteRunner:
     def __init__(self, route:Route) -> None:
@@ -69,14 +154,8 @@ class RouteRunner:
     #     fn = self.route(funcName)
     #     return fn(frt, *args)
     
-    def route(self, name: str) -> Callable[[FaasitRuntime], FaasitResult]:
-        for func in self._route.functions:
-            if func.name == name:
-                return func.handler
-        for work in self._route.workflows:
-            if work.name == name:
-                def handler(event, workflow_runner:RouteRunner, metadata):
-                    wf = work._generate_workflow(workflow_runner,metadata)
-                    return wf.execute(event)
-                return handler
-        raise ValueError(f'Function {name} not found in workflow')
\ No newline at end of file
+    def route(self, name: str) -> 'Callable[[FaasitRuntime], FaasitResult]':
+        handler = self._route.lookup(name)
+        if handler is None:
+            raise ValueError(f'Function {name} not found in workflow')
+        return handler
@@ -16,6 +16,15 @@ setup(
         'kn': [
             "requests==2.26.0",
             'redis==5.2.1',
+        ],
+        'msgpack': [
+            'msgpack==1.0.8',
+        ],
+        'zstd': [
+            'zstandard==0.23.0',
+        ],
+        'server': [
+            'gunicorn==22.0.0',
         ]
     },
     packages=find_packages(),
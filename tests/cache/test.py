@@ -0,0 +1,97 @@
+"""
+The process-wide storage cache in front of local-once storage, in a
+temporary directory:
+
+    python tests/cache/test.py
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, root)
+os.environ['FAASIT_PROVIDER'] = 'local-once'
+os.environ['FAASIT_STORAGE_CACHE_BYTES'] = str(1 << 20)
+os.environ.pop('FAASIT_STORAGE_CACHE_TTL', None)
+
+from faasit_runtime.runtime.local_once_runtime import LocalOnceRuntime
+from faasit_runtime.storage import cache
+from faasit_runtime.storage.cache import CachedStorage, LRUCache
+
+
+class SlowStorage(LocalOnceRuntime.LocalStorage):
+    """Local storage whose reads stop after reading the file until released."""
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.read = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def get_raw(self, filename, timeout=-1):
+        data = super().get_raw(filename, timeout)
+        self.read.set()
+        self.release.wait()
+        return data
+
+
+def fill_racing_put():
+    backend = SlowStorage(tempfile.mkdtemp(prefix='faasit-cache-test-'))
+    storage = CachedStorage(backend, 'race', LRUCache(1 << 20, ttl=60))
+    storage.put('key', 'old')
+    # a reader fetches the old value, a put finishes before it fills the cache
+    backend.release.clear()
+    results = []
+    reader = threading.Thread(target=lambda: results.append(storage.get('key')))
+    reader.start()
+    assert backend.read.wait(5)
+    storage.put('key', 'new')
+    backend.release.set()
+    reader.join(5)
+    assert results == ['old'], results
+    # the old value was not cached over the new one
+    assert storage.get('key') == 'new'
+    assert storage.get('key') == 'new'
+    print("fill racing a put: ok")
+
+
+def eviction():
+    lru = LRUCache(100, ttl=60)
+    lru.put('a', b'a' * 40)
+    lru.put('b', b'b' * 40)
+    # touched, so b is the least recently used
+    assert lru.get('a') == b'a' * 40
+    lru.put('c', b'c' * 40)
+    assert lru.get('b') is None
+    assert lru.get('a') is not None and lru.get('c') is not None
+    assert lru.stats()['bytes'] == 80 and lru.stats()['evictions'] == 1, lru.stats()
+    # larger than the whole budget, not cached and nothing is evicted for it
+    lru.put('d', b'd' * 101)
+    assert lru.get('d') is None and lru.stats()['entries'] == 2, lru.stats()
+    # one large value pushes out as many as needed
+    lru.put('e', b'e' * 90)
+    assert lru.stats()['entries'] == 1 and lru.stats()['bytes'] == 90, lru.stats()
+    print("eviction by bytes: ok")
+
+
+def ttl():
+    lru = LRUCache(100, ttl=0.1)
+    lru.put('a', b'a')
+    assert lru.contains('a')
+    time.sleep(0.15)
+    assert not lru.contains('a') and lru.get('a') is None
+    assert lru.stats()['bytes'] == 0, lru.stats()
+    # entries expire unless a TTL is configured
+    assert cache.get_cache().ttl > 0, cache.get_cache().ttl
+    print("ttl: ok")
+
+
+def main():
+    fill_racing_put()
+    eviction()
+    ttl()
+
+
+if __name__ == '__main__':
+    main()
@@ -14,11 +14,11 @@ async def executor(frt: FaasitRuntime):
     frt.storage.put(filename, pickle.dumps('123'))
     res1 = pickle.loads(frt.storage.get(filename))
     print(res1) # '123'
-    print(frt.storage.list()) # [fileName]
+    print(list(frt.storage.list())) # [fileName]
     frt.storage.delete(filename)
 
     # list, exists, get when file is not exist
-    print(frt.storage.list()) # []
+    print(list(frt.storage.list())) # []
     print(frt.storage.exists(filename)) # false
     print(frt.storage.get(filename, 1000)) # None after 1s
 
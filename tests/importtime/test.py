@@ -0,0 +1,74 @@
+"""
+Startup budget of a lambda, measured in fresh interpreters: importing the
+package, decorating a function with `@function` and building its handler
+with `create_handler`, as every lambda module does when it is loaded.
+Exits non zero when that takes longer than the budget for one of the
+providers or pulls in a module that should be loaded lazily.
+
+    python tests/importtime/test.py [--budget-ms 40] [--runs 5] [--providers local-once,knative]
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# modules that only the code paths using them may import
+deferred = ['pydantic', 'oss2', 'alibabacloud_fc_open20210406', 'dotenv', 'redis', 'flask', 'requests', 'aiohttp']
+
+providers = ['local-once', 'local', 'knative', 'aliyun']
+
+# what the top of a lambda module runs
+startup = """
+import sys, time
+start = time.perf_counter()
+import faasit_runtime
+from faasit_runtime import function, create_handler
+
+@function
+def handler(frt):
+    return frt.output(frt.input())
+
+create_handler(handler)
+print((time.perf_counter() - start) * 1000)
+print(' '.join(sys.modules))
+"""
+
+
+def measure(provider: str) -> tuple[float, set]:
+    env = dict(os.environ, PYTHONPATH=root, FAASIT_PROVIDER=provider)
+    proc = subprocess.run([sys.executable, '-c', startup], env=env, capture_output=True, text=True, check=True)
+    ms, modules = proc.stdout.splitlines()
+    return float(ms), set(modules.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='lambda startup budget')
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('FAASIT_IMPORT_BUDGET_MS', 40)))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--providers', default=','.join(providers))
+    args = parser.parse_args()
+    failed = False
+    for provider in args.providers.split(','):
+        samples = []
+        modules = set()
+        for _ in range(args.runs):
+            ms, modules = measure(provider)
+            samples.append(ms)
+        best = min(samples)
+        print(f"{provider}: best {best:.2f} ms, worst {max(samples):.2f} ms, budget {args.budget_ms:.2f} ms")
+        if best > args.budget_ms:
+            print(f"FAIL: {provider} over budget by {best - args.budget_ms:.2f} ms")
+            failed = True
+        loaded = [name for name in deferred if name in modules]
+        if loaded:
+            print(f"FAIL: {provider} imported eagerly: {', '.join(loaded)}")
+            failed = True
+    if not failed:
+        print("OK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Calls between functions registered in the same process, for every local
+call policy, with sync and async callers and callees:
+
+    python tests/local_call/test.py
+"""
+import os
+import sys
+import time
+import uuid
+import threading
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, root)
+os.environ['FAASIT_PROVIDER'] = 'knative'
+
+from faasit_runtime import function, routeBuilder
+from faasit_runtime.runtime import local_call
+from faasit_runtime.runtime.kn_runtime import KnativeRuntime
+from faasit_runtime.serverless_function import Metadata
+from faasit_runtime.storage import RedisDB
+from faasit_runtime.utils.event_loop import resolve
+
+told = []
+release = threading.Event()
+
+
+@function
+async def async_add(frt: KnativeRuntime):
+    params = frt.input()
+    return {'sum': params['lhs'] + params['rhs']}
+
+
+@function
+def sync_add(frt: KnativeRuntime):
+    params = frt.input()
+    return {'sum': params['lhs'] + params['rhs']}
+
+
+@function
+async def async_record(frt: KnativeRuntime):
+    told.append(frt.input()['value'])
+
+
+@function
+def blocked_record(frt: KnativeRuntime):
+    release.wait()
+    told.append(frt.input()['value'])
+
+
+@function
+def sync_caller(frt: KnativeRuntime):
+    params = frt.input()
+    return frt.call(params['callee'], {'lhs': 1, 'rhs': 2})
+
+
+@function
+async def async_caller(frt: KnativeRuntime):
+    params = frt.input()
+    return frt.call(params['callee'], {'lhs': 3, 'rhs': 4})
+
+
+@function
+def sync_streamer(frt: KnativeRuntime):
+    return list(frt.callStream('async_add', {'lhs': 5, 'rhs': 6}))
+
+
+@function
+def sync_teller(frt: KnativeRuntime):
+    params = frt.input()
+    return frt.tell(params.get('callee', 'async_record'), {'value': params['value']})
+
+
+def invoke(fn_name: str, params: dict):
+    handler = routeBuilder.build().function(fn_name).handler
+    metadata = Metadata(str(uuid.uuid4()), params, 'default', {}, 'invoke', RedisDB())
+    return resolve(handler(metadata))
+
+
+def main():
+    for policy in ('copy', 'share'):
+        os.environ['FAASIT_LOCAL_CALL'] = policy
+        for callee in ('async_add', 'sync_add'):
+            assert invoke('sync_caller', {'callee': callee}) == {'sum': 3}, (policy, callee)
+            assert invoke('async_caller', {'callee': callee}) == {'sum': 7}, (policy, callee)
+        assert invoke('sync_streamer', {}) == [{'sum': 11}], policy
+        told.clear()
+        invoke('sync_teller', {'value': policy})
+        deadline = time.monotonic() + 5
+        while not told and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert told == [policy], (policy, told)
+        print(f"{policy}: ok")
+    backpressure()
+
+
+def backpressure():
+    # tells beyond the consumers and the queue wait, then fail, no thread is started per tell
+    local_call.tell_queue.maxsize = 2
+    local_call.local_tell_timeout = 0.2
+    told.clear()
+    threads = threading.active_count()
+    sent = 0
+    try:
+        for i in range(100):
+            invoke('sync_teller', {'callee': 'blocked_record', 'value': i})
+            sent += 1
+    except RuntimeError:
+        pass
+    assert sent == local_call.local_tell_workers + 2, sent
+    assert threading.active_count() <= threads + local_call.local_tell_workers, threading.active_count()
+    release.set()
+    local_call.tell_queue.join()
+    assert sorted(told) == list(range(sent)), told
+    print("backpressure: ok")
+
+
+if __name__ == '__main__':
+    main()
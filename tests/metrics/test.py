@@ -0,0 +1,93 @@
+"""
+Metrics shared by the processes of a pre-forked server, with processes
+forked after the registry was shared:
+
+    python tests/metrics/test.py
+"""
+import os
+import sys
+import json
+import signal
+import tempfile
+import threading
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, root)
+os.environ['FAASIT_METRICS_FLUSH_INTERVAL'] = '0.05'
+
+from faasit_runtime.utils import metrics
+
+requests = metrics.counter('test_requests_total', 'Requests', ('kind',))
+latency = metrics.histogram('test_latency_seconds', 'Latency', buckets=(0.1, 1))
+
+
+def fork(child) -> int:
+    pid = os.fork()
+    if pid == 0:
+        # a lock left held by a thread of the parent hangs the child
+        signal.alarm(5)
+        code = 1
+        try:
+            child()
+            code = 0
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    return status
+
+
+def sample(text: str, name: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(name + ' ') or line.startswith(name + '{'):
+            return float(line.rsplit(' ', 1)[1])
+    raise AssertionError(f"{name} not in\n{text}")
+
+
+def main():
+    directory = metrics.shared_directory(tempfile.mkdtemp(prefix='faasit-metrics-test-'))
+    threads = threading.active_count()
+    metrics.REGISTRY.share(directory)
+    # forking follows sharing in every pre-forked process (the fork server)
+    assert threading.active_count() == threads, "share started a thread"
+
+    def observe():
+        latency.observe(0.5)
+        requests.inc(kind='child')
+        assert 'test_latency_seconds_count 1' in metrics.REGISTRY.render()
+
+    # a child observes metrics of its own without sharing them
+    for _ in range(20):
+        assert fork(observe) == 0
+    print("fork after share: ok")
+
+    def shared_child():
+        metrics.REGISTRY.share(directory)
+        observe()
+        metrics.REGISTRY.start_flushing()
+        time.sleep(0.2)
+
+    # a child sharing the directory shows up in the parent's scrape
+    assert fork(shared_child) == 0
+    # not before the fork, a child writes the values it was forked with too
+    requests.inc(kind='parent')
+    text = metrics.REGISTRY.render()
+    assert sample(text, 'test_requests_total{kind="parent"}') == 1, text
+    assert sample(text, 'test_requests_total{kind="child"}') == 1, text
+    assert sample(text, 'test_latency_seconds_count') == 1, text
+    print("shared child: ok")
+
+    metrics.REGISTRY.start_flushing()
+    metrics.REGISTRY.start_flushing()
+    assert threading.active_count() == threads + 1, threading.active_count()
+    requests.inc(kind='parent')
+    time.sleep(0.2)
+    # written by the thread, not at exit
+    with open(os.path.join(directory, f'{os.getpid()}.json')) as f:
+        values = json.load(f)['metrics']['test_requests_total']['values']
+    assert [['parent'], 2] in values, values
+    print("flushing: ok")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Round trip of AliyunStorage against an OSS-compatible endpoint, small
+objects, multipart uploads and parallel ranged downloads. Point it at a
+local stand-in or a scratch bucket:
+
+    ALIBABA_CLOUD_OSS_ENDPOINT=http://127.0.0.1:9000 \\
+    ALIBABA_CLOUD_OSS_BUCKET_NAME=faasit-test \\
+    ALIBABA_CLOUD_ACCESS_KEY_ID=... ALIBABA_CLOUD_ACCESS_KEY_SECRET=... \\
+    python tests/oss/test.py [--size-mb 64] [--part-mb 8]
+"""
+import os
+import sys
+import time
+import argparse
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, root)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--part-mb', type=int, default=8)
+    args = parser.parse_args()
+
+    from faasit_runtime.runtime import aliyun_runtime
+    aliyun_runtime.oss_part_size = args.part_mb * 1024 * 1024
+    storage = aliyun_runtime.AliyunRuntime.AliyunStorage()
+    prefix = f"faasit-test-{os.getpid()}/"
+
+    assert storage.get(prefix + 'missing') is None
+    assert storage.get_stream(prefix + 'missing') is None
+
+    storage.put(prefix + 'small', {'hello': 'world'})
+    assert storage.get(prefix + 'small') == {'hello': 'world'}
+
+    data = os.urandom(args.size_mb * 1024 * 1024 + 123)
+    start = time.perf_counter()
+    storage.put(prefix + 'large', data)
+    put_s = time.perf_counter() - start
+    start = time.perf_counter()
+    assert storage.get(prefix + 'large') == data
+    get_s = time.perf_counter() - start
+
+    chunks = (data[i:i + 1000003] for i in range(0, len(data), 1000003))
+    storage.put_stream(prefix + 'stream', chunks)
+    assert b''.join(storage.get_stream(prefix + 'stream')) == data
+
+    # an object overwritten or deleted between two parts fails the read
+    for change in (lambda key: storage.put(key, b'other'), storage.delete):
+        parts = storage.get_stream(prefix + 'stream')
+        next(parts)
+        change(prefix + 'stream')
+        try:
+            b''.join(parts)
+            raise AssertionError("read a changed object")
+        except aliyun_runtime.ObjectChangedError:
+            pass
+        storage.put(prefix + 'stream', data)
+
+    for key in ('small', 'large', 'stream'):
+        storage.delete(prefix + key)
+    mb = len(data) / 1024 / 1024
+    print(f"put {mb / put_s:.1f} MB/s, get {mb / get_s:.1f} MB/s ({args.size_mb} MB, {args.part_mb} MB parts, {aliyun_runtime.oss_parallel} in parallel)")
+
+
+if __name__ == '__main__':
+    main()
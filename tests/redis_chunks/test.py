@@ -0,0 +1,123 @@
+"""
+Large values stored as segments behind a manifest key, on an in-process
+fakeredis server (pip install fakeredis lupa, lupa runs the scripts):
+
+    python tests/redis_chunks/test.py
+"""
+import os
+import sys
+import asyncio
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, root)
+os.environ['FAASIT_REDIS_CHUNK_THRESHOLD'] = '1000'
+os.environ['FAASIT_REDIS_CHUNK_SIZE'] = '300'
+
+import redis
+import fakeredis
+import fakeredis.aioredis
+
+from faasit_runtime.storage import RedisDB, redis_chunks, redis_conn
+from faasit_runtime.storage.redis_conn import RedisConfig
+
+server = fakeredis.FakeServer()
+config = RedisConfig()
+client = fakeredis.FakeRedis(server=server)
+redis_conn._clients[config] = client
+
+BIG = os.urandom(5000)
+
+
+def segments() -> list[bytes]:
+    return sorted(key for key in client.keys() if key.startswith(redis_chunks.CHUNK_KEY_PREFIX.encode()))
+
+
+def round_trip():
+    db = RedisDB(config=config)
+    assert db.set('big', BIG)
+    # 5000 bytes in 300 byte segments, the key holds the manifest
+    assert len(segments()) == 17, segments()
+    assert len(client.get('big')) == redis_chunks.MANIFEST_LEN
+    assert db.get('big') == BIG
+    assert db.mget(['big', 'missing']) == [BIG, None]
+    with db.pipeline() as pipe:
+        pipe.set('big2', BIG).get('big2')
+    assert pipe.results == [True, BIG], pipe.results
+    assert db.delete('big2') and len(segments()) == 17
+    print("round trip: ok")
+
+
+def overwrite():
+    db = RedisDB(config=config)
+    assert db.set('big', BIG)
+    assert db.set('big', 'small')
+    assert db.get('big') == 'small'
+    # the segments of the replaced value are gone
+    assert segments() == [], segments()
+    assert db.set('big', BIG) and db.set('big', BIG[::-1])
+    assert db.get('big') == BIG[::-1] and len(segments()) == 17
+    assert db.mset({'big': 1}) and segments() == []
+    print("overwrite: ok")
+
+
+def scan():
+    db = RedisDB(config=config)
+    for i in range(3):
+        db.set(f'scan/{i}', BIG)
+    db.set('scan/small', 1)
+    assert segments()
+    assert sorted(set(db.scan('scan/'))) == ['scan/0', 'scan/1', 'scan/2', 'scan/small']
+    assert not any(redis_chunks.is_segment_key(key) for key in db.scan())
+    assert db.mdelete(db.scan('scan/')) == 4 and segments() == []
+    print("scan: ok")
+
+
+def async_round_trip():
+    async def main():
+        aclient = fakeredis.aioredis.FakeRedis(server=server)
+        redis_conn._async_clients.setdefault(asyncio.get_running_loop(), {})[config] = aclient
+        db = RedisDB(config=config).as_async()
+        assert await db.set('abig', BIG)
+        assert await db.get('abig') == BIG
+        assert await db.set('abig', 'small') and segments() == []
+        await aclient.aclose()
+    asyncio.run(main())
+    print("async round trip: ok")
+
+
+class RefusingRedis(fakeredis.FakeRedis):
+    # a server whose ACLs deny scripting
+    def script_load(self, script):
+        raise redis.exceptions.NoPermissionError("NOPERM this user has no permissions to run the 'script|load' command")
+
+
+def refused():
+    refusing = RefusingRedis(server=server)
+    refusing_config = config._replace(port=config.port + 1)
+    redis_conn._clients[refusing_config] = refusing
+    db = RedisDB(config=refusing_config)
+    # refused in this call, its segments were written and it is sent again
+    # with the manifest set by MSET
+    assert db.set('chunked', BIG) and db.get('chunked') == BIG
+    assert len(segments()) == 17 and not redis_chunks.chunking()
+    # large values are stored whole, everything else goes on working
+    assert db.set('plain', BIG) and len(client.get('plain')) > len(BIG) and len(segments()) == 17
+    assert db.get('plain') == BIG
+    with db.pipeline() as pipe:
+        pipe.set('plain', 1).get('plain').delete('plain').delete('plain')
+    assert pipe.results == [True, 1, True, False], pipe.results
+    assert db.mset({'a': 1, 'b': 2}) and db.mdelete(['a', 'b', 'c']) == 2
+    print("scripts refused: ok")
+
+
+def main():
+    round_trip()
+    overwrite()
+    scan()
+    async_round_trip()
+    # last, the fallback turns chunking off for the process
+    refused()
+
+
+if __name__ == '__main__':
+    main()
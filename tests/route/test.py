@@ -0,0 +1,51 @@
+"""
+Dispatch through the route table of a local-once runtime, to a function
+and to a workflow registered in the same process:
+
+    python tests/route/test.py
+"""
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, root)
+os.environ['FAASIT_PROVIDER'] = 'local-once'
+
+from faasit_runtime import function, workflow, create_handler, routeBuilder
+from faasit_runtime.runtime import FaasitRuntime
+from faasit_runtime.workflow import Workflow
+
+
+@function
+def double(frt: FaasitRuntime):
+    return frt.output({'value': frt.input()['value'] * 2})
+
+
+@workflow
+def quadruple(wf: Workflow):
+    _in = wf.input()
+    twice = wf.call('double', {'value': _in['value']})
+    return wf.call('double', {'value': twice['value']})
+
+
+@function
+def caller(frt: FaasitRuntime):
+    value = frt.input()['value']
+    return frt.output({
+        'function': frt.call('double', {'value': value}),
+        'workflow': frt.call('quadruple', {'value': value}),
+    })
+
+
+def main():
+    table = routeBuilder.build().table
+    assert sorted(table) == ['caller', 'double', 'quadruple'], sorted(table)
+    assert table['double']({'value': 2}) == {'value': 4}
+    assert table['quadruple']({'value': 2}) == {'value': 8}
+    result = create_handler(caller)({'value': 3})
+    assert result == {'function': {'value': 6}, 'workflow': {'value': 12}}, result
+    print("ok")
+
+
+if __name__ == '__main__':
+    main()
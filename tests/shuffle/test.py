@@ -0,0 +1,153 @@
+"""
+Shuffles over the storage of a local-once runtime, in a temporary
+directory, with map and reduce tasks in threads of one process:
+
+    python tests/shuffle/test.py
+"""
+import os
+import sys
+import time
+import operator
+import tempfile
+import threading
+from collections import Counter
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, root)
+os.environ['FAASIT_PROVIDER'] = 'local-once'
+os.environ['LOCAL_STORAGE_DIR'] = tempfile.mkdtemp(prefix='faasit-shuffle-test-')
+
+from faasit_runtime.runtime.local_once_runtime import LocalOnceRuntime
+from faasit_runtime.serverless_function import Metadata
+from faasit_runtime.shuffle import partition_of
+
+NUM_PARTITIONS = 4
+TEXTS = [
+    "the quick brown fox jumps over the lazy dog",
+    "the dog sleeps and the fox runs",
+    "a lazy afternoon for a quick fox",
+]
+WORDS = Counter(word for text in TEXTS for word in text.split())
+
+
+def runtime() -> LocalOnceRuntime:
+    return LocalOnceRuntime(Metadata('test', {}, 'default', {}, 'invoke', None))
+
+
+def map_task(name: str, map_id: int, close: bool = True, **options):
+    out = runtime().shuffle(name, NUM_PARTITIONS, map_id=map_id, **options)
+    out.scatter((word, 1) for word in TEXTS[map_id].split())
+    if close:
+        out.close()
+    return out
+
+
+def reduce_all(name: str, **options) -> list[list[tuple]]:
+    shuffle = runtime().shuffle(name, NUM_PARTITIONS, **options)
+    return [list(shuffle.read(p)) for p in range(NUM_PARTITIONS)]
+
+
+def combine():
+    for i in range(len(TEXTS)):
+        map_task('combine', i, combine=operator.add)
+    partitions = reduce_all('combine', num_maps=len(TEXTS), combine=operator.add)
+    for p, records in enumerate(partitions):
+        assert all(partition_of(key, NUM_PARTITIONS) == p for key, _ in records), records
+    counts = [record for records in partitions for record in records]
+    assert dict(counts) == WORDS and len(counts) == len(WORDS), counts
+    print("combine: ok")
+
+
+def sort():
+    for i in range(len(TEXTS)):
+        map_task('sort', i, sort=True, combine=operator.add)
+        map_task('sort-raw', i, sort=True)
+    combined = reduce_all('sort', num_maps=len(TEXTS), sort=True, combine=operator.add)
+    raw = reduce_all('sort-raw', num_maps=len(TEXTS), sort=True)
+    for records, raw_records in zip(combined, raw):
+        keys = [key for key, _ in records]
+        assert keys == sorted(set(keys)), keys
+        assert all(count == WORDS[key] for key, count in records), records
+        # without combine every record is kept, in key order
+        assert [key for key, _ in raw_records] == sorted(key for key, _ in raw_records), raw_records
+        assert Counter(key for key, _ in raw_records) == dict(records), raw_records
+    print("sort: ok")
+
+
+def flushes():
+    # a run per partition every 3 buffered records and on close
+    out = map_task('flushes', 0, buffer_records=3)
+    runs = [run for partition in out._runs for run in partition]
+    assert len(set(run.rsplit('-', 1)[1] for run in runs)) > 1, runs
+    assert sorted(runtime().storage.list('flushes/_commit/')) == ['flushes/_commit/0']
+    for i in range(1, len(TEXTS)):
+        map_task('flushes', i, buffer_records=3)
+    partitions = reduce_all('flushes', num_maps=len(TEXTS), combine=operator.add)
+    assert dict(record for records in partitions for record in records) == WORDS
+    print("flushes: ok")
+
+
+def wait():
+    # reducers started before the maps wait for their commits
+    results = {}
+    def reduce():
+        results['records'] = reduce_all('wait', num_maps=len(TEXTS), combine=operator.add, timeout=10)
+    reducer = threading.Thread(target=reduce)
+    reducer.start()
+    time.sleep(0.2)
+    assert reducer.is_alive()
+    for i in range(len(TEXTS)):
+        map_task('wait', i, combine=operator.add)
+    reducer.join(10)
+    assert not reducer.is_alive()
+    assert dict(record for records in results['records'] for record in records) == WORDS
+
+    # a map task that never commits
+    map_task('wait-missing', 0)
+    started = time.monotonic()
+    try:
+        reduce_all('wait-missing', num_maps=2, timeout=0.3)
+        raise AssertionError("read did not time out")
+    except TimeoutError:
+        pass
+    assert 0.3 <= time.monotonic() - started < 5, time.monotonic() - started
+    print("wait: ok")
+
+
+def listing():
+    # without num_maps the committed map tasks are read, a flushed but not
+    # committed one is left out
+    map_task('listing', 0, combine=operator.add)
+    map_task('listing', 1, combine=operator.add)
+    uncommitted = map_task('listing', 2, close=False, combine=operator.add)
+    uncommitted.flush()
+    assert len(list(runtime().storage.list('listing/_commit/'))) == 2
+    partitions = reduce_all('listing', combine=operator.add)
+    expected = Counter(word for text in TEXTS[:2] for word in text.split())
+    assert dict(record for records in partitions for record in records) == expected
+    print("listing: ok")
+
+
+def delete():
+    for i in range(len(TEXTS)):
+        map_task('delete', i)
+    map_task('kept', 0)
+    assert list(runtime().storage.list('delete/'))
+    runtime().shuffle('delete', NUM_PARTITIONS).delete()
+    assert list(runtime().storage.list('delete/')) == []
+    assert list(runtime().storage.list('kept/'))
+    assert reduce_all('delete') == [[] for _ in range(NUM_PARTITIONS)]
+    print("delete: ok")
+
+
+def main():
+    combine()
+    sort()
+    flushes()
+    wait()
+    listing()
+    delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Local start-up latency of a function, three ways:
+  cold     a new interpreter imports index.py and calls the handler
+  fork     a fork server that already imported index.py, one process per call
+  restore  criu restores a process dumped after the import (needs root and criu)
+
+    python tests/snapshot/bench.py [--runs 10]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(os.path.dirname(here))
+sys.path.insert(0, root)
+sys.path.insert(0, here)
+
+env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, here, os.environ.get('PYTHONPATH', '')]))
+
+
+def bench_cold(runs):
+    code = "from index import handler; handler({'x': 1})"
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], env=env, check=True)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_fork(runs):
+    from faasit_runtime.forkserver import ForkServer
+    from index import handler
+    server = ForkServer(handler, pool_size=1, per_request=True)
+    server.start()
+    samples = []
+    try:
+        server.invoke({'x': 1})
+        for _ in range(runs):
+            start = time.perf_counter()
+            server.invoke({'x': 1})
+            samples.append(time.perf_counter() - start)
+    finally:
+        server.close()
+    return samples
+
+
+def bench_restore(runs):
+    if shutil.which('criu') is None:
+        return None
+    from faasit_runtime.start import dump, SnapshotClient
+    from index import handler
+    samples = []
+    snapshot_dir = tempfile.mkdtemp()
+    try:
+        if dump(handler, snapshot_dir) != 0:
+            return None
+        client = SnapshotClient(snapshot_dir)
+        for _ in range(runs):
+            start = time.perf_counter()
+            client.restore()
+            client.invoke({'params': {'x': 1}})
+            samples.append(time.perf_counter() - start)
+            client.close()
+    finally:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='start-up latency benchmark')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    print(f"{'mode':<10}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for name, bench in (('cold', bench_cold), ('fork', bench_fork), ('restore', bench_restore)):
+        samples = bench(args.runs)
+        if not samples:
+            print(f"{name:<10}{'skipped':>12}")
+            continue
+        ms = [s * 1000 for s in samples]
+        print(f"{name:<10}{statistics.median(ms):>12.2f}{min(ms):>10.2f}{max(ms):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
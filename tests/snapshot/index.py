@@ -0,0 +1,8 @@
+import faasit_runtime
+
+# stands in for a function whose module is expensive to import
+table = {i: str(i) * 8 for i in range(200000)}
+
+
+def handler(params):
+    return {'size': len(table), 'echo': params}